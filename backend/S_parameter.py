@@ -1,13 +1,18 @@
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import figure, subplots, savefig
-import skrf as rf
-from skrf import Network
-from collections import Counter
+from collections import Counter, OrderedDict
 import logging
 import os
+import threading
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit, parse_value
+from touchstone import load_touchstone
+from lazy_imports import LazyModule, lazy_pyplot
+from metrics import timed, stage
+from nport import NodalConnection, s_to_y
+
+# Imported on first use so loading this module does not cost the scikit-rf import
+rf = LazyModule('skrf')
+plt = lazy_pyplot()
 
 # Configure logging
 logging.basicConfig(
@@ -22,46 +27,206 @@ def _static_dir(path_segment: str = ""):
     os.makedirs(base_dir, exist_ok=True)
     return os.path.join(base_dir, path_segment) if path_segment else base_dir
 
-UNIT_SCALE = {'f': 1e-15, 'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'm': 1e-3, 'k': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+def theta_in_rad(theta):
+    return float(theta)*np.pi/180
 
+MAX_CACHED_LINES = 256
+_line_cache = OrderedDict()
+_line_cache_lock = threading.Lock()
 
-def parse_value(v, unit):
-    if unit is None: return float(v)
-    for k, s in UNIT_SCALE.items():
-        if unit.startswith(k):
-            return float(v) * s
-    return float(v)
+def line_abcd(Zc, theta, f0, f):
+    """
+    ABCD matrices (nfreqs, 2, 2) of a lossless line with characteristic impedance
+    Zc and electrical length theta (radian) at f0, over the frequency array f
+    (same unit as f0). Results are cached per (Zc, theta, f0, frequency grid)
+    and returned read-only.
+    """
+    f = np.asarray(f, dtype=float)
+    key = (float(Zc), float(theta), float(f0), f.tobytes())
+    with _line_cache_lock:
+        abcd = _line_cache.get(key)
+        if abcd is not None:
+            _line_cache.move_to_end(key)
+            return abcd
 
-def theta_in_rad(theta):
-    return float(theta)*np.pi/180
+    theta_f = theta * f / f0
+    cos, sin = np.cos(theta_f), np.sin(theta_f)
+    abcd = np.empty((len(f), 2, 2), dtype=complex)
+    abcd[:, 0, 0] = cos
+    abcd[:, 0, 1] = 1j * Zc * sin
+    abcd[:, 1, 0] = 1j * sin / Zc
+    abcd[:, 1, 1] = cos
+    abcd.setflags(write=False)
+    with _line_cache_lock:
+        _line_cache[key] = abcd
+        while len(_line_cache) > MAX_CACHED_LINES:
+            _line_cache.popitem(last=False)
+    return abcd
+
+def stub_admittance(Zc, theta, f0, f, termination):
+    """Input admittance of an 'open' (C/A) or 'short' (D/B) terminated stub for every frequency."""
+    abcd = line_abcd(Zc, theta, f0, f)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if termination == 'open':
+            return abcd[:, 1, 0] / abcd[:, 0, 0]
+        return abcd[:, 1, 1] / abcd[:, 0, 1]
+
+def abcd_to_y(abcd):
+    """Admittance matrices of two-port ABCD matrices (infinite where B is zero)."""
+    A, B, C, D = abcd[:, 0, 0], abcd[:, 0, 1], abcd[:, 1, 0], abcd[:, 1, 1]
+    y = np.empty_like(abcd, dtype=complex)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y[:, 0, 0] = D / B
+        y[:, 0, 1] = (B * C - A * D) / B
+        y[:, 1, 0] = -1 / B
+        y[:, 1, 1] = A / B
+    return y
 
 def Transmission_Line(Zc,theta,f0,f,Z0,name):
     #theta in radian
-    abcd=np.zeros([len(f),2,2],dtype=complex)
-    Yc=1/Zc
-    theta=theta*f.f/f0
-    abcd[:,0,0]=np.cos(theta)
-    abcd[:,1,1]=np.cos(theta)
-    abcd[:,1,0]=1j*Yc*np.sin(theta)
-    abcd[:, 0, 1] = 1j*Zc * np.sin(theta)
-    s=rf.network.a2s(abcd,Z0)
+    s=rf.network.a2s(np.array(line_abcd(Zc, theta, f0, f.f)),Z0)
     TL=rf.Network(s=s,frequency=f,name=name)
     return TL
 
 def Open_Stub(Zc,theta,f0,f,Z0,name):
     #theta in radian
-    TL = Transmission_Line(Zc,theta,f0,f,Z0,name)
-    Zopen=TL.z[:,0,0]
+    with np.errstate(divide='ignore'):
+        Zopen = 1 / stub_admittance(Zc, theta, f0, f.f, 'open')
     Openstub = rf.Network(z=Zopen, frequency=f, name=name)
     return Openstub
 
 def Short_Stub(Zc,theta,f0,f,Z0,name):
     #theta in radian
-    TL = Transmission_Line(Zc,theta,f0,f,Z0,name)
-    Yshort=TL.y[:,0,0]
+    Yshort = stub_admittance(Zc, theta, f0, f.f, 'short')
     Shortstub =  rf.Network(y=Yshort, frequency=f, name=name)
     return Shortstub
 
+# Element kinds stamped as one two-terminal admittance, and the shunt stubs by termination
+TWO_TERMINAL = ('W', 'R', 'C', 'L')
+STUBS = {'O': 'open', 'S': 'short'}
+# Resistance (ohm) standing in for an ideal wire
+WIRE_RESISTANCE = 1e-6
+
+class ConnectionGraph:
+    """
+    Topology of an S-parameter netlist, built in one pass over the elements:
+    the node-to-element-port index (the connection list of scikit-rf's
+    Circuit), the grounded nodes, the port order and the compiled nodal stamp
+    pattern of every element group. It depends only on element names, kinds
+    and nodes, so connection_graph() caches it and requests that only change
+    values or the frequency grid refill the admittance arrays.
+    """
+
+    def __init__(self, elements, node):
+        self.node = list(node)
+        self.adjacency = {n: [] for n in self.node}
+        for name, element in elements.items():
+            nodes = element['nodes']
+            for k, n in enumerate(nodes):
+                # A two-terminal element with both ends on one node connects there once
+                if len(nodes) > 2 or n not in nodes[:k]:
+                    self.adjacency[n].append((name, k))
+
+        grounded = {e['nodes'][0] for e in elements.values() if e['prefix'] == 'G'}
+        self.index = {}
+        for n in self.node:
+            if n not in grounded:
+                self.index[n] = len(self.index)
+        size = len(self.index)
+        self.index.update(dict.fromkeys(grounded, -1))
+
+        # Ports ordered like scikit-rf's Circuit orders them: by node, then by element
+        position = {n: i for i, n in enumerate(self.node)}
+        self.ports = [name for *_, name in sorted(
+            (position[e['nodes'][0]], i, name) for i, (name, e) in enumerate(elements.items())
+            if e['prefix'] == 'P')]
+
+        groups = {}
+        for name, element in elements.items():
+            prefix = element['prefix']
+            if prefix not in ('P', 'G'):
+                key = ('X', len(element['nodes'])) if prefix == 'X' else prefix
+                groups.setdefault(key, []).append(name)
+        self.nodal = NodalConnection(size)
+        self.groups = list(groups.items())
+        for key, names in self.groups:
+            nodes = np.array([[self.index[n] for n in elements[name]['nodes']] for name in names])
+            if key in TWO_TERMINAL:
+                self.nodal.add_admittances(nodes[:, 0], nodes[:, 1])
+            elif key in STUBS:
+                self.nodal.add_admittances(nodes[:, 0], np.full(len(names), -1))
+            else:
+                self.nodal.add_blocks(nodes)
+        for name in self.ports:
+            self.nodal.add_port(self.index[elements[name]['nodes'][0]])
+        self.nodal.compile()
+        logger.info(f"Connection graph: {len(self.node)} nodes, {len(elements)} elements, "
+                    f"{len(self.ports)} ports")
+
+    def admittances(self, elements, f):
+        """Admittances of every element group over the frequencies f (Hz), in stamp order."""
+        omega = 2 * np.pi * f[:, None]
+        values = []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for key, names in self.groups:
+                group = [elements[name] for name in names]
+                if key == 'W':
+                    y = np.full((len(f), len(names)), 1 / WIRE_RESISTANCE)
+                elif key in ('R', 'C', 'L'):
+                    value = np.array([e['value'] for e in group], dtype=float)
+                    if key == 'R':
+                        y = np.broadcast_to(1 / value, (len(f), len(names)))
+                    elif key == 'C':
+                        y = 1j * omega * value
+                    else:
+                        y = 1 / (1j * omega * value)
+                elif key == 'T':
+                    y = np.stack([abcd_to_y(line_abcd(e['Zc'], e['theta'], e['f0'], f)) for e in group], axis=1)
+                elif key in STUBS:
+                    y = np.stack([stub_admittance(e['Zc'], e['theta'], e['f0'], f, STUBS[key])
+                                  for e in group], axis=1)
+                else:
+                    y = np.stack([s_to_y(e['s'], e['z0']) for e in group], axis=1)
+                values.append(y)
+        return values
+
+    def s_parameters(self, elements, f):
+        """S-parameters and port impedances of the elements over the frequencies f (Hz)."""
+        z0 = np.array([elements[name]['value'] for name in self.ports], dtype=float)
+        return self.nodal.solve(self.admittances(elements, f), z0), z0
+
+    def connection(self, networks):
+        """scikit-rf Circuit connection list: the (network, port) pairs on every node."""
+        return [[(networks[name], k) for name, k in self.adjacency[n]] for n in self.node]
+
+
+MAX_CACHED_GRAPHS = int(os.getenv('CONNECTION_GRAPH_ENTRIES', 64))
+_graph_cache = OrderedDict()
+_graph_cache_lock = threading.Lock()
+
+def connection_graph(elements, node):
+    """The ConnectionGraph of the elements, cached by topology (names, kinds and nodes only)."""
+    key = (tuple((name, e['prefix'], e['nodes']) for name, e in elements.items()), tuple(node))
+    with _graph_cache_lock:
+        graph = _graph_cache.get(key)
+        if graph is not None:
+            _graph_cache.move_to_end(key)
+            return graph
+    graph = ConnectionGraph(elements, node)
+    with _graph_cache_lock:
+        _graph_cache[key] = graph
+        while len(_graph_cache) > MAX_CACHED_GRAPHS:
+            _graph_cache.popitem(last=False)
+    return graph
+
+def graph_cache_info():
+    with _graph_cache_lock:
+        return {'graphs': len(_graph_cache), 'max_graphs': MAX_CACHED_GRAPHS}
+
+def clear_graph_cache():
+    with _graph_cache_lock:
+        _graph_cache.clear()
+
 class run_s_parameter:
     """A corrected tool to analyze circuits from netlist files and return S-parameters"""
     
@@ -74,37 +239,7 @@ class run_s_parameter:
     
     def convert_value_to_number(self, value_text):
         """Convert component values like '1k', '10n', '5.6m' to actual numbers"""
-        value_text = value_text.lower().replace(' ', '')
-        
-        if 'e' in value_text:
-            return float(value_text)
-        
-        units = {
-            'k': 1000,
-            'm': 0.001,
-            'u': 0.000001,
-            'n': 0.000000001,
-            'p': 0.000000000001,
-            'f': 0.000000000000001
-        }
-        
-        number_part = ''
-        unit_part = ''
-        
-        for char in value_text:
-            if char.isdigit() or char == '.' or char == '-':
-                number_part += char
-            else:
-                unit_part += char
-                break
-        
-        base_value = float(number_part)
-        
-        for unit_name, multiplier in units.items():
-            if unit_part.startswith(unit_name):
-                return base_value * multiplier
-        
-        return base_value
+        return parse_value(value_text.replace(' ', ''))
     
     def create_wire_network(self, frequency_range):
         """Create a wire network (zero resistance, ideal connection)"""
@@ -141,17 +276,10 @@ class run_s_parameter:
         frequency_range: skrf Frequency object
         f_ref: reference frequency in GHz for given electrical length
         """
-        # Convert GHz to Hz for calculation
-        f_ref_hz = f_ref * 1e9
-        theta_deg = electrical_length_deg_ref * (frequency_range.f / f_ref_hz)
-        # Build network at each frequency
-        media = rf.media.DefinedGammaZ0(frequency=frequency_range, z0=self.z0_system, gamma=1j)
-        # Use skrf's 'line' for the full frequency array
-        transmission_line = media.line(electrical_length_deg_ref, unit='deg')
-        # Override theta per frequency
-        transmission_line.s = np.array([
-            media.line(theta, unit='deg').s[0, :, :] for theta in theta_deg
-        ])
+        # All frequencies at once; theta scales linearly from the reference frequency (GHz -> Hz)
+        abcd = line_abcd(impedance, theta_in_rad(electrical_length_deg_ref), f_ref * 1e9, frequency_range.f)
+        z0_array = rf.fix_z0_shape(self.z0_system, len(frequency_range.f), 2)
+        transmission_line = rf.Network(frequency=frequency_range, a=np.array(abcd), z0=z0_array)
         logger.info(f"Created transmission line (freq-dependent): {electrical_length_deg_ref}° @ {f_ref}GHz, {impedance}Ω")
         return transmission_line
 
@@ -161,23 +289,9 @@ class run_s_parameter:
         """
         Create a frequency-dependent short stub network as 2-port shunt.
         """
-        f_ref_hz = f_ref * 1e9
-        theta_deg = electrical_length_deg_ref * (frequency_range.f / f_ref_hz)
-        
-        media = rf.media.DefinedGammaZ0(frequency=frequency_range, z0=self.z0_system, gamma=1j)
-        # Build 1-port shorted stub
-        short_termination = media.short()
-        stub_line = media.line(electrical_length_deg_ref, unit='deg')
-        short_stub_1port = stub_line ** short_termination
-        
-        # Override per-frequency theta
-        s_array = np.array([
-            (media.line(theta, unit='deg') ** media.short()).s[0,:,:] for theta in theta_deg
-        ])
-        short_stub_1port.s = s_array
-        
-        # Convert 1-port to 2-port shunt
-        short_stub_2port = self.convert_1port_to_2port_shunt(short_stub_1port, frequency_range, impedance)
+        Y_stub = stub_admittance(impedance, theta_in_rad(electrical_length_deg_ref), f_ref * 1e9,
+                                 frequency_range.f, 'short')
+        short_stub_2port = self.shunt_admittance_network(Y_stub, frequency_range)
         logger.info(f"Created short stub (freq-dependent) {electrical_length_deg_ref}° @ {f_ref}GHz, {impedance}Ω")
         return short_stub_2port
 
@@ -186,21 +300,9 @@ class run_s_parameter:
         """
         Create a frequency-dependent open stub network as 2-port shunt.
         """
-        f_ref_hz = f_ref * 1e9
-        theta_deg = electrical_length_deg_ref * (frequency_range.f / f_ref_hz)
-        
-        media = rf.media.DefinedGammaZ0(frequency=frequency_range, z0=self.z0_system, gamma=1j)
-        open_termination = media.open()
-        stub_line = media.line(electrical_length_deg_ref, unit='deg')
-        open_stub_1port = stub_line ** open_termination
-        
-        # Override per-frequency theta
-        s_array = np.array([
-            (media.line(theta, unit='deg') ** media.open()).s[0,:,:] for theta in theta_deg
-        ])
-        open_stub_1port.s = s_array
-        
-        open_stub_2port = self.convert_1port_to_2port_shunt(open_stub_1port, frequency_range, impedance)
+        Y_stub = stub_admittance(impedance, theta_in_rad(electrical_length_deg_ref), f_ref * 1e9,
+                                 frequency_range.f, 'open')
+        open_stub_2port = self.shunt_admittance_network(Y_stub, frequency_range)
         logger.info(f"Created open stub (freq-dependent) {electrical_length_deg_ref}° @ {f_ref}GHz, {impedance}Ω")
         return open_stub_2port
 
@@ -217,7 +319,10 @@ class run_s_parameter:
         else:
             Z_shunt = one_port_network.z[:, 0, 0]
         
-        Y_shunt = 1.0 / Z_shunt
+        return self.shunt_admittance_network(1.0 / Z_shunt, frequency_range)
+
+    def shunt_admittance_network(self, Y_shunt, frequency_range):
+        """2-port network of a shunt admittance array (one value per frequency)"""
         nfreqs = len(frequency_range.f)
         
         # ABCD matrix for shunt element: [[1, 0], [Y, 1]]
@@ -249,131 +354,66 @@ class run_s_parameter:
         """Check if a node is ground (explicit '0' or implicit dangling node)"""
         return node == '0' or node in self.implicit_ground_nodes
     
-    def read_and_parse_netlist(self, filename):
-        """Read a netlist file and extract component information"""
+    def read_and_parse_netlist(self, filename='netlist.txt', netlist=None):
+        """Read a netlist (string, parsed object or file) and extract component information"""
         try:
-            with open(filename, 'r') as file:
-                netlist_lines = file.readlines()
-            logger.info(f"Successfully read netlist from {filename}")
+            circuit = parse_circuit(load_netlist(netlist, filename))
         except FileNotFoundError:
             logger.error(f"Could not find file: {filename}")
             return None
         
+        lumped = {'R': ('resistor', 'Ω'), 'C': ('capacitor', 'F'), 'L': ('inductor', 'H')}
+        distributed = {'TL': 'transmission_line', 'OS': 'open_stub', 'SS': 'short_stub'}
         components = {}
         
-        for line_number, line in enumerate(netlist_lines, 1):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
+        for i, component_name in enumerate(circuit.names):
+            component_type = circuit.kinds[i]
+            nodes = tuple(circuit.element_nodes(i)[:2])
+            params = circuit.params[i]
+            line_number = circuit.lines[i]
             
-            parts = line.split()
-            if len(parts) < 3:
-                logger.warning(f"Line {line_number}: Not enough information - {line}")
-                continue
+            if component_type == 'W':
+                components[component_name] = {
+                    'type': 'wire',
+                    'nodes': nodes,
+                    'value': 1e-6,  # 1 micro-ohm
+                    'unit': 'Ω'
+                }
+                logger.info(f"Found wire {component_name}: ideal connection")
             
-            component_name = parts[0]
-            node1 = parts[1]
-            node2 = parts[2]
-            component_type = component_name[0].upper()
+            elif component_type in lumped:
+                kind, unit = lumped[component_type]
+                if not params:
+                    logger.warning(f"Line {line_number}: {kind.capitalize()} needs value - {component_name}")
+                    continue
+                value = circuit.values[i]
+                if np.isnan(value):
+                    logger.error(f"Error parsing {component_name} on line {line_number}: "
+                                 f"Invalid numeric value: {params[0]}")
+                    continue
+                components[component_name] = {'type': kind, 'nodes': nodes, 'value': float(value), 'unit': unit}
+                logger.info(f"Found {kind} {component_name}: {value} {unit}")
             
-            try:
-                # Handle Wire component
-                if component_type == 'W':
-                    components[component_name] = {
-                        'type': 'wire',
-                        'nodes': (node1, node2),
-                        'value': 1e-6,  # 1 micro-ohm
-                        'unit': 'Ω'
-                    }
-                    logger.info(f"Found wire {component_name}: ideal connection")
-                
-                elif component_type == 'R':
-                    if len(parts) < 4:
-                        logger.warning(f"Line {line_number}: Resistor needs value - {line}")
-                        continue
-                    resistance = self.convert_value_to_number(parts[3])
-                    components[component_name] = {
-                        'type': 'resistor',
-                        'nodes': (node1, node2),
-                        'value': resistance,
-                        'unit': 'Ω'
-                    }
-                    logger.info(f"Found resistor {component_name}: {resistance} Ω")
-                
-                elif component_type == 'C':
-                    if len(parts) < 4:
-                        logger.warning(f"Line {line_number}: Capacitor needs value - {line}")
-                        continue
-                    capacitance = self.convert_value_to_number(parts[3])
-                    components[component_name] = {
-                        'type': 'capacitor',
-                        'nodes': (node1, node2),
-                        'value': capacitance,
-                        'unit': 'F'
-                    }
-                    logger.info(f"Found capacitor {component_name}: {capacitance} F")
-                
-                elif component_type == 'L':
-                    if len(parts) < 4:
-                        logger.warning(f"Line {line_number}: Inductor needs value - {line}")
-                        continue
-                    inductance = self.convert_value_to_number(parts[3])
-                    components[component_name] = {
-                        'type': 'inductor',
-                        'nodes': (node1, node2),
-                        'value': inductance,
-                        'unit': 'H'
-                    }
-                    logger.info(f"Found inductor {component_name}: {inductance} H")
-                
-                elif component_name.startswith('TL'):
-                    if len(parts) < 4:
-                        logger.warning(f"Line {line_number}: Transmission line needs parameters - {line}")
-                        continue
-                    electrical_length = self.convert_value_to_number(parts[3])
-                    impedance = self.convert_value_to_number(parts[4]) if len(parts) > 4 else 50.0
-                    components[component_name] = {
-                        'type': 'transmission_line',
-                        'nodes': (node1, node2),
-                        'electrical_length': electrical_length,
-                        'impedance': impedance,
-                        'unit': '°'
-                    }
-                    logger.info(f"Found transmission line {component_name}: {electrical_length}°, {impedance}Ω")
-                
-                elif component_name.startswith('OS'):
-                    if len(parts) < 4:
-                        logger.warning(f"Line {line_number}: Open stub needs parameters - {line}")
-                        continue
-                    electrical_length = self.convert_value_to_number(parts[3])
-                    impedance = self.convert_value_to_number(parts[4]) if len(parts) > 4 else 50.0
-                    components[component_name] = {
-                        'type': 'open_stub',
-                        'nodes': (node1, node2),
-                        'electrical_length': electrical_length,
-                        'impedance': impedance,
-                        'unit': '°'
-                    }
-                    logger.info(f"Found open stub {component_name}: {electrical_length}°, {impedance}Ω")
-                
-                elif component_name.startswith('SS'):
-                    if len(parts) < 4:
-                        logger.warning(f"Line {line_number}: Short stub needs parameters - {line}")
-                        continue
-                    electrical_length = self.convert_value_to_number(parts[3])
-                    impedance = self.convert_value_to_number(parts[4]) if len(parts) > 4 else 50.0
-                    components[component_name] = {
-                        'type': 'short_stub',
-                        'nodes': (node1, node2),
-                        'electrical_length': electrical_length,
-                        'impedance': impedance,
-                        'unit': '°'
-                    }
-                    logger.info(f"Found short stub {component_name}: {electrical_length}°, {impedance}Ω")
-                
-            except ValueError as error:
-                logger.error(f"Error parsing {component_name} on line {line_number}: {error}")
-                continue
+            elif component_type in distributed:
+                kind = distributed[component_type]
+                if not params:
+                    logger.warning(f"Line {line_number}: {kind.replace('_', ' ').capitalize()} needs parameters "
+                                   f"- {component_name}")
+                    continue
+                try:
+                    electrical_length = parse_value(params[0])
+                    impedance = parse_value(params[1]) if len(params) > 1 else 50.0
+                except ValueError as error:
+                    logger.error(f"Error parsing {component_name} on line {line_number}: {error}")
+                    continue
+                components[component_name] = {
+                    'type': kind,
+                    'nodes': nodes,
+                    'electrical_length': electrical_length,
+                    'impedance': impedance,
+                    'unit': '°'
+                }
+                logger.info(f"Found {kind.replace('_', ' ')} {component_name}: {electrical_length}°, {impedance}Ω")
         
         self.circuit_components = components
         self.detect_implicit_ground_nodes()
@@ -429,124 +469,46 @@ class run_s_parameter:
         self.component_networks = networks
         return networks
     
-    def build_circuit_topology(self, networks):
-        """CORRECTED: Build proper circuit topology with series and shunt placement"""
-        # Separate series and shunt components
-        series_components = []
-        shunt_components = []
-        
-        for name, component in self.circuit_components.items():
-            if name not in networks:
-                continue
-                
-            nodes = component['nodes']
-            if self.is_ground_node(nodes[1]) or self.is_ground_node(nodes[0]):
-                # Find the non-ground node for shunt placement
-                shunt_node = nodes[0] if not self.is_ground_node(nodes[0]) else nodes[1]
-                shunt_components.append({
-                    'name': name,
-                    'network': networks[name],
-                    'node': shunt_node,
-                    'component': component
-                })
-                logger.info(f"{name} identified as SHUNT at node {shunt_node}")
-            else:
-                series_components.append({
-                    'name': name,
-                    'network': networks[name],
-                    'nodes': nodes,
-                    'component': component
-                })
-                logger.info(f"{name} identified as SERIES from {nodes[0]} to {nodes[1]}")
-        
-        # Sort series components by node order for proper cascade
-        series_components.sort(key=lambda x: (
-            int(x['nodes'][0]) if x['nodes'][0].isdigit() else float('inf'),
-            int(x['nodes'][1]) if x['nodes'][1].isdigit() else float('inf')
-        ))
-        
-        # Sort shunt components by node for proper insertion
-        shunt_components.sort(key=lambda x: int(x['node']) if x['node'].isdigit() else float('inf'))
-        
-        return series_components, shunt_components
-    
-    def cascade_networks_properly(self, series_components, shunt_components, frequency_range):
-        """CORRECTED: Properly cascade series elements and insert shunts at correct locations"""
-        nfreqs = frequency_range.npoints
-        abcd_total = np.tile(np.eye(2), (nfreqs, 1, 1))
-        
-        logger.info("Building circuit cascade with proper topology:")
-        
-        # Create a map of where shunts should be inserted
-        shunt_map = {}
-        for shunt in shunt_components:
-            node = shunt['node']
-            if node not in shunt_map:
-                shunt_map[node] = []
-            shunt_map[node].append(shunt)
-        
-        # Process series elements in order, inserting shunts at appropriate nodes
-        processed_nodes = set(['0'])  # Start with ground as processed
-        
-        for i, series_elem in enumerate(series_components):
-            nodes = series_elem['nodes']
-            name = series_elem['name']
-            
-            # Check if there are shunts to insert before this series element
-            for node in nodes:
-                if node in shunt_map and node not in processed_nodes:
-                    # Insert all shunts at this node
-                    for shunt in shunt_map[node]:
-                        logger.info(f"  Inserting SHUNT {shunt['name']} at node {node}")
-                        abcd_total = np.matmul(abcd_total, shunt['network'].a)
-                    processed_nodes.add(node)
-            
-            # Add the series element
-            logger.info(f"  Adding SERIES {name} from {nodes[0]} to {nodes[1]}")
-            abcd_total = np.matmul(abcd_total, series_elem['network'].a)
-            processed_nodes.update(nodes)
-        
-        # Add any remaining shunts
-        for node, shunts in shunt_map.items():
-            if node not in processed_nodes:
-                for shunt in shunts:
-                    logger.info(f"  Adding remaining SHUNT {shunt['name']} at node {node}")
-                    abcd_total = np.matmul(abcd_total, shunt['network'].a)
-        
-        logger.info(" Cascade complete!")
-        return abcd_total
-    
     def calculate_circuit_s_parameters(self, frequency_range, p1n1, p1n2, p2n1, p2n2):
         """Calculate overall S-parameters for the circuit between specified ports"""
         try:
-            networks = self.create_networks_for_all_components(frequency_range)
-            
-            if not networks:
-                logger.error("No networks created from components")
-                return None
-            
-            if len(networks) == 1:
-                # Single component case
-                single_network = list(networks.values())[0]
-                # Ensure consistent z0
-                if hasattr(single_network, 'z0') and np.any(single_network.z0 != self.z0_system):
-                    single_network_renorm = single_network.copy()
-                    single_network_renorm.z0 = self.z0_system
-                    return single_network_renorm.s
-                return single_network.s
-            
-            # CORRECTED: Use proper topology building
-            series_components, shunt_components = self.build_circuit_topology(networks)
-            
-            # CORRECTED: Use proper cascading method
-            nfreqs = frequency_range.npoints
-            abcd_total = self.cascade_networks_properly(series_components, shunt_components, frequency_range)
-            
-            # Create final network with consistent impedance
-            z0_array = rf.fix_z0_shape(self.z0_system, nfreqs, 2)
-            result_network = rf.Network(frequency=frequency_range, a=abcd_total, z0=z0_array)
-            s_parameters = result_network.s
-            return s_parameters
+            index = {}
+            for component in self.circuit_components.values():
+                for node in component['nodes']:
+                    if not self.is_ground_node(node):
+                        index.setdefault(node, len(index))
+            f = np.asarray(frequency_range.f, dtype=float)
+            omega = 2 * np.pi * f
+            nodal = NodalConnection(len(index))
+
+            admittances = []
+            for name, component in self.circuit_components.items():
+                a, b = (index.get(node, -1) for node in component['nodes'])
+                component_type = component['type']
+                with np.errstate(divide='ignore'):
+                    if component_type == 'transmission_line':
+                        # Electrical length is given at 1 GHz
+                        abcd = line_abcd(component['impedance'], theta_in_rad(component['electrical_length']),
+                                         1e9, f)
+                        nodal.add_blocks([(a, b)])
+                        admittances.append(abcd_to_y(abcd)[:, None])
+                        continue
+                    if component_type in ('wire', 'resistor'):
+                        y = np.full(len(f), 1 / component['value'], dtype=complex)
+                    elif component_type == 'capacitor':
+                        y = 1j * omega * component['value']
+                    elif component_type == 'inductor':
+                        y = 1 / (1j * omega * component['value'])
+                    else:
+                        termination = 'open' if component_type == 'open_stub' else 'short'
+                        y = stub_admittance(component['impedance'], theta_in_rad(component['electrical_length']),
+                                            1e9, f, termination)
+                    nodal.add_admittances([a], [b])
+                    admittances.append(y[:, None])
+
+            for plus, minus in ((p1n1, p1n2), (p2n1, p2n2)):
+                nodal.add_port(index.get(str(plus), -1), index.get(str(minus), -1))
+            return nodal.compile().solve(admittances, [self.z0_system] * 2)
             
         except Exception as error:
             logger.error(f"Error calculating S-parameters: {error}")
@@ -579,122 +541,135 @@ class run_s_parameter:
                 print(f"  Value: {value} {unit}")
             print()
     
-    def __call__(self, netlist):
-        """Main interface function to calculate S-parameters"""
+    def parse_elements(self, circuit, freq):
+        """
+        Element descriptions of an S-parameter netlist (CircuitIR) and its
+        nodes in order of first appearance, which fixes the port order.
+        """
         elements = {}
-        nodes = {}
         node = []
-        freq = None
-        media = None
-        
-        # First pass: find frequency line and create freq/media objects
-        for line in netlist.strip().splitlines():
-            tokens = line.split()
-            if tokens[0] == 'f':
-                fmin = float(tokens[1])
-                fmax = float(tokens[2])
-                npoints = int(tokens[3])
-                funits = tokens[4]
-                freq = rf.Frequency(fmin, fmax, npoints, funits)
-                media = rf.DefinedGammaZ0(freq, z0=50, gamma=1j * freq.w / rf.c)
-                break
-        
-        # If no frequency line found, create default
-        if freq is None:
-            freq = rf.Frequency(0.1, 1.0, 101, 'GHz')
-            media = rf.DefinedGammaZ0(freq, z0=50, gamma=1j * freq.w / rf.c)
-        
-        # Second pass: process all components
-        for line in netlist.strip().splitlines():
-            tokens = line.split()
-            if tokens[0] == 'f':
-                continue  # Skip frequency line in second pass
-            else:
-                if len(tokens) == 3:
-                    # Handle ports, ground, and wires with 3 tokens
-                    name, n1, n2 = tokens[:3]
-                    if name.startswith('Port'):
-                        value = 50.0  # Default port impedance
-                    elif name.startswith('Ground'):
-                        value = 1.0   # Default ground value
-                    elif name.startswith('W') or name.startswith('w'):
-                        # Wire component with 3 tokens (no value needed)
-                        value = 1e-6  # 1 micro-ohm for ideal wire
-                    else:
-                        # Skip lines that don't have enough information
-                        continue
-                elif len(tokens) == 4 or len(tokens) == 5:
-                    name, n1, n2, val = tokens[:4]
-                    unit = tokens[4] if len(tokens) > 4 else None
-                    value = parse_value(val, unit)
-                elif len(tokens) > 4:
-                    name, n1, n2, Zc, theta, f0 = tokens[:6]
-                    unit = tokens[6]
-                    f0 = parse_value(f0, unit)
-                    theta = theta_in_rad(theta)
-                    Zc = float(Zc)
+        for i, name in enumerate(circuit.names):
+            element_nodes = circuit.element_nodes(i)
+            params = circuit.params[i]
+            if circuit.kinds[i] == 'X':
+                # Black box from an uploaded Touchstone file: X<n> <node of each port> <touchstone id>
+                x_nodes, touchstone_id = element_nodes, params[-1] if params else ''
+                data = load_touchstone(touchstone_id)
+                if len(x_nodes) != data.nports:
+                    raise ValueError(f"{name} needs {data.nports} nodes for its {data.nports}-port data, "
+                                     f"got {len(x_nodes)}")
+                elements[name] = {'prefix': 'X', 'nodes': tuple(int(n) for n in x_nodes),
+                                  's': data.interpolate(freq.f), 'z0': data.z0}
+                node.extend(int(n) for n in x_nodes)
+                continue
+
+            n1, n2 = element_nodes[:2]
+            element = {'prefix': name[0].upper()}
+            if not params:
+                # Handle ports, ground, and wires with 3 tokens
+                if name.startswith('Port'):
+                    element['value'] = 50.0  # Default port impedance
+                elif name.startswith('Ground'):
+                    element['value'] = 1.0   # Default ground value
+                elif name.startswith('W') or name.startswith('w'):
+                    # Wire component with 3 tokens (no value needed)
+                    element['value'] = 1e-6  # 1 micro-ohm for ideal wire
                 else:
-                    # Skip lines that don't have enough tokens
+                    # Skip lines that don't have enough information
                     continue
+            elif len(params) <= 2:
+                unit = params[1] if len(params) > 1 else None
+                element['value'] = parse_value(params[0], unit)
+            else:
+                Zc, theta, f0 = params[:3]
+                unit = params[3] if len(params) > 3 else None
+                element.update(Zc=float(Zc), theta=theta_in_rad(theta), f0=parse_value(f0, unit))
 
-                prefix = name[0].upper()
-                if prefix == 'W':
-                    # Wire component - use 1 micro-ohm resistor
-                    net = media.resistor(1e-6, name=name)
-                elif prefix == 'C':
-                    net = media.capacitor(value, name=name)
-                elif prefix == 'L':
-                    net = media.inductor(value, name=name)
-                elif prefix == 'R':
-                    net = media.resistor(value, name=name)
-                elif prefix == 'P':
-                    net = rf.Circuit.Port(freq, name=name, z0=value)
-                elif prefix == 'G':
-                    net = rf.Circuit.Ground(freq, name='gnd')
-                elif prefix == 'T':
-                    net = Transmission_Line(Zc, theta, f0, freq, 50, name)
-                elif prefix == 'O':
-                    net = Open_Stub(Zc, theta, f0, freq, 50, name)
-                elif prefix == 'S':
-                    net = Short_Stub(Zc, theta, f0, freq, 50, name)
-                elif prefix == '#':
-                    continue
-                else:
-                    raise ValueError(f"Unsupported component {name}")
-                if prefix not in ('P', 'G', 'O', 'S'):
-                    elements[name] = {'net': net, 'nodes': (int(n1), int(n2))}
-                else:
-                    elements[name] = {'net': net, 'nodes': (int(n1),)}
-                node.append(int(n1))
-                node.append(int(n2))
+            prefix = element['prefix']
+            if prefix not in 'WCLRPGTOS':
+                raise ValueError(f"Unsupported component {name}")
+            if prefix in 'TOS' and 'Zc' not in element:
+                raise ValueError(f"{name} needs a characteristic impedance, an electrical length and f0")
+            if prefix not in ('P', 'G', 'O', 'S'):
+                element['nodes'] = (int(n1), int(n2))
+            else:
+                element['nodes'] = (int(n1),)
+            elements[name] = element
+            node.append(int(n1))
+            node.append(int(n2))
 
         node = list(dict.fromkeys(node))
         logger.info(f"Unique nodes: {node}")
         logger.info(f"Elements: {list(elements.keys())}")
-        
-        # -----------------------------
-        # Step 2: Create connection rows for each node
-        # -----------------------------
+        return elements, node
+
+    def nodal_s_parameters(self, elements, node, freq):
+        """
+        S-parameters (and port impedances) of the connected elements from the
+        nodal engine, on the cached connection graph of their topology.
+        Raises LinAlgError when an element has no admittance form at some
+        frequency (e.g. a half-wave line).
+        """
+        return connection_graph(elements, node).s_parameters(elements, np.asarray(freq.f, dtype=float))
+
+    def connect_networks(self, elements, node, freq):
+        """The elements as scikit-rf networks joined by rf.Circuit (dense, but takes any network)."""
+        media = rf.DefinedGammaZ0(freq, z0=50, gamma=1j * freq.w / rf.c)
+        networks = {}
+        for name, element in elements.items():
+            prefix = element['prefix']
+            if prefix == 'X':
+                net = rf.Network(frequency=freq, s=element['s'], z0=element['z0'], name=name)
+            elif prefix == 'W':
+                # Wire component - use 1 micro-ohm resistor
+                net = media.resistor(WIRE_RESISTANCE, name=name)
+            elif prefix == 'C':
+                net = media.capacitor(element['value'], name=name)
+            elif prefix == 'L':
+                net = media.inductor(element['value'], name=name)
+            elif prefix == 'R':
+                net = media.resistor(element['value'], name=name)
+            elif prefix == 'P':
+                net = rf.Circuit.Port(freq, name=name, z0=element['value'])
+            elif prefix == 'G':
+                net = rf.Circuit.Ground(freq, name='gnd')
+            elif prefix == 'T':
+                net = Transmission_Line(element['Zc'], element['theta'], element['f0'], freq, 50, name)
+            elif prefix == 'O':
+                net = Open_Stub(element['Zc'], element['theta'], element['f0'], freq, 50, name)
+            else:
+                net = Short_Stub(element['Zc'], element['theta'], element['f0'], freq, 50, name)
+            networks[name] = net
+
         # Node rows = list of lists, each sublist contains all ports connected to that node
-        connection = []
-        for i in node:
-            coni = []
-            for j in elements:
-                nodej = elements[j].get('nodes')
-                if i in nodej:
-                    if i == nodej[0]:
-                        coni.append((elements[j].get('net'), 0))
-                        logger.info(f"Node {i}: Connected {j} port 0")
-                    elif i == nodej[1]:
-                        if elements[j].get('net').name != 'gnd':
-                            coni.append((elements[j].get('net'), 1))
-            connection.append(coni)
-            logger.info(f"Node {i} connections: {len(coni)} components")
-        
+        connection = connection_graph(elements, node).connection(networks)
         logger.info(f"Total connection matrix size: {len(connection)}")
-        ckt = rf.Circuit(connection)
-        ntw = ckt.network
+        with stage('solve'):
+            return rf.Circuit(connection).network
+
+    @timed('s')
+    def __call__(self, netlist):
+        """Main interface function to calculate S-parameters"""
+        circuit = parse_circuit(netlist)
+        
+        # Frequency line, or a default sweep
+        if circuit.frequency:
+            fmin, fmax, npoints, funits = circuit.frequency[:4]
+            freq = rf.Frequency(float(fmin), float(fmax), int(npoints), funits)
+        else:
+            freq = rf.Frequency(0.1, 1.0, 101, 'GHz')
+
+        elements, node = self.parse_elements(circuit, freq)
+        try:
+            s, z0 = self.nodal_s_parameters(elements, node, freq)
+            ntw = rf.Network(frequency=freq, s=s, z0=z0)
+        except np.linalg.LinAlgError as e:
+            logger.info(f"Nodal connection not possible ({e}); connecting the networks with scikit-rf")
+            ntw = self.connect_networks(elements, node, freq)
+            z0 = np.real(ntw.z0[0])
         self.network = ntw
+        # Reference impedance of every port, in the port order of the S matrix
+        self.port_impedances = [float(z) for z in z0]
         logger.info(f"Network created with shape: {ntw.s.shape if hasattr(ntw, 's') else 'No S-parameters'}")
         
         # Return S-parameter array instead of Network object
@@ -704,7 +679,8 @@ class run_s_parameter:
             logger.error("Network object does not have S-parameters")
             return None
 
-def plot_s_parameters(frequency_range, s_parameters, save_dir='static'):
+def plot_s_parameters(frequency_range, s_parameters, save_dir='static', dpi=300,
+                      filename='s_parameters_combined.png'):
     """
     Enhanced S-parameter plotting that automatically detects number of ports
     and plots all relevant S-parameters including S31, S32 for 3-port networks
@@ -717,11 +693,11 @@ def plot_s_parameters(frequency_range, s_parameters, save_dir='static'):
         S-parameter matrix with shape (nfreqs, nports, nports)
     save_dir : str
         Directory to save plots
+    dpi : int
+        Resolution of the saved PNG
+    filename : str
+        Name of the PNG inside save_dir
     """
-    import os
-    import numpy as np
-    import matplotlib.pyplot as plt
-    
     os.makedirs(save_dir, exist_ok=True)
     
     logger.info(f"S-parameters shape: {s_parameters.shape}")
@@ -813,13 +789,24 @@ def plot_s_parameters(frequency_range, s_parameters, save_dir='static'):
     plt.tight_layout()
     
     # Save the plot
-    save_path = os.path.join(save_dir, 's_parameters_combined.png')
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    save_path = os.path.join(save_dir, filename)
+    plt.savefig(save_path, dpi=dpi, bbox_inches='tight')
     logger.info(f"S-parameter plot (S11,S21,S31,S32) saved to: {save_path}")
     plt.close()
     
     return save_path
 
+
+S_PLOTS = ('combined',)
+
+
+def render_s_plot(name, plot_data, filename, dpi):
+    """Render one of S_PLOTS from {'frequencies': Hz array, 's': (nfreqs, nports, nports) array}."""
+    frequency_range = rf.Frequency.from_f(plot_data['frequencies'], unit='Hz')
+    save_dir, basename = os.path.split(filename)
+    return plot_s_parameters(frequency_range, plot_data['s'], save_dir=save_dir, dpi=dpi,
+                             filename=basename) is not None
+
 # Example usage with wire component:
 # spar = run_s_parameter()
 # netlist = """
@@ -1,136 +1,63 @@
-from lcapy import Circuit
+from __future__ import annotations
 import logging
-import sympy as sp
 import numpy as np
 from typing import Dict, Any, Tuple, List, Optional
-import matplotlib.pyplot as plt
 from pathlib import Path
 import json
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit, parse_value
+from result_cache import make_cache_key
+from lazy_imports import LazyModule
+from metrics import timed, stage
+from compiled_expr import CompiledParameters, get_compiled_parameters, simplify_expression, SIMPLIFY_MAX_OPS
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Imported on the first Y-parameter calculation
+lcapy = LazyModule('lcapy')
+sp = LazyModule('sympy')
+
 class YParameterCalculator:
     def __init__(self):
         self.s = sp.Symbol('s', complex=True)
         self.supported_components = ['R', 'C', 'L', 'V', 'I', 'W']
-        self.engineering_prefixes = {
-            'f': 1e-15, 'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'm': 1e-3,
-            'k': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12
-        }
 
     def parse_engineering_notation(self, value_str: str) -> float:
         """Parse engineering notation values (e.g., '1k', '10u', '1.5M')"""
-        value_str = str(value_str).strip()
-        if not value_str:
+        if not str(value_str).strip():
             return 0.0
-            
-        try:
-            # Check if it's already a number
-            return float(value_str)
-        except ValueError:
-            pass
-        
-        # Extract number and suffix
-        for suffix, multiplier in self.engineering_prefixes.items():
-            if value_str.endswith(suffix):
-                number = float(value_str[:-len(suffix)])
-                return number * multiplier
-        
-        # If no suffix found, try to parse as float
         try:
-            return float(value_str)
+            return parse_value(value_str)
         except ValueError:
             logger.warning(f"Could not parse value: {value_str}")
             return 0.0
 
     def preprocess_netlist(self, netlist_string: str) -> str:
-        """Enhanced preprocessing with better component handling"""
-        lines = netlist_string.strip().splitlines()
-        processed = []
-        wire_counter = 1
-        existing_names = set()
-        
-        # First pass: collect existing names
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#') or line.startswith(';'):
-                continue
-            tokens = line.split()
-            if len(tokens) >= 3:
-                existing_names.add(tokens[0])
-
-        # Second pass: process components
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
-            if not line or line.startswith('#') or line.startswith(';'):
-                continue
-                
-            tokens = line.split()
-            if len(tokens) < 3:
-                logger.warning(f"Line {line_num}: Invalid component definition: {line}")
-                continue
-            
-            component_type = tokens[0][0].upper()
-            name = tokens[0]
-            n1, n2 = tokens[1], tokens[2]
-            
-            if component_type == 'W':
-                # Convert wire to very small resistor
-                new_name = f'Rwire{wire_counter}'
-                while new_name in existing_names:
-                    wire_counter += 1
-                    new_name = f'Rwire{wire_counter}'
-                processed.append(f'{new_name} {n1} {n2} 1e-12')
-                existing_names.add(new_name)
-                wire_counter += 1
-                logger.info(f"Converted wire {name} to small resistor {new_name}")
-                
-            elif component_type in ['R', 'C', 'L']:
-                # Handle component values with engineering notation
-                if len(tokens) >= 4:
-                    raw_value = tokens[3]
-                    parsed_value = self.parse_engineering_notation(raw_value)
-                    processed.append(f'{name} {n1} {n2} {parsed_value}')
-                    logger.debug(f"Processed {component_type}: {name} = {parsed_value}")
-                else:
-                    processed.append(line)
-                    
-            elif component_type in ['V', 'I']:
-                # Voltage/current sources
-                processed.append(line)
-                
-            else:
-                logger.warning(f"Line {line_num}: Unsupported component type: {component_type}")
-                # Still add it to let lcapy handle the error
-                processed.append(line)
-        
-        return '\n'.join(processed)
+        """
+        Wires become 1 pOhm resistors and R, C, L values plain numbers; the
+        S-parameter port, ground and frequency lines are dropped.
+        """
+        circuit = parse_circuit(netlist_string)
+        for i in np.flatnonzero(~np.isin(circuit.kinds, self.supported_components + ['port', 'ground'])):
+            # Still passed on to let lcapy handle the error
+            logger.warning(f"Line {circuit.lines[i]}: Unsupported component type: {circuit.kinds[i]}")
+        return circuit.lowered(wires=1e-12, numeric_values=True).to_netlist()
 
     def validate_ports(self, netlist: str, p1n1: str, p1n2: str, p2n1: str, p2n2: str) -> Tuple[bool, List[str]]:
         """Enhanced port validation with better error reporting"""
-        nodes = set()
-        components = []
-        
-        for line in netlist.strip().splitlines():
-            tokens = line.split()
-            if len(tokens) >= 3:
-                components.append(tokens[0])
-                for token in tokens[1:3]:
-                    try:
-                        nodes.add(str(token))
-                    except:
-                        pass
-        
+        circuit = parse_circuit(netlist)
+        nodes = circuit.node_names()
+
         port_nodes = [str(n) for n in [p1n1, p1n2, p2n1, p2n2]]
         missing_nodes = [node for node in port_nodes if node not in nodes]
         
         if missing_nodes:
             logger.error(f"Port nodes not found in circuit: {missing_nodes}")
             logger.info(f"Available nodes: {sorted(nodes)}")
-            logger.info(f"Circuit components: {components}")
+            logger.info(f"Circuit components: {circuit.names}")
             return False, missing_nodes
         
         logger.info(f"Port validation successful: P1({p1n1},{p1n2}), P2({p2n1},{p2n2})")
@@ -171,7 +98,8 @@ class YParameterCalculator:
             logger.info(f"Added ground reference resistor from node {ref_node}")
         
         try:
-            circuit = Circuit(netlist)
+            with stage('circuit'):
+                circuit = lcapy.Circuit(netlist)
             logger.debug(f"Circuit created successfully")
             
             # Create twoport representation
@@ -270,34 +198,57 @@ class YParameterCalculator:
             sign = '+' if imag >= 0 else '-'
             return f"{real_str} {sign} j{imag_str}"
 
-    def evaluate_at_frequency(self, y_params: Dict[str, sp.Basic], frequency: float) -> Dict[str, complex]:
-        """Evaluate symbolic Y-parameters at specific frequency with enhanced error handling"""
+    def compile_y_parameters(self, netlist: str, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
+                             simplify=True) -> CompiledParameters:
+        """
+        Symbolic Y-parameters compiled into vectorized functions of frequency.
+        simplify may be False, True (bounded by SIMPLIFY_MAX_OPS) or an operation budget.
+        """
+        max_ops = SIMPLIFY_MAX_OPS if simplify is True else int(simplify or 0)
+        with stage('solve'):
+            y_params = self.calculate_y_parameters_twoport(netlist, p1n1, p1n2, p2n1, p2n2)
+        with stage('compile'):
+            y_params = {param: simplify_expression(expr, max_ops) for param, expr in y_params.items()}
+        logger.info("Symbolic Y-parameters compiled")
+        return CompiledParameters(y_params)
+
+    def get_compiled_y_parameters(self, netlist: str, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
+                                  simplify=True) -> CompiledParameters:
+        """Compiled Y-parameters of a preprocessed netlist, cached per circuit hash and ports."""
+        key = make_cache_key('y', netlist, {'ports': [p1n1, p1n2, p2n1, p2n2], 'simplify': simplify})
+        return get_compiled_parameters(
+            key, lambda: self.compile_y_parameters(netlist, p1n1, p1n2, p2n1, p2n2, simplify))
+
+    def evaluate_sweep(self, y_params, frequencies) -> Dict[str, np.ndarray]:
+        """Y-parameter arrays over frequencies; y_params is a CompiledParameters or a dict of expressions."""
+        if not isinstance(y_params, CompiledParameters):
+            y_params = CompiledParameters({k: v if isinstance(v, sp.Basic) else sp.sympify(v)
+                                           for k, v in y_params.items()})
+        try:
+            with stage('evaluate'):
+                return y_params.evaluate(frequencies)
+        except Exception as e:
+            logger.error(f"Failed to evaluate Y-parameters: {e}")
+            zeros = np.zeros(np.size(frequencies), dtype=complex)
+            return {param: zeros.copy() for param in y_params.symbolic}
+
+    def evaluate_at_frequency(self, y_params, frequency: float) -> Dict[str, complex]:
+        """Evaluate Y-parameters at a specific frequency"""
         omega = 2 * np.pi * frequency
-        jw = sp.I * omega
         numeric_params = {}
         
         logger.info(f"Evaluating Y-parameters at f = {frequency} Hz (ω = {omega:.3e} rad/s)")
         
-        for param, expr in y_params.items():
-            try:
-                if not isinstance(expr, sp.Basic):
-                    expr = sp.sympify(expr)
-                
-                # Substitute s = jω
-                substituted = expr.subs(self.s, jw)
-                
-                # Evaluate to complex number
-                result = complex(substituted.evalf())
-                numeric_params[param] = result
-                
-                # Log with engineering notation
-                formatted = self.format_complex_eng(result)
-                logger.info(f"{param} = {formatted} S")  # Siemens for admittance
-                
-            except Exception as e:
-                logger.error(f"Failed to evaluate {param}: {e}")
-                logger.debug(f"Expression: {expr}")
-                numeric_params[param] = 0+0j
+        for param, values in self.evaluate_sweep(y_params, [frequency]).items():
+            result = complex(values[0])
+            if not np.isfinite(result):
+                logger.error(f"Failed to evaluate {param}: non-finite value")
+                result = 0+0j
+            numeric_params[param] = result
+            
+            # Log with engineering notation
+            formatted = self.format_complex_eng(result)
+            logger.info(f"{param} = {formatted} S")  # Siemens for admittance
         
         return numeric_params
 
@@ -322,25 +273,24 @@ class YParameterCalculator:
         return properties
 
     def run_y_parameter(self, freq: float, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
-                        netlist_filename: str = 'netlist.txt') -> Dict[str, Any]:
+                        netlist_filename: str = 'netlist.txt', netlist=None, simplify=True) -> Dict[str, Any]:
         """Main method to run Y-parameter analysis with comprehensive error handling"""
         start_time = logger.info("Starting Y-parameter analysis")
         
         # Read netlist
         try:
-            netlist_path = Path(netlist_filename)
-            if not netlist_path.exists():
+            if netlist is None and not Path(netlist_filename).exists():
                 return self._create_error_result(f"Netlist file not found: {netlist_filename}", freq)
                 
-            with open(netlist_path, 'r') as file:
-                netlist_string = file.read()
-            logger.info(f"Read netlist from: {netlist_filename} ({len(netlist_string)} characters)")
+            netlist_string = load_netlist(netlist, netlist_filename)
+            logger.info(f"Loaded netlist ({len(netlist_string)} characters)")
         except Exception as e:
             return self._create_error_result(f"Failed to read netlist: {e}", freq)
         
         # Preprocess netlist
         try:
-            processed_netlist = self.preprocess_netlist(netlist_string)
+            with stage('preprocess'):
+                processed_netlist = self.preprocess_netlist(netlist_string)
             logger.debug("Netlist preprocessing completed")
         except Exception as e:
             return self._create_error_result(f"Netlist preprocessing failed: {e}", freq)
@@ -353,29 +303,18 @@ class YParameterCalculator:
         except Exception as e:
             return self._create_error_result(f"Port validation failed: {e}", freq)
         
-        # Calculate Y-parameters
+        # Calculate and compile Y-parameters (cached per circuit)
         try:
-            y_params_symbolic = self.calculate_y_parameters_twoport(
-                processed_netlist, p1n1, p1n2, p2n1, p2n2)
+            y_params_compiled = self.get_compiled_y_parameters(
+                processed_netlist, p1n1, p1n2, p2n1, p2n2, simplify)
             logger.info("Symbolic Y-parameter calculation completed")
         except Exception as e:
             logger.error(f"Y-parameter calculation failed: {e}")
             return self._create_error_result(str(e), freq)
         
-        # Simplify symbolic expressions
-        simplified_params = {}
-        for param, expr in y_params_symbolic.items():
-            try:
-                simplified = sp.simplify(expr)
-                simplified_params[param] = simplified
-                logger.debug(f"Simplified {param}: {simplified}")
-            except Exception as e:
-                logger.warning(f"Failed to simplify {param}: {e}")
-                simplified_params[param] = expr
-        
         # Evaluate at frequency
         try:
-            y_params_numeric = self.evaluate_at_frequency(simplified_params, freq)
+            y_params_numeric = self.evaluate_at_frequency(y_params_compiled, freq)
             logger.info("Numeric evaluation completed")
         except Exception as e:
             return self._create_error_result(f"Frequency evaluation failed: {e}", freq)
@@ -391,7 +330,7 @@ class YParameterCalculator:
         
         return {
             "frequency": freq,
-            "symbolic": {k: str(v) for k, v in simplified_params.items()},
+            "symbolic": dict(y_params_compiled.symbolic),
             "numeric": y_params_numeric,
             "properties": properties,
             "method_used": "twoport_y_parameters",
@@ -399,30 +338,31 @@ class YParameterCalculator:
         }
 
     def frequency_sweep(self, frequencies: List[float], p1n1: str, p1n2: str, 
-                       p2n1: str, p2n2: str, netlist_filename: str = 'netlist.txt') -> Dict[str, Any]:
+                       p2n1: str, p2n2: str, netlist_filename: str = 'netlist.txt',
+                       netlist=None, simplify=True) -> Dict[str, Any]:
         """Perform frequency sweep analysis"""
         results = []
         
-        # Calculate symbolic parameters once
+        # Calculate and compile symbolic parameters once
         try:
-            with open(netlist_filename, 'r') as file:
-                netlist_string = file.read()
+            netlist_string = load_netlist(netlist, netlist_filename)
             processed_netlist = self.preprocess_netlist(netlist_string)
             
             valid, _ = self.validate_ports(processed_netlist, p1n1, p1n2, p2n1, p2n2)
             if not valid:
                 raise ValueError("Invalid port configuration")
                 
-            y_params_symbolic = self.calculate_y_parameters_twoport(
-                processed_netlist, p1n1, p1n2, p2n1, p2n2)
+            y_params_compiled = self.get_compiled_y_parameters(
+                processed_netlist, p1n1, p1n2, p2n1, p2n2, simplify)
             
         except Exception as e:
             return {"error": str(e), "frequencies": frequencies, "results": []}
         
-        # Evaluate at each frequency
-        for freq in frequencies:
+        # Evaluate all frequencies in one vectorized call
+        sweep = self.evaluate_sweep(y_params_compiled, frequencies)
+        for i, freq in enumerate(frequencies):
             try:
-                y_params_numeric = self.evaluate_at_frequency(y_params_symbolic, freq)
+                y_params_numeric = {param: complex(values[i]) for param, values in sweep.items()}
                 properties = self.check_network_properties(y_params_numeric)
                 
                 results.append({
@@ -436,7 +376,7 @@ class YParameterCalculator:
         
         return {
             "frequencies": frequencies,
-            "symbolic": {k: str(v) for k, v in y_params_symbolic.items()},
+            "symbolic": dict(y_params_compiled.symbolic),
             "results": results,
             "sweep_success": True
         }
@@ -454,17 +394,19 @@ class YParameterCalculator:
             "success": False
         }
 
+@timed('y')
 def run_y_parameter(freq: float, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
-                    netlist_filename: str = 'netlist.txt') -> Dict[str, Any]:
+                    netlist_filename: str = 'netlist.txt', netlist=None, simplify=True) -> Dict[str, Any]:
     """Convenience function to run Y-parameter analysis"""
     calculator = YParameterCalculator()
-    return calculator.run_y_parameter(freq, p1n1, p1n2, p2n1, p2n2, netlist_filename)
+    return calculator.run_y_parameter(freq, p1n1, p1n2, p2n1, p2n2, netlist_filename, netlist, simplify)
 
+@timed('y_sweep')
 def run_frequency_sweep(frequencies: List[float], p1n1: str, p1n2: str, p2n1: str, p2n2: str,
-                       netlist_filename: str = 'netlist.txt') -> Dict[str, Any]:
+                       netlist_filename: str = 'netlist.txt', netlist=None, simplify=True) -> Dict[str, Any]:
     """Convenience function for frequency sweep analysis"""
     calculator = YParameterCalculator()
-    return calculator.frequency_sweep(frequencies, p1n1, p1n2, p2n1, p2n2, netlist_filename)
+    return calculator.frequency_sweep(frequencies, p1n1, p1n2, p2n1, p2n2, netlist_filename, netlist, simplify)
 
 def main():
     """Enhanced main function with examples"""
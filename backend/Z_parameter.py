@@ -1,68 +1,37 @@
-from lcapy import Circuit
+from __future__ import annotations
 import logging
-import sympy as sp
 import numpy as np
 from typing import Dict, Any, Tuple
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit
+from result_cache import make_cache_key
+from lazy_imports import LazyModule
+from metrics import timed, stage
+from compiled_expr import CompiledParameters, get_compiled_parameters, simplify_expression, SIMPLIFY_MAX_OPS
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Imported on the first Z-parameter calculation
+lcapy = LazyModule('lcapy')
+sp = LazyModule('sympy')
+
 class ZParameterCalculator:
     def __init__(self):
         self.s = sp.Symbol('s', complex=True)
         self.supported_components = ['R', 'C', 'L', 'V', 'I', 'W']
 
     def preprocess_netlist(self, netlist_string: str) -> str:
-        lines = netlist_string.strip().splitlines()
-        processed = []
-        wire_counter = 1
-        existing_names = set()
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            tokens = line.split()
-            if len(tokens) >= 3:
-                existing_names.add(tokens[0])
-
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            tokens = line.split()
-            if len(tokens) < 3:
-                logger.warning(f"Line {line_num}: Invalid component definition: {line}")
-                continue
-            component_type = tokens[0][0].upper()
-            if component_type == 'W':
-                name, n1, n2 = tokens[:3]
-                new_name = f'Rwire{wire_counter}'
-                while new_name in existing_names:
-                    wire_counter += 1
-                    new_name = f'Rwire{wire_counter}'
-                processed.append(f'{new_name} {n1} {n2} 1e-12')
-                existing_names.add(new_name)
-                wire_counter += 1
-                logger.info(f"Converted wire {name} to small resistor {new_name}")
-            elif component_type in self.supported_components:
-                processed.append(line)
-            else:
-                logger.warning(f"Line {line_num}: Unsupported component type: {component_type}")
-                processed.append(line)
-        return '\n'.join(processed)
+        """Wires become 1 pOhm resistors; the S-parameter port, ground and frequency lines are dropped."""
+        circuit = parse_circuit(netlist_string)
+        for i in np.flatnonzero(~np.isin(circuit.kinds, self.supported_components + ['port', 'ground'])):
+            logger.warning(f"Line {circuit.lines[i]}: Unsupported component type: {circuit.kinds[i]}")
+        return circuit.lowered(wires=1e-12).to_netlist()
 
     def validate_ports(self, netlist: str, p1n1: str, p1n2: str, p2n1: str, p2n2: str) -> bool:
-        nodes = set()
-        for line in netlist.strip().splitlines():
-            tokens = line.split()
-            if len(tokens) >= 3:
-                for token in tokens[1:3]:
-                    try:
-                        nodes.add(str(token))
-                    except:
-                        pass
+        nodes = parse_circuit(netlist).node_names()
         port_nodes = [p1n1, p1n2, p2n1, p2n2]
         missing_nodes = [node for node in port_nodes if str(node) not in nodes]
         if missing_nodes:
@@ -97,7 +66,8 @@ class ZParameterCalculator:
         if ' 0 ' not in netlist:
             netlist += f'\nRgnd {p1n2} 0 1e12'
             logger.info("Added ground reference resistor for twoport analysis")
-        circuit = Circuit(netlist)
+        with stage('circuit'):
+            circuit = lcapy.Circuit(netlist)
         twoport = circuit.twoport(p1n1, p1n2, p2n1, p2n2)
         z_params = {}
         if hasattr(twoport, 'Z'):
@@ -148,49 +118,70 @@ class ZParameterCalculator:
             return f"{to_eng(real)}"
         return f"{to_eng(real)} {'-' if imag < 0 else '+'} j{to_eng(imag)}"
 
-    def evaluate_at_frequency(self, z_params: Dict[str, sp.Basic], frequency: float) -> Dict[str, complex]:
-        omega = 2 * np.pi * frequency
-        jw = sp.I * omega
+    def compile_z_parameters(self, netlist: str, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
+                             simplify=True) -> CompiledParameters:
+        """
+        Symbolic Z-parameters compiled into vectorized functions of frequency.
+        simplify may be False, True (bounded by SIMPLIFY_MAX_OPS) or an operation budget.
+        """
+        max_ops = SIMPLIFY_MAX_OPS if simplify is True else int(simplify or 0)
+        with stage('solve'):
+            z_params = self.calculate_z_parameters_twoport(netlist, p1n1, p1n2, p2n1, p2n2)
+        with stage('compile'):
+            z_params = {param: simplify_expression(expr, max_ops) for param, expr in z_params.items()}
+        return CompiledParameters(z_params)
+
+    def get_compiled_z_parameters(self, netlist: str, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
+                                  simplify=True) -> CompiledParameters:
+        """Compiled Z-parameters of a preprocessed netlist, cached per circuit hash and ports."""
+        key = make_cache_key('z', netlist, {'ports': [p1n1, p1n2, p2n1, p2n2], 'simplify': simplify})
+        return get_compiled_parameters(
+            key, lambda: self.compile_z_parameters(netlist, p1n1, p1n2, p2n1, p2n2, simplify))
+
+    def evaluate_sweep(self, z_params, frequencies) -> Dict[str, np.ndarray]:
+        """Z-parameter arrays over frequencies; z_params is a CompiledParameters or a dict of expressions."""
+        if not isinstance(z_params, CompiledParameters):
+            z_params = CompiledParameters({k: v if isinstance(v, sp.Basic) else sp.sympify(v)
+                                           for k, v in z_params.items()})
+        try:
+            with stage('evaluate'):
+                return z_params.evaluate(frequencies)
+        except Exception as e:
+            logger.error(f"Failed to evaluate Z-parameters: {e}")
+            zeros = np.zeros(np.size(frequencies), dtype=complex)
+            return {param: zeros.copy() for param in z_params.symbolic}
+
+    def evaluate_at_frequency(self, z_params, frequency: float) -> Dict[str, complex]:
         numeric_params = {}
-        for param, expr in z_params.items():
-            try:
-                if not isinstance(expr, sp.Basic):
-                    expr = sp.sympify(expr)
-                substituted = expr.subs(self.s, jw)
-                result = complex(substituted.evalf())
-                numeric_params[param] = result
-                formatted = self.format_complex_eng(result)
-                logger.info(f"{param} = {formatted} \u03a9")
-            except Exception as e:
-                logger.error(f"Failed to evaluate {param}: {e}")
-                numeric_params[param] = 0+0j
+        for param, values in self.evaluate_sweep(z_params, [frequency]).items():
+            result = complex(values[0])
+            if not np.isfinite(result):
+                logger.error(f"Failed to evaluate {param}: non-finite value")
+                result = 0+0j
+            numeric_params[param] = result
+            formatted = self.format_complex_eng(result)
+            logger.info(f"{param} = {formatted} \u03a9")
         return numeric_params
 
     def run_z_parameter(self, freq: float, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
-                        netlist_filename: str = 'netlist.txt') -> Dict[str, Any]:
+                        netlist_filename: str = 'netlist.txt', netlist=None, simplify=True) -> Dict[str, Any]:
         try:
-            with open(netlist_filename, 'r') as file:
-                netlist_string = file.read()
-            logger.info(f"Read netlist from: {netlist_filename}")
+            netlist_string = load_netlist(netlist, netlist_filename)
         except FileNotFoundError:
             return self._create_error_result(f"Netlist file not found: {netlist_filename}", freq)
-        processed_netlist = self.preprocess_netlist(netlist_string)
+        with stage('preprocess'):
+            processed_netlist = self.preprocess_netlist(netlist_string)
         if not self.validate_ports(processed_netlist, p1n1, p1n2, p2n1, p2n2):
             return self._create_error_result("Invalid port nodes", freq)
         try:
-            z_params_symbolic = self.calculate_z_parameters_twoport(processed_netlist, p1n1, p1n2, p2n1, p2n2)
+            z_params_compiled = self.get_compiled_z_parameters(processed_netlist, p1n1, p1n2, p2n1, p2n2, simplify)
         except Exception as e:
             return self._create_error_result(str(e), freq)
-        for param in z_params_symbolic:
-            try:
-                z_params_symbolic[param] = sp.simplify(z_params_symbolic[param])
-            except:
-                pass
-        z_params_numeric = self.evaluate_at_frequency(z_params_symbolic, freq)
+        z_params_numeric = self.evaluate_at_frequency(z_params_compiled, freq)
         reciprocal = abs(z_params_numeric['Z12'] - z_params_numeric['Z21']) < 1e-12
         return {
             "frequency": freq,
-            "symbolic": {k: str(v) for k, v in z_params_symbolic.items()},
+            "symbolic": dict(z_params_compiled.symbolic),
             "numeric": z_params_numeric,
             "reciprocal": reciprocal,
             "method_used": "twoport_z_only"
@@ -206,10 +197,11 @@ class ZParameterCalculator:
             "method_used": "failed"
         }
 
+@timed('z')
 def run_z_parameter(freq: float, p1n1: str, p1n2: str, p2n1: str, p2n2: str,
-                    netlist_filename: str = 'netlist.txt') -> Dict[str, Any]:
+                    netlist_filename: str = 'netlist.txt', netlist=None, simplify=True) -> Dict[str, Any]:
     calculator = ZParameterCalculator()
-    return calculator.run_z_parameter(freq, p1n1, p1n2, p2n1, p2n2, netlist_filename)
+    return calculator.run_z_parameter(freq, p1n1, p1n2, p2n1, p2n2, netlist_filename, netlist, simplify)
 
 def main():
     print("Z-Parameter Calculator")
@@ -1,15 +1,17 @@
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib import pyplot as plt
-from matplotlib.pyplot import figure, show, xlabel, ylabel, legend, subplots, savefig
-from lcapy import *
-from sympy import sympify, pi, I
 from cmath import polar
 import numpy as np
 import logging
-import re
-import math
 import os
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit
+from mna import MNACircuit
+from lazy_imports import LazyModule, lazy_pyplot
+from metrics import timed, stage
+
+# Imported on first use: the numeric analyses need neither
+plt = lazy_pyplot()
+lcapy = LazyModule('lcapy')
+sp = LazyModule('sympy')
 
 # Configure logging
 logging.basicConfig(
@@ -24,57 +26,27 @@ def _static_dir(path_segment: str = ""):
     return os.path.join(base_dir, path_segment) if path_segment else base_dir
 
 def preprocess_netlist(netlist_string):
-    lines = netlist_string.strip().splitlines()
-    processed = []
-
-    for line in lines:
-        tokens = line.split()
-        if len(tokens) == 3 and tokens[0].startswith('W'):
-            name, n1, n2 = tokens
-            processed.append(f'R{name} {n1} {n2} 0.000001')
-        else:
-            processed.append(line)
-
-    return '\n'.join(processed)
+    return parse_circuit(netlist_string).lowered(wires=1e-6).to_netlist()
 
 def convert_ac_sources(netlist):
-    ac_pattern = re.compile(r'^(V\d+)\s+(\d+)\s+(\d+)\s+AC\s+([0-9.]+)\s+([0-9.]+)$', re.IGNORECASE)
-    lines = netlist.strip().splitlines()
-    new_lines = []
-
-    for line in lines:
-        match = ac_pattern.match(line)
-        if match:
-            name, n1, n2, mag, phase = match.groups()
-            radians = float(phase) * math.pi / 180
-            complex_phasor = float(mag) * np.exp(1j * radians)
-            real_part = complex_phasor.real
-            imag_part = complex_phasor.imag
-            expr = f'{name} {n1} {n2} ac {{{real_part:.6f} + {imag_part:.6f}j}} 0 omega_0'
-            new_lines.append(expr)
-        else:
-            new_lines.append(line)
-
-    return "\n".join(new_lines)
+    """Write 'V.. AC <magnitude> <phase>' sources as the complex phasors lcapy's AC analysis takes."""
+    return parse_circuit(netlist).lowered(sources='phasor').to_netlist()
 
 def evaluate_complex_expression(expression, omega_val):
     try:
-        expr = sympify(expression.replace('j', 'I'))
-        result = expr.subs({'omega_0': omega_val, 'pi': pi, 'I': I}).evalf()
+        expr = sp.sympify(expression.replace('j', 'I'))
+        result = expr.subs({'omega_0': omega_val, 'pi': sp.pi, 'I': sp.I}).evalf()
         logger.info(f"Successfully evaluated: {expression} → {result}")
         return complex(result)
     except Exception as e:
         logger.warning(f"Failed to evaluate: {expression} → {e}")
         return None
 
-def plot_time_domain(phasors, labels, title, filename, freq):
+def plot_time_domain(phasors, labels, title, filename, freq, dpi=300):
     """
     Plot time domain representation of phasors with component-specific line styles
     and cosine expressions in the legend.
     """
-    import matplotlib.pyplot as plt
-    import numpy as np
-
     fig, ax = plt.subplots(figsize=(12, 8))
     
     # Time vector for two complete cycles
@@ -142,34 +114,127 @@ def plot_time_domain(phasors, labels, title, filename, freq):
     # Resolve filename relative to backend/static if needed
     out_path = _static_dir(os.path.basename(filename)) if filename.startswith('static') else filename
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    plt.savefig(out_path, bbox_inches='tight', dpi=300)
+    plt.savefig(out_path, bbox_inches='tight', dpi=dpi)
     plt.close()
 
 
-def run_ac_analysis(freq, netlist_filename='netlist.txt'):
+def plot_phasor_diagram(phasors, labels, title, filename, dpi=100):
+    """Polar diagram of the phasors, each normalized to the largest magnitude."""
+    fig = plt.figure(figsize=(8, 6))
+    ax = fig.add_subplot(111, polar=True)
+    max_mag = max((m for m, _ in phasors), default=1)
+
+    for (mag, ang), label in zip(phasors, labels):
+        ax.plot([0, ang], [0, mag / max_mag], marker='o', label=f'{label}: {mag:.6f}∠{np.degrees(ang):.0f}°')
+
+    ax.set_yticklabels([])
+    ax.set_rgrids([0.2, 0.5, 0.8, 1.0], angle=45)
+    ax.legend(bbox_to_anchor=(1.1, 1.05))
+    plt.title(title, fontsize=14, fontweight='bold')
+    plt.savefig(filename, bbox_inches='tight', dpi=dpi)
+    plt.close()
+
+
+def plot_combined_time_domain(v_phasors, v_labels, i_phasors, i_labels, filename, freq, dpi=300):
+    """Voltage and current waveforms over two periods in two stacked subplots."""
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
+
+    T = 1.0 / freq
+    t = np.linspace(0, 2*T, 1000)
+    omega = 2 * np.pi * freq
+
+    # Voltage subplot
+    colors_v = plt.cm.tab10(np.linspace(0, 1, len(v_phasors)))
+    for i, ((mag, phase), label) in enumerate(zip(v_phasors, v_labels)):
+        signal = mag * np.cos(omega * t + phase)
+        ax1.plot(t * 1000, signal, label=f'{label}: {mag:.4f}∠{np.degrees(phase):.1f}°',
+                color=colors_v[i], linewidth=2)
+
+    ax1.set_ylabel('Voltage (V)', fontsize=12)
+    ax1.set_title('Voltage Time Domain', fontsize=12, fontweight='bold')
+    ax1.grid(True, alpha=0.3)
+    ax1.legend()
+
+    # Current subplot
+    colors_i = plt.cm.tab10(np.linspace(0, 1, len(i_phasors)))
+    for i, ((mag, phase), label) in enumerate(zip(i_phasors, i_labels)):
+        signal = mag * np.cos(omega * t + phase)
+        ax2.plot(t * 1000, signal, label=f'{label}: {mag:.4f}∠{np.degrees(phase):.1f}°',
+                color=colors_i[i], linewidth=2)
+
+    ax2.set_xlabel('Time (ms)', fontsize=12)
+    ax2.set_ylabel('Current (A)', fontsize=12)
+    ax2.set_title('Current Time Domain', fontsize=12, fontweight='bold')
+    ax2.grid(True, alpha=0.3)
+    ax2.legend()
+
+    # Add period markers
+    period_ms = T * 1000
+    for i in range(3):
+        ax1.axvline(x=i*period_ms, color='red', linestyle='--', alpha=0.5)
+        ax2.axvline(x=i*period_ms, color='red', linestyle='--', alpha=0.5)
+
+    plt.tight_layout()
+    plt.savefig(filename, bbox_inches='tight', dpi=dpi)
+    plt.close()
+
+
+AC_PLOTS = ('voltage_phasor', 'current_phasor', 'voltage_time_domain', 'current_time_domain',
+            'combined_time_domain')
+
+
+def render_ac_plot(name, plot_data, filename, dpi):
+    """Render one of AC_PLOTS from run_ac_analysis plot data; returns False when there is nothing to plot."""
+    freq = plot_data['frequency']
+    v_phasors, v_labels = plot_data['voltages']
+    i_phasors, i_labels = plot_data['currents']
+    if name == 'voltage_phasor':
+        plot_phasor_diagram(v_phasors, v_labels, "Voltage Phasor Diagram", filename, dpi)
+    elif name == 'current_phasor':
+        plot_phasor_diagram(i_phasors, i_labels, "Current Phasor Diagram", filename, dpi)
+    elif name == 'voltage_time_domain' and v_phasors:
+        plot_time_domain(v_phasors, v_labels, "Voltage", filename, freq, dpi)
+    elif name == 'current_time_domain' and i_phasors:
+        plot_time_domain(i_phasors, i_labels, "Current", filename, freq, dpi)
+    elif name == 'combined_time_domain' and v_phasors and i_phasors:
+        plot_combined_time_domain(v_phasors, v_labels, i_phasors, i_labels, filename, freq, dpi)
+    else:
+        return False
+    return True
+
+
+@timed('ac')
+def run_ac_analysis(freq, netlist_filename='netlist.txt', netlist=None, return_plot_data=False):
+    """
+    Phasor voltages and currents of the sources and passive elements at freq.
+    No plots are drawn here; with return_plot_data the phasors are returned as
+    a third value for render_ac_plot.
+    """
     try:
-        with open(netlist_filename, 'r') as file:
-            netlist_string = file.read()
+        netlist_string = load_netlist(netlist, netlist_filename)
 
         logger.info("Original netlist:\n%s", netlist_string)
-        netlist_string = preprocess_netlist(netlist_string)
-        netlist_string = convert_ac_sources(netlist_string)
+        with stage('preprocess'):
+            netlist_string = preprocess_netlist(netlist_string)
+            netlist_string = convert_ac_sources(netlist_string)
         logger.info("Processed netlist:\n%s", netlist_string)
 
         try:
-            cct = Circuit(netlist_string)
+            with stage('circuit'):
+                cct = lcapy.Circuit(netlist_string)
             logger.info("Circuit created successfully")
         except Exception as e:
             logger.error(f"Error creating circuit: {e}")
-            return {}, {}
+            return ({}, {}, None) if return_plot_data else ({}, {})
 
         try:
-            cct_ac = cct.ac()
+            with stage('solve'):
+                cct_ac = cct.ac()
             logger.info("AC analysis completed")
             logger.info(f"AC analysis results: {cct_ac}")
         except Exception as e:
             logger.error(f"Error during AC analysis: {e}")
-            return {}, {}
+            return ({}, {}, None) if return_plot_data else ({}, {})
 
         omega_val = 2 * np.pi * freq
         v_phasors, v_labels = [], []
@@ -195,117 +260,112 @@ def run_ac_analysis(freq, netlist_filename='netlist.txt'):
             except Exception as e:
                 logger.error(f"Error processing {component}: {e}")
 
+        # Phasors are evaluated from lcapy's expressions, which is where most of the time goes
         linear_components = ['A', 'V', 'R', 'L', 'C', 'ACSource']
-        for prefix in linear_components:
-            index = 1
-            while True:
-                name = f"{prefix}{index}"
-                if name not in cct_ac.elements:
-                    break
-                logger.info(f"Processing component: {name}")
-                add_phasors(name)
-                index += 1
-
-        # Plot phasor diagrams (original code)
-        fig = plt.figure(figsize=(8, 6))
-        ax = fig.add_subplot(111, polar=True)
-        res_voltages = {}
-        max_v_mag = max((m for m, _ in v_phasors), default=1)
-
-        for (mag, ang), label in zip(v_phasors, v_labels):
-            norm_mag = mag / max_v_mag
-            text = f'{label}: {mag:.6f}∠{np.degrees(ang):.0f}°'
-            ax.plot([0, ang], [0, norm_mag], marker='o', label=text)
-            res_voltages[label] = text.split(": ")[1]
-
-        ax.set_yticklabels([])
-        ax.set_rgrids([0.2, 0.5, 0.8, 1.0], angle=45)
-        ax.legend(bbox_to_anchor=(1.1, 1.05))
-        plt.title("Voltage Phasor Diagram", fontsize=14, fontweight='bold')
-        plt.savefig(_static_dir('ac_analysis_voltage_phasor.png'), bbox_inches='tight')
-        plt.close()
-
-        fig = plt.figure(figsize=(8, 6))
-        ay = fig.add_subplot(111, polar=True)
-        res_currents = {}
-        max_i_mag = max((m for m, _ in i_phasors), default=1)
-
-        for (mag, ang), label in zip(i_phasors, i_labels):
-            norm_mag = mag / max_i_mag
-            text = f'{label}: {mag:.6f}∠{np.degrees(ang):.0f}°'
-            ay.plot([0, ang], [0, norm_mag], marker='o', label=text)
-            res_currents[label] = text.split(": ")[1]
-
-        ay.set_yticklabels([])
-        ay.set_rgrids([0.2, 0.5, 0.8, 1.0], angle=45)
-        ay.legend(bbox_to_anchor=(1.1, 1.05))
-        plt.title("Current Phasor Diagram", fontsize=14, fontweight='bold')
-        plt.savefig(_static_dir('ac_analysis_current_phasor.png'), bbox_inches='tight')
-        plt.close()
-
-        # Plot time domain representations
-        if v_phasors:
-            plot_time_domain(v_phasors, v_labels, "Voltage", 
-                           _static_dir('ac_analysis_voltage_time_domain.png'), freq)
-            logger.info("Voltage time domain plot saved")
-
-        if i_phasors:
-            plot_time_domain(i_phasors, i_labels, "Current", 
-                           _static_dir('ac_analysis_current_time_domain.png'), freq)
-            logger.info("Current time domain plot saved")
-
-        # Combined time domain plot
-        if v_phasors and i_phasors:
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
-            
-            T = 1.0 / freq
-            t = np.linspace(0, 2*T, 1000)
-            omega = 2 * np.pi * freq
-            
-            # Voltage subplot
-            colors_v = plt.cm.tab10(np.linspace(0, 1, len(v_phasors)))
-            for i, ((mag, phase), label) in enumerate(zip(v_phasors, v_labels)):
-                signal = mag * np.cos(omega * t + phase)
-                ax1.plot(t * 1000, signal, label=f'{label}: {mag:.4f}∠{np.degrees(phase):.1f}°', 
-                        color=colors_v[i], linewidth=2)
-            
-            ax1.set_ylabel('Voltage (V)', fontsize=12)
-            ax1.set_title('Voltage Time Domain', fontsize=12, fontweight='bold')
-            ax1.grid(True, alpha=0.3)
-            ax1.legend()
-            
-            # Current subplot
-            colors_i = plt.cm.tab10(np.linspace(0, 1, len(i_phasors)))
-            for i, ((mag, phase), label) in enumerate(zip(i_phasors, i_labels)):
-                signal = mag * np.cos(omega * t + phase)
-                ax2.plot(t * 1000, signal, label=f'{label}: {mag:.4f}∠{np.degrees(phase):.1f}°', 
-                        color=colors_i[i], linewidth=2)
-            
-            ax2.set_xlabel('Time (ms)', fontsize=12)
-            ax2.set_ylabel('Current (A)', fontsize=12)
-            ax2.set_title('Current Time Domain', fontsize=12, fontweight='bold')
-            ax2.grid(True, alpha=0.3)
-            ax2.legend()
-            
-            # Add period markers
-            period_ms = T * 1000
-            for i in range(3):
-                ax1.axvline(x=i*period_ms, color='red', linestyle='--', alpha=0.5)
-                ax2.axvline(x=i*period_ms, color='red', linestyle='--', alpha=0.5)
-            
-            plt.tight_layout()
-            plt.savefig(_static_dir('ac_analysis_combined_time_domain.png'), bbox_inches='tight', dpi=300)
-            plt.close()
-            logger.info("Combined time domain plot saved")
+        with stage('postprocess'):
+            for prefix in linear_components:
+                index = 1
+                while True:
+                    name = f"{prefix}{index}"
+                    if name not in cct_ac.elements:
+                        break
+                    logger.info(f"Processing component: {name}")
+                    add_phasors(name)
+                    index += 1
+
+        res_voltages = {label: f'{mag:.6f}∠{np.degrees(ang):.0f}°' for (mag, ang), label in zip(v_phasors, v_labels)}
+        res_currents = {label: f'{mag:.6f}∠{np.degrees(ang):.0f}°' for (mag, ang), label in zip(i_phasors, i_labels)}
 
         logger.info("Final results - Voltages: %s", res_voltages)
         logger.info("Final results - Currents: %s", res_currents)
 
+        if return_plot_data:
+            plot_data = {'frequency': freq, 'voltages': (v_phasors, v_labels), 'currents': (i_phasors, i_labels)}
+            return res_voltages, res_currents, plot_data
         return res_voltages, res_currents
 
     except Exception as e:
         logger.error(f"Unexpected error in AC analysis: {e}")
-        return {}, {}
+        return ({}, {}, None) if return_plot_data else ({}, {})
+
+SWEEP_TYPES = ('lin', 'dec', 'oct')
+
+
+def frequency_grid(sweep_type, start, stop, points):
+    """
+    SPICE style frequency points: 'lin' spreads points over [start, stop],
+    'dec'/'oct' place points per decade/octave on a log scale.
+    """
+    sweep_type = sweep_type.lower()
+    if sweep_type not in SWEEP_TYPES:
+        raise ValueError(f"Unknown sweep type '{sweep_type}' (use lin, dec or oct)")
+    points = int(points)
+    if points < 1 or stop < start or (sweep_type != 'lin' and start <= 0):
+        raise ValueError(f"Invalid sweep range: start={start}, stop={stop}, points={points}")
+    if sweep_type == 'lin':
+        return np.linspace(start, stop, points)
+    span = np.log10(stop / start) if sweep_type == 'dec' else np.log2(stop / start)
+    count = max(2, int(np.ceil(span * points)) + 1) if stop > start else 1
+    return np.logspace(np.log10(start), np.log10(stop), count)
+
+
+def bode_data(values):
+    """Magnitude, magnitude in dB and phase in degrees of a complex response array."""
+    magnitude = np.abs(values)
+    with np.errstate(divide='ignore'):
+        magnitude_db = 20 * np.log10(magnitude)
+    return {
+        'magnitude': magnitude.tolist(),
+        'magnitude_db': np.where(np.isfinite(magnitude_db), magnitude_db, -400.0).tolist(),
+        'phase': np.degrees(np.angle(values)).tolist(),
+        'real': values.real.tolist(),
+        'imag': values.imag.tolist()
+    }
+
+
+def ac_element_current(circuit, X, element, omegas):
+    """Small-signal current of an element (lcapy sign convention) for every frequency row of X."""
+    kind = element['type']
+    if kind == 'C':
+        return 1j * omegas * element['value'] * circuit.element_voltage(X, element)
+    if kind == 'I':
+        return np.full(len(omegas), -element['ac'])
+    return circuit.element_current(X, element)
+
+
+@timed('ac_sweep')
+def run_ac_sweep(sweep_type='dec', start=1.0, stop=1e6, points=10, netlist_filename='netlist.txt', netlist=None):
+    """
+    Small-signal AC sweep on the numeric MNA engine.
+
+    AC sources ('AC <mag> <phase>') drive the circuit; DC sources are zero.
+    Returns (frequencies, voltages, currents) where voltages holds Bode data for
+    every node (V_node_*) and element (V_*) and currents for every element (I_*).
+    """
+    with stage('preprocess'):
+        netlist_string = preprocess_netlist(load_netlist(netlist, netlist_filename))
+    frequencies = frequency_grid(sweep_type, float(start), float(stop), points)
+    omegas = 2 * np.pi * frequencies
+
+    circuit = MNACircuit(netlist_string)
+    if not np.any(circuit.b_ac):
+        logger.warning("AC sweep: circuit has no AC sources, every response is zero")
+    logger.info(f"AC sweep: {len(frequencies)} points ({sweep_type}) from {frequencies[0]:g} to "
+                f"{frequencies[-1]:g} Hz, system size {circuit.size}")
+    X = circuit.solve_ac(omegas)
+
+    voltages = {}
+    currents = {}
+    with stage('postprocess'):
+        for node, index in circuit.node_index.items():
+            voltages[f'V_node_{node}'] = bode_data(X[:, index])
+        for element in circuit.elements:
+            name = element['name']
+            voltage = np.broadcast_to(circuit.element_voltage(X, element), omegas.shape)
+            current = np.broadcast_to(ac_element_current(circuit, X, element, omegas), omegas.shape)
+            voltages[f'V_{name}'] = bode_data(np.asarray(voltage, dtype=complex))
+            currents[f'I_{name}'] = bode_data(np.asarray(current, dtype=complex))
+    return frequencies.tolist(), voltages, currents
 
 # Example usage
 if __name__ == "__main__":
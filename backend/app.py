@@ -1,22 +1,33 @@
 import traceback
-from flask import Flask, request, jsonify,send_from_directory
+from flask import Flask, request, jsonify,send_from_directory, send_file, Response, stream_with_context, g, make_response
 from databse.db import connect_to_mongo, blogs_collection  
 from auth.routes import auth_bp
 import json  # Import the json module
 import numpy as np  # For numerical operations
 from flask_cors import CORS
-from fastapi import  HTTPException
 from pydantic import BaseModel
 import logging
-from lcapy import Circuit, j, omega, s, t, sin
-import sympy as sp  # For more control over symbolic expressions
 import re
 from transient_analysis import run_transient_analysis
-from ac_analysis import run_ac_analysis
-from dc_analysis import run_dc_analysis
+from ac_analysis import run_ac_analysis, run_ac_sweep, frequency_grid, preprocess_netlist as preprocess_ac_netlist
+from dc_analysis import (run_dc_analysis, preprocess_netlist as preprocess_dc_netlist, wire_aliases,
+                         NUMERIC_WIRES)
 from Z_parameter import run_z_parameter
 from Y_parameter import run_y_parameter
-from S_parameter import run_s_parameter
+from S_parameter import run_s_parameter, graph_cache_info
+from two_port import run_two_port, REPRESENTATIONS as TWO_PORT_REPRESENTATIONS
+from result_cache import result_cache
+from job_queue import job_queue, JobQueueFull, report_progress
+from parallel import parallel_executor
+from plot_cache import plot_cache, PLOTS
+from result_payload import (BinaryPayload, normalize_format, complex_columns, complex_dicts, npz_payload,
+                            touchstone_payload)
+from touchstone import store_touchstone, load_touchstone, FREQUENCY_UNITS
+from parameter_sweep import run_parameter_sweep, DEFAULT_PERCENTILES, DEFAULT_BINS
+from metrics import metrics, stage, set_analysis, bounded, start_request_timer, end_request_timer
+from profiler import profile_store
+import circuit_ir
+from factorization import factorization_cache, ordering_cache
 import os
 from dotenv import load_dotenv
 from flask_jwt_extended import JWTManager
@@ -46,9 +57,11 @@ CORS(app, resources={
                   # production
         ],
         "methods": ["GET", "POST", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "Accept"],
+        "allow_headers": ["Content-Type", "Authorization", "Accept", "X-Profile", "X-Request-Id"],
         "supports_credentials": True,
-        "expose_headers": ["Content-Type", "Authorization"],
+        "expose_headers": ["Content-Type", "Authorization", "Content-Disposition",
+                           "X-Array-frequencies", "X-Array-s", "X-Timing",
+                           "X-Profile-Id"],
         "max_age": 3600
     }
 })
@@ -67,6 +80,74 @@ if not os.path.exists(static_dir):
 # Use Flask's application context to store the image file name instead of a global variable
 app.config['IMG_FILE_NAME'] = ""
 
+# Known values of the metric labels taken from requests; anything else is labelled 'other'
+ANALYSIS_TYPES = ('dc', 'ac', 'ac_sweep', 'transient')
+PARAMETER_TYPES = ('z', 'y', 'h', 'abcd', 'twoport', 's')
+HTTP_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS')
+
+def to_response(response, status):
+    """Flask response for a (payload, status) pair; payloads are JSON unless they are binary."""
+    with stage('serialize'):
+        if isinstance(response, BinaryPayload):
+            return Response(response.data, status=status, mimetype=response.mimetype, headers=response.headers)
+        return jsonify(response), status
+
+def profiled(endpoint, ckt_data, run):
+    """
+    Response of run(ckt_data); when the request asks for it (a 'profile' flag
+    in the body or an X-Profile header, see profiler.py) the analysis and
+    serialization run under the profiler and X-Profile-Id names the result.
+    """
+    body = ckt_data or {}
+    try:
+        mode = profile_store.requested(body.get('profile'), request.headers.get('X-Profile'))
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    if mode is None:
+        return to_response(*run(ckt_data))
+    analysis = body.get('analysisType') or body.get('parameterType')
+    with profile_store.profile(mode, request.headers.get('X-Request-Id'), endpoint=endpoint,
+                               analysis=analysis) as profile_id:
+        response = make_response(to_response(*run(ckt_data)))
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@app.before_request
+def start_timing():
+    g.timer, g.timer_token = start_request_timer()
+
+@app.after_request
+def record_timing(response):
+    """Request metrics, plus the per-stage breakdown of analysis requests in X-Timing (milliseconds)."""
+    timer = g.pop('timer', None)
+    if timer is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    method = bounded(request.method, HTTP_METHODS)
+    metrics.inc('requests_total', 1, 'HTTP requests', endpoint=endpoint, method=method,
+                status=str(response.status_code))
+    metrics.observe('request_duration_seconds', timer.total(), 'HTTP request latency',
+                    endpoint=endpoint, method=method)
+    if timer.analysis is not None or timer.stages:
+        timer.finish()
+        response.headers['X-Timing'] = timer.header()
+    return response
+
+@app.teardown_request
+def end_timing(exc):
+    token = g.pop('timer_token', None)
+    if token is not None:
+        end_request_timer(token)
+
+def publish_plots(analysis_type, plot_data):
+    """
+    Store plot_data for rendering on request and return its plot key, which
+    clients pass to /plots and /get-images as ?key= (None without plot data).
+    """
+    if plot_data is None:
+        return None
+    return plot_cache.put(analysis_type, plot_data)
+
 def validate_component(component):
     """Validate component data structure and values"""
     required_fields = ['type', 'id', 'node', 'value']
@@ -109,26 +190,26 @@ class EmptyRequest(BaseModel):
 
 @app.post("/generate-netlist")
 def generate_netlist():
+    """
+    Netlist for the components of the request body (the /simulation body, or
+    {"components": [...]}). /simulation and /parameter responses carry the
+    netlist they ran as well.
+    """
+    ckt_data = request.get_json(silent=True) or {}
+    try:
+        netlist = json.loads(ckt_data['netList']) if ckt_data.get('netList') else ckt_data
+    except json.JSONDecodeError as e:
+        return jsonify({"error": f"Invalid JSON in netlist: {str(e)}"}), 400
+    components = netlist.get("components") if isinstance(netlist, dict) else None
+    if not components:
+        return jsonify({"error": "Send the circuit's components to build its netlist"}), 400
     try:
-        netlist_path = "netlist.txt"
-        if not os.path.exists(netlist_path):
-            raise HTTPException(status_code=404, detail="netlist.txt not found")
-        with open(netlist_path, "r") as f:
-            file_content = f.read()
-        # circuit = Circuit()
-        # circuit.add(file_content)
-        netlist = file_content
-        logger.info(f"Generated netlist: {netlist}")
-
-        return {"netlist": netlist}
-
-    except HTTPException:
-        # Allow HTTP errors to propagate as they are
-        raise
+        cctt = build_netlist(components)
     except Exception as e:
-        # Log unexpected errors and return a 500 response
         logger.exception("Unexpected error generating netlist")
-        raise HTTPException(status_code=500, detail=str(e))
+        return jsonify({"error": str(e)}), 500
+    logger.info(f"Generated netlist: {cctt}")
+    return jsonify({"netlist": cctt})
 
 @app.route('/', methods=['GET', 'POST', 'OPTIONS', 'HEAD'])
 def simulate():
@@ -165,45 +246,113 @@ def simulate():
         logger.error("Simulation error: %s\n%s", str(e), traceback.format_exc())
         return jsonify({"error": f"Error during simulation: {str(e)}"}), 500
 
-@app.route('/simulation', methods=['GET', 'POST', 'OPTIONS','HEAD'])
-def simulation():
-    if request.method in ['GET', 'HEAD']:          # <‑‑ handle both
-        return (
-            "Circuit Simulator API is running. "
-            "POST your JSON netlist to this simulation  endpoint."
-        )
-    if request.method == 'OPTIONS':
-        return '', 200
+def build_netlist(components):
+    """Netlist (lcapy syntax) of the component list of a /simulation request."""
+    cctt = ""
+    for comp in components:
+        type_prefix = comp.get('type', '')
+        id_ = comp.get('id', '')
+        node1 = comp.get('node1', '')
+        node2 = comp.get('node2', '')
         
-    try:
-        if not request.is_json:
-            logger.warning("Request is not JSON")
-            return jsonify({"error": "Request must be JSON"}), 415
+        # Initialize dependent nodes with empty strings
+        depnode3 = ''
+        depnode4 = ''
+        depVoltage=''
+        phase=''
+       
+        # Handle value extraction properly
+        raw_value = comp.get('value', '')
+        
+        # Debug log to see what we're receiving
+        logger.info(f"Processing component {id_}: type={type_prefix}, raw_value={raw_value}")
+        
+        if isinstance(raw_value, dict):
+            # This is a dependent source with nested structure
+            value = raw_value.get('value', '')
+            depnode3 = raw_value.get('dependentNode1', '')
+            depnode4 = raw_value.get('dependentNode2', '')
+            depVoltage=raw_value.get('Vcontrol','')
+            phase=raw_value.get('phase','')
+            
+            logger.info(f"Extracted from dict - value: {value}, depnode3: {depnode3}, depnode4: {depnode4}")
+        else:
+            # This is a regular component
+            value = raw_value
+            # Try to get dependent nodes from component level (fallback)
+            depnode3 = comp.get('dependentnode1', '')
+            depnode4 = comp.get('dependentnode2', '')
+            depVoltage=comp.get('Vcontrol','')
+            phase=comp.get('phase',0)
             
-        ckt_data = request.get_json()
+        # Ensure value is a string/number, not an object
+        if isinstance(value, dict):
+            logger.error(f"Value is still a dict for component {id_}: {value}")
+            value = str(value)  # Fallback to string representation
+        
+        # Generate the netlist line based on component type
+        if type_prefix in ['AC Source', 'DC Source', 'Inductor', 'Resistor', 'Wire', 'Capacitor', 'Diode', 'Npn Transistor', 'Pnp Transistor', 'P Mosfet', 'N Mosfet', 'VCVS', 'VCCS','CCVS','CCCS','Current Source','Generic']:
+            if type_prefix == 'DC Source':
+                line = f"{id_} {node2} {node1} {value}\n"
+            elif type_prefix == 'AC Source':
+                if phase is None:
+                    phase = 0
+                try:
+                    phase = float(phase)
+                except (ValueError, TypeError):
+                    logger.warning(f"Invalid phase for {id_}, defaulting to 0")
+                    phase = 0
+                line = f"{id_} {node1} {node2} AC {value} {phase}\n"
+            elif type_prefix == 'VCVS':
+                # VCVS format: E<n> <+node> <-node> <+control> <-control> <Voltage gain>
+                line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
+                logger.info(f"Generated VCVS line: {line.strip()}")
+            elif type_prefix == 'VCCS':
+                # VCCS format: G<n> <+node> <-node> <+control> <-control> <transadmitance>
+                line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
+                logger.info(f"Generated VCCS line: {line.strip()}")
+            elif type_prefix == 'CCVS':
+                # VCVS format: E<n> <+node> <-node> <+control> <-control> <transimpedance>
+                line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
+                logger.info(f"Generated CCVS line: {line.strip()}")
+            elif type_prefix == 'CCCS':
+                # VCCS format: G<n> <+node> <-node> <+control> <Current gain>
+                line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
+                logger.info(f"Generated CCCS line: {line.strip()}")    
+            else:
+                line = f"{id_} {node1} {node2} {value}\n"
+            
+            cctt += line
+            logger.info(f"Added to netlist: {line.strip()}")
+    return cctt
+
+def run_simulation(ckt_data):
+    """Run the analysis described by a /simulation request body; returns (response, status)."""
+    try:
         if not ckt_data:
             logger.warning("No JSON data received")
-            return jsonify({"error": "No JSON data received"}), 400
+            return {"error": "No JSON data received"}, 400
             
         netlist_str = ckt_data.get("netList", "")
         if not netlist_str:
             logger.warning("Netlist is empty")
-            return jsonify({"error": "Netlist is empty"}), 400
+            return {"error": "Netlist is empty"}, 400
 
         try:
             netlist = json.loads(netlist_str)
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON in netlist: {str(e)}")
-            return jsonify({"error": f"Invalid JSON in netlist: {str(e)}"}), 400
+            return {"error": f"Invalid JSON in netlist: {str(e)}"}, 400
 
         components = netlist.get("components", [])
         if not components:
             logger.warning("Components are empty")
-            return jsonify({"error": "Components are empty"}), 400
+            return {"error": "Components are empty"}, 400
 
-        cctt = ""
         numberOfNodes = ckt_data.get("numberNodes", 0)
         analysisType = ckt_data.get("analysisType", "dc").lower()
+        set_analysis(bounded(analysisType, ANALYSIS_TYPES))
+        solver = str(ckt_data.get("solver", "numeric")).lower()
         groundNode = netlist.get("groundNode")
 
         try:
@@ -213,215 +362,256 @@ def simulation():
             frequency = 50
             logger.warning("Invalid frequency value, defaulting to 50")
 
+        try:
+            tstop = float(ckt_data.get("tstop", 0.05))
+            tstep = float(ckt_data["tstep"]) if ckt_data.get("tstep") else None
+            if tstop <= 0 or (tstep is not None and (tstep <= 0 or tstep > tstop)):
+                raise ValueError
+        except (ValueError, TypeError):
+            tstop, tstep = 0.05, None
+            logger.warning("Invalid tstop/tstep values, defaulting to 0.05 s with 1000 points")
+        sweep_params = {
+            'sweep_type': str(ckt_data.get("sweepType", "dec")).lower(),
+            'start': ckt_data.get("startFrequency", 1),
+            'stop': ckt_data.get("stopFrequency", 1e6),
+            'points': ckt_data.get("points", 10)
+        }
+        integration_method = str(ckt_data.get("integrationMethod", "trap")).lower()
+        adaptive_step = bool(ckt_data.get("adaptiveStep", True))
 
-        # Process components
-        for comp in components:
-            type_prefix = comp.get('type', '')
-            id_ = comp.get('id', '')
-            node1 = comp.get('node1', '')
-            node2 = comp.get('node2', '')
-            
-            # Initialize dependent nodes with empty strings
-            depnode3 = ''
-            depnode4 = ''
-            depVoltage=''
-            phase=''
-           
-            # Handle value extraction properly
-            raw_value = comp.get('value', '')
-            
-            # Debug log to see what we're receiving
-            logger.info(f"Processing component {id_}: type={type_prefix}, raw_value={raw_value}")
-            
-            if isinstance(raw_value, dict):
-                # This is a dependent source with nested structure
-                value = raw_value.get('value', '')
-                depnode3 = raw_value.get('dependentNode1', '')
-                depnode4 = raw_value.get('dependentNode2', '')
-                depVoltage=raw_value.get('Vcontrol','')
-                phase=raw_value.get('phase','')
-                
-                logger.info(f"Extracted from dict - value: {value}, depnode3: {depnode3}, depnode4: {depnode4}")
-            else:
-                # This is a regular component
-                value = raw_value
-                # Try to get dependent nodes from component level (fallback)
-                depnode3 = comp.get('dependentnode1', '')
-                depnode4 = comp.get('dependentnode2', '')
-                depVoltage=comp.get('Vcontrol','')
-                phase=comp.get('phase',0)
-                
-            # Ensure value is a string/number, not an object
-            if isinstance(value, dict):
-                logger.error(f"Value is still a dict for component {id_}: {value}")
-                value = str(value)  # Fallback to string representation
-            
-            # Generate the netlist line based on component type
-            if type_prefix in ['AC Source', 'DC Source', 'Inductor', 'Resistor', 'Wire', 'Capacitor', 'Diode', 'Npn Transistor', 'Pnp Transistor', 'P Mosfet', 'N Mosfet', 'VCVS', 'VCCS','CCVS','CCCS','Current Source','Generic']:
-                if type_prefix == 'DC Source':
-                    line = f"{id_} {node2} {node1} {value}\n"
-                elif type_prefix == 'AC Source':
-                    if phase is None:
-                        phase = 0
-                    try:
-                        phase = float(phase)
-                    except (ValueError, TypeError):
-                        logger.warning(f"Invalid phase for {id_}, defaulting to 0")
-                        phase = 0
-                    line = f"{id_} {node1} {node2} AC {value} {phase}\n"
-                elif type_prefix == 'VCVS':
-                    # VCVS format: E<n> <+node> <-node> <+control> <-control> <Voltage gain>
-                    line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
-                    logger.info(f"Generated VCVS line: {line.strip()}")
-                elif type_prefix == 'VCCS':
-                    # VCCS format: G<n> <+node> <-node> <+control> <-control> <transadmitance>
-                    line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
-                    logger.info(f"Generated VCCS line: {line.strip()}")
-                elif type_prefix == 'CCVS':
-                    # VCVS format: E<n> <+node> <-node> <+control> <-control> <transimpedance>
-                    line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
-                    logger.info(f"Generated CCVS line: {line.strip()}")
-                elif type_prefix == 'CCCS':
-                    # VCCS format: G<n> <+node> <-node> <+control> <Current gain>
-                    line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
-                    logger.info(f"Generated CCCS line: {line.strip()}")    
-                else:
-                    line = f"{id_} {node1} {node2} {value}\n"
-                
-                cctt += line
-                logger.info(f"Added to netlist: {line.strip()}")
 
-        # Write netlist to file
-        netlist_filename = 'netlist.txt'
-        try:
-            with open(netlist_filename, 'w') as file:
-                file.write(cctt)
-            logger.info("Netlist written to file successfully")
-        except Exception as e:
-            logger.error(f"Error writing netlist to file: {str(e)}")
-            return jsonify({"error": f"Error writing netlist to file: {str(e)}"}), 500
+        with stage('netlist'):
+            cctt = build_netlist(components)
 
+
+        report_progress(f"Running {analysisType} analysis", 0.1)
+        plot_key = None
         try:
             # Run the appropriate analysis
             if analysisType == "dc":
-                logger.info("Starting DC analysis")
-                node_voltages, current = run_dc_analysis()
-                app.config['IMAGES'] = []
+                logger.info(f"Starting DC analysis ({solver})")
+                node_voltages, current, dc_info = result_cache.get_or_compute(
+                    'dc', cctt, {'solver': solver},
+                    lambda: run_dc_analysis(mode=solver, return_info=True, netlist=cctt))
             elif analysisType == "ac":
                 logger.info("Starting AC analysis")
                 # Pass frequency to AC analysis if needed
                 logger.info(f"Frequency: {frequency}")
-                node_voltages, current = run_ac_analysis(frequency)
-                # Updated image list for AC analysis with time domain plots
-                app.config['IMAGES'] = [
-                    ("ac_analysis_voltage_phasor.png", "Voltage Phasor Diagram"),
-                    ("ac_analysis_current_phasor.png", "Current Phasor Diagram"),
-                    ("ac_analysis_voltage_time_domain.png", "Voltage Time Domain"),
-                    ("ac_analysis_current_time_domain.png", "Current Time Domain"),
-                    ("ac_analysis_combined_time_domain.png", "Combined Time Domain")
-                ]
+                node_voltages, current, ac_plot_data = result_cache.get_or_compute(
+                    'ac', cctt, {'frequency': frequency},
+                    lambda: run_ac_analysis(frequency, netlist=cctt, return_plot_data=True))
+                plot_key = publish_plots('ac', ac_plot_data)
+            elif analysisType == "ac_sweep":
+                logger.info(f"Starting AC sweep: {sweep_params}")
+                frequencies, node_voltages, current = result_cache.get_or_compute(
+                    'ac_sweep', cctt, sweep_params,
+                    lambda: run_ac_sweep(netlist=cctt, **sweep_params))
             elif analysisType == "transient":
-                logger.info("Starting Transient analysis")
-                run_transient_analysis()
+                logger.info(f"Starting Transient analysis ({solver}, {integration_method})")
+                transient_params = {'solver': solver, 'tstop': tstop, 'tstep': tstep,
+                                    'method': integration_method, 'adaptive': adaptive_step}
+                _, transient_info, transient_plot_data = result_cache.get_or_compute(
+                    'transient', cctt, transient_params,
+                    lambda: run_transient_analysis(netlist=cctt, mode=solver, tstop=tstop, tstep=tstep,
+                                                   method=integration_method, adaptive=adaptive_step,
+                                                   return_info=True, return_plot_data=True))
+                plot_key = publish_plots('transient', transient_plot_data)
                 node_voltages = {}
                 current = {}
-                app.config['IMAGES'] = [
-                    ("transient_analysis-voltage.png", "Transient Voltage"),
-                    ("transient_analysis-current.png", "Transient Current")
-                ]
             else:
                 logger.error(f"Unsupported analysis type: {analysisType}")
                 raise ValueError(f"Unsupported analysis type: {analysisType}")
 
             logger.info("Analysis completed successfully")
-            return jsonify({
+            response = {
                 "voltages": node_voltages,
                 "current": current,
                 "analysis_type": analysisType,
+                "netlist": cctt,
                 "status": "success"
-            })
+            }
+            if analysisType == "dc":
+                response["solver_info"] = dc_info
+            elif analysisType == "transient":
+                response["solver_info"] = transient_info
+            elif analysisType == "ac_sweep":
+                response["frequencies"] = frequencies
+                response["sweep"] = sweep_params
+            if plot_key is not None:
+                response["plot_key"] = plot_key
+            return response, 200
 
         except Exception as e:
             logger.error(f"Error during {analysisType} analysis: {str(e)}")
             logger.error(traceback.format_exc())
-            return jsonify({
+            return {
                 "error": f"Error during {analysisType} analysis: {str(e)}",
                 "traceback": traceback.format_exc(),
                 "status": "error"
-            }), 500
+            }, 500
 
     except Exception as e:
         logger.error(f"Error during simulation: {str(e)}")
         logger.error(traceback.format_exc())
-        return jsonify({
+        return {
             "error": str(e),
             "traceback": traceback.format_exc(),
             "status": "error"
-        }), 500
+        }, 500
+
+@app.route('/simulation', methods=['GET', 'POST', 'OPTIONS','HEAD'])
+def simulation():
+    if request.method in ['GET', 'HEAD']:          # <‑‑ handle both
+        return (
+            "Circuit Simulator API is running. "
+            "POST your JSON netlist to this simulation  endpoint."
+        )
+    if request.method == 'OPTIONS':
+        return '', 200
+        
+    if not request.is_json:
+        logger.warning("Request is not JSON")
+        return jsonify({"error": "Request must be JSON"}), 415
+    return profiled('simulation', request.get_json(), run_simulation)
+
+
+def run_sweep(ckt_data):
+    """
+    Run the Monte Carlo analysis or parameter sweep described by a /sweep
+    request body; returns (response, status). The body holds a /simulation
+    netList plus the element distributions or value ranges in parameters.
+    """
+    if not ckt_data:
+        logger.warning("No JSON data received")
+        return {"error": "No JSON data received"}, 400
+    try:
+        netlist = json.loads(ckt_data.get("netList") or "{}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid JSON in netlist: {str(e)}")
+        return {"error": f"Invalid JSON in netlist: {str(e)}"}, 400
+    components = netlist.get("components", [])
+    if not components:
+        logger.warning("Components are empty")
+        return {"error": "Components are empty"}, 400
+    parameters = ckt_data.get("parameters")
+    if not parameters or not isinstance(parameters, dict):
+        return {"error": "parameters must map element names to distributions or value ranges"}, 400
+
+    analysis_type = str(ckt_data.get("analysisType", "dc")).lower()
+    mode = str(ckt_data.get("mode", "montecarlo")).lower()
+    set_analysis('sweep')
+    with stage('netlist'):
+        cctt = build_netlist(components)
+    try:
+        if analysis_type == "dc":
+            netlist_string, has_diodes = preprocess_dc_netlist(cctt, wires=NUMERIC_WIRES)
+            if has_diodes:
+                raise ValueError("Parameter sweeps need a linear circuit (no diodes)")
+            frequencies = None
+            # Wire branches are reported under the DC analysis' wire names
+            aliases = wire_aliases(cctt)[0]
+        elif analysis_type == "ac":
+            netlist_string = preprocess_ac_netlist(cctt)
+            if ckt_data.get("sweepType"):
+                frequencies = frequency_grid(str(ckt_data["sweepType"]), float(ckt_data.get("startFrequency", 1)),
+                                             float(ckt_data.get("stopFrequency", 1e6)),
+                                             ckt_data.get("points", 10)).tolist()
+            else:
+                frequencies = [float(ckt_data.get("frequency", 50))]
+            aliases = None
+        else:
+            raise ValueError(f"Unsupported analysis type for sweeps: {analysis_type} (use dc or ac)")
+        seed = ckt_data.get("seed")
+        sweep_params = {
+            'parameters': parameters,
+            'mode': mode,
+            'analysis': analysis_type,
+            'samples': int(ckt_data.get("samples", 1000)),
+            'seed': int(seed) if seed is not None else None,
+            'frequencies': frequencies,
+            'outputs': ckt_data.get("outputs"),
+            'percentiles': [float(q) for q in ckt_data.get("percentiles", DEFAULT_PERCENTILES)],
+            'bins': int(ckt_data.get("bins", DEFAULT_BINS)),
+            'return_samples': ckt_data.get("returnSamples"),
+            'aliases': aliases
+        }
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid sweep request: {e}")
+        return {"error": str(e), "status": "error"}, 400
+
+    report_progress(f"Running {mode} {analysis_type} analysis", 0.1)
+    compute = lambda: run_parameter_sweep(netlist_string, progress=report_progress, **sweep_params)
+    try:
+        if mode == "montecarlo" and sweep_params['seed'] is None:
+            # Unseeded runs are never repeated, so there is nothing to cache
+            result = compute()
+        else:
+            result = result_cache.get_or_compute('sweep', netlist_string, sweep_params, compute)
+    except ValueError as e:
+        logger.warning(f"Sweep failed: {e}")
+        return {"error": str(e), "status": "error"}, 400
+    except Exception as e:
+        logger.error(f"Error during sweep: {str(e)}")
+        logger.error(traceback.format_exc())
+        return {"error": f"Error during sweep: {str(e)}", "status": "error"}, 500
+    return {**result, "analysis_type": analysis_type, "status": "success"}, 200
+
+
+@app.route('/sweep', methods=['POST', 'OPTIONS'])
+def sweep():
+    if request.method == 'OPTIONS':
+        return '', 200
+    if not request.is_json:
+        logger.warning("Request is not JSON")
+        return jsonify({"error": "Request must be JSON"}), 415
+    response, status = run_sweep(request.get_json())
+    return to_response(response, status)
+
+
+def requested_plot_key(analysis_type):
+    """(?key= of the request, None) when it names a stored analysis_type result, else (None, error response)."""
+    if analysis_type not in PLOTS:
+        return None, (jsonify({"error": f"No plots for analysis type: {analysis_type}"}), 404)
+    key = request.args.get('key')
+    if not key:
+        return None, (jsonify({"error": "Pass the plot_key of a /simulation or /parameter response as ?key="}), 400)
+    entry = plot_cache.get(key)
+    if entry is None or entry[0] != analysis_type:
+        return None, (jsonify({"error": f"Unknown or expired {analysis_type} result: {key}"}), 404)
+    return key, None
+
+def rendered_plots(key, dpi=None):
+    """Render (or reuse) every plot of the result stored under key."""
+    analysis_type, _ = plot_cache.get(key)
+    images = []
+    for name, filename, description in PLOTS[analysis_type]:
+        path = plot_cache.render(key, name, dpi)
+        if path is not None:
+            images.append({
+                "url": f"static/plots/{os.path.basename(path)}",
+                "description": description,
+                "filename": filename,
+                "location": "static/plots",
+                "plot": name
+            })
+    return images
 
 @app.route('/get-images/<analysis_type>')
 def get_images(analysis_type):
+    """Every plot of the result named by ?key= (the plot_key of its response)."""
+    key, error = requested_plot_key(analysis_type)
+    if error is not None:
+        return error
     try:
-        # Ensure top-level static exists
-        if not os.path.exists('static'):
-            os.makedirs('static')
-            logger.info("Created static directory")
-
-        # Candidate directories to search (top-level static first, then simulation/<analysis_type>/static)
-        candidate_dirs = [
-            ('static', lambda fn: f"static/{fn}"),
-            (os.path.join('simulation', analysis_type, 'static'), lambda fn: f"simulation/{analysis_type}/static/{fn}")
-        ]
-
-        image_files = {
-            'ac': [
-                ("ac_analysis_voltage_phasor.png", "Voltage Phasor Diagram"),
-                ("ac_analysis_current_phasor.png", "Current Phasor Diagram"),
-                ("ac_analysis_voltage_time_domain.png", "Voltage Time Domain"),
-                ("ac_analysis_current_time_domain.png", "Current Time Domain"),
-            ],
-            's': [
-                ("s_parameters_individual.png", "S-Parameters (Individual Subplots)"),
-                ("s_parameters_combined.png", "S-Parameters (Combined Plot)"),
-                ("s_parameters_phase.png", "S-Parameters Phase")
-            ],
-            'transient': [
-                ("transient_analysis-voltage.png", "Transient Voltage"),
-                ("transient_analysis-current.png", "Transient Current")
-            ]
-        }.get(analysis_type, [])
-
-        if not image_files:
-            logger.warning(f"No image configuration found for analysis type: {analysis_type}")
-            return jsonify({"error": f"No images found for analysis type: {analysis_type}"}), 404
-
-        existing_files = []
-        for filename, description in image_files:
-            found = False
-            for dir_path, url_builder in candidate_dirs:
-                file_path = os.path.join(dir_path, filename)
-                if os.path.exists(file_path):
-                    existing_files.append({
-                        "url": url_builder(filename),
-                        "description": description,
-                        "filename": filename,
-                        "location": dir_path
-                    })
-                    logger.info(f"Found image file: {filename} in {dir_path}")
-                    found = True
-                    break
-            if not found:
-                logger.warning(f"Image file not found: {filename}")
-
-        if not existing_files:
-            logger.warning("No image files found in any static directories")
-            return jsonify({"error": "No image files found. Please run the simulation first."}), 404
-
-        return jsonify(existing_files)
-
+        images = rendered_plots(key, request.args.get('dpi'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting images: {str(e)}")
         return jsonify({"error": str(e)}), 500
+    if not images:
+        return jsonify({"error": f"Nothing to plot for this {analysis_type} result"}), 404
+    return jsonify(images)
 
 
 @app.route('/simulation/<analysis_type>/static/<filename>')
@@ -437,38 +627,122 @@ def serve_simulation_static(analysis_type, filename):
         logger.error(f"Error serving simulation static file {filename} from {analysis_type}: {str(e)}")
         return jsonify({"error": f"File not found: {filename}"}), 404
     
-@app.route('/parameter', methods=['GET', 'POST', 'OPTIONS'])
-def parameter():
-    if request.method == 'OPTIONS':
-        return '', 200 
-    
-    try:  # OUTER TRY (wraps whole function)
+def build_parameter_netlist(components, freqency_prop, freqency_prop_unit):
+    """Component lines and ground line (empty without ports) of a /parameter request."""
+    component_lines = []
+    grnd = ""
+    for comp in components:
+        type_prefix = comp.get('type', '')
+        id_ = comp.get('id', '')
+        node1 = comp.get('node1', '')
+        node2 = comp.get('node2', '')
+        depnode3 = ''
+        depnode4 = ''
+        depVoltage = ''
+        phase = ''
+        impedance = ''
+        electrical_length = ''
+        impedance_Zo=''
+        raw_value = comp.get('value', '')
+        logger.info(f"Processing component {id_}: type={type_prefix}, raw_value={raw_value}")
+
+        if isinstance(raw_value, dict):
+            value = raw_value.get('value', '')
+            depnode3 = raw_value.get('dependentNode1', '')
+            depnode4 = raw_value.get('dependentNode2', '')
+            depVoltage = raw_value.get('Vcontrol', '')
+            phase = raw_value.get('phase', '')
+            impedance = raw_value.get('impedance', 50)
+            electrical_length = raw_value.get('electrical_length', '90')
+            impedance_Zo = raw_value.get('impedance_Zo', '50')
+            logger.info(f"Extracted from dict - impedance_Zo: {impedance_Zo}")
 
-        if not request.is_json:
-            logger.warning("Request is not JSON")
-            return jsonify({"error": "Request must be JSON"}), 415
-            
-        ckt_data = request.get_json()
+        else:
+            value = raw_value
+            depnode3 = comp.get('dependentnode1', '')
+            depnode4 = comp.get('dependentnode2', '')
+            depVoltage = comp.get('Vcontrol', '')
+            phase = comp.get('phase', '0')
+            impedance = comp.get('impedance', 50)
+            electrical_length = comp.get('electrical_length', '90')
+            # For ports, also try to get impedance_Zo from component level
+            if type_prefix == 'port':
+                impedance_Zo = comp.get('impedance_Zo', '50')
+                logger.info(f"Extracted impedance_Zo from component level: {impedance_Zo}")
+        if isinstance(value, dict):
+            logger.error(f"Value is still a dict for component {id_}: {value}")
+            value = str(value)
+
+        if type_prefix in [
+            'AC Source', 'DC Source', 'Inductor', 'Resistor', 'Wire', 'Capacitor',
+            'Diode', 'Npn Transistor', 'Pnp Transistor', 'P Mosfet', 'N Mosfet',
+            'VCVS', 'VCCS', 'CCVS', 'CCCS', 'Current Source', 'Transmission line',
+            'Open Stub', 'Short Stub', 'port', 'Generic', 'Touchstone'
+        ]:
+            if type_prefix == 'DC Source':
+                line = f"{id_} {node2} {node1} {value}\n"
+            elif type_prefix == 'AC Source':
+                line = f"{id_} {node1} {node2} AC {value} {phase}\n"
+            elif type_prefix == 'VCVS':
+                line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
+            elif type_prefix == 'VCCS':
+                line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
+            elif type_prefix == 'CCVS':
+                line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
+            elif type_prefix == 'CCCS':
+                line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
+            elif type_prefix == 'Transmission line':
+                line = f"{id_} {node1} {node2} {impedance} {electrical_length} {freqency_prop} {freqency_prop_unit}\n"
+            elif type_prefix == 'Open Stub':
+                line = f"OS{id_[-1]} {node1} {0} {impedance} {electrical_length} {freqency_prop} {freqency_prop_unit}\n"
+            elif type_prefix == 'Short Stub':
+                line = f"SS{id_[-1]} {node1} {0} {impedance} {electrical_length} {freqency_prop} {freqency_prop_unit}\n"
+            elif type_prefix == 'port':
+                # Port format: Port<n> <node> <ground> <impedance>
+                # Ensure impedance_Zo has a value, default to 50 if empty
+                if impedance_Zo is None or impedance_Zo == '':
+                    impedance_Zo = '50'
+                line = f"Port{id_[-1]} {node1} {0} {impedance_Zo}\n"    
+                grnd = f"Ground {0} {1} {1}\n"
+                logger.info(f"Generated port line: {line.strip()}, impedance_Zo: {impedance_Zo}")
+            elif type_prefix == 'Wire':
+                line = f"{id_} {node1} {node2}\n"
+            elif type_prefix == 'Touchstone':
+                # Black box: X<n> <node of each port> <id returned by /touchstone>
+                touchstone_nodes = raw_value.get('nodes') if isinstance(raw_value, dict) else None
+                touchstone_nodes = touchstone_nodes or [node1, node2]
+                touchstone_id = raw_value.get('file', '') if isinstance(raw_value, dict) else value
+                name = id_ if id_.upper().startswith('X') else f"X{id_}"
+                line = f"{name} {' '.join(str(n) for n in touchstone_nodes)} {touchstone_id}\n"
+            else:
+                line = f"{id_} {node1} {node2} {value}\n"
+            component_lines.append(line)    
+            logger.info(f"Added to netlist: {line.strip()}")
+    return component_lines, grnd
+
+def run_parameter(ckt_data):
+    """Compute the network parameters described by a /parameter request body; returns (response, status)."""
+    try:
         if not ckt_data:
             logger.warning("No JSON data received")
-            return jsonify({"error": "No JSON data received"}), 400
+            return {"error": "No JSON data received"}, 400
             
         netlist_str = ckt_data.get("netList", "")
         if not netlist_str:
             logger.warning("Netlist is empty")
-            return jsonify({"error": "Netlist is empty"}), 400
+            return {"error": "Netlist is empty"}, 400
 
         # Parse netlist
         try:
             netlist = json.loads(netlist_str)
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON in netlist: {str(e)}")
-            return jsonify({"error": f"Invalid JSON in netlist: {str(e)}"}), 400
+            return {"error": f"Invalid JSON in netlist: {str(e)}"}, 400
 
         components = netlist.get("components", [])
         if not components:
             logger.warning("Components are empty")
-            return jsonify({"error": "Components are empty"}), 400
+            return {"error": "Components are empty"}, 400
 
         cctt = ""
         freq =""
@@ -477,6 +751,15 @@ def parameter():
         component_lines=[]
         numberOfNodes = ckt_data.get("numberNodes", 0)
         parameterType = ckt_data.get("parameterType", "z").lower()
+        set_analysis(bounded(parameterType, PARAMETER_TYPES))
+        # Z/Y default to the symbolic lcapy path; "numeric" uses port-excited MNA solves
+        parameter_solver = str(ckt_data.get("solver", "symbolic")).lower()
+        # S-parameter payload: nested JSON dicts (default), base64 columns or an npz file
+        try:
+            response_format, response_dtype = normalize_format(ckt_data.get("responseFormat"),
+                                                               ckt_data.get("dtype"))
+        except ValueError as e:
+            return {"error": str(e), "status": "error"}, 400
         groundNode = netlist.get("groundNode")
 
         # Parse ports safely
@@ -525,87 +808,8 @@ def parameter():
             endfrequency = 1
             logger.warning("Invalid frequency values, using defaults")
         # Build netlist text
-        for comp in components:
-            type_prefix = comp.get('type', '')
-            id_ = comp.get('id', '')
-            node1 = comp.get('node1', '')
-            node2 = comp.get('node2', '')
-            depnode3 = ''
-            depnode4 = ''
-            depVoltage = ''
-            phase = ''
-            impedance = ''
-            electrical_length = ''
-            impedance_Zo=''
-            raw_value = comp.get('value', '')
-            logger.info(f"Processing component {id_}: type={type_prefix}, raw_value={raw_value}")
-
-            if isinstance(raw_value, dict):
-                value = raw_value.get('value', '')
-                depnode3 = raw_value.get('dependentNode1', '')
-                depnode4 = raw_value.get('dependentNode2', '')
-                depVoltage = raw_value.get('Vcontrol', '')
-                phase = raw_value.get('phase', '')
-                impedance = raw_value.get('impedance', 50)
-                electrical_length = raw_value.get('electrical_length', '90')
-                impedance_Zo = raw_value.get('impedance_Zo', '50')
-                logger.info(f"Extracted from dict - impedance_Zo: {impedance_Zo}")
-                
-            else:
-                value = raw_value
-                depnode3 = comp.get('dependentnode1', '')
-                depnode4 = comp.get('dependentnode2', '')
-                depVoltage = comp.get('Vcontrol', '')
-                phase = comp.get('phase', '0')
-                impedance = comp.get('impedance', 50)
-                electrical_length = comp.get('electrical_length', '90')
-                # For ports, also try to get impedance_Zo from component level
-                if type_prefix == 'port':
-                    impedance_Zo = comp.get('impedance_Zo', '50')
-                    logger.info(f"Extracted impedance_Zo from component level: {impedance_Zo}")
-            if isinstance(value, dict):
-                logger.error(f"Value is still a dict for component {id_}: {value}")
-                value = str(value)
-
-            if type_prefix in [
-                'AC Source', 'DC Source', 'Inductor', 'Resistor', 'Wire', 'Capacitor',
-                'Diode', 'Npn Transistor', 'Pnp Transistor', 'P Mosfet', 'N Mosfet',
-                'VCVS', 'VCCS', 'CCVS', 'CCCS', 'Current Source', 'Transmission line',
-                'Open Stub', 'Short Stub', 'port', 'Generic'
-            ]:
-                if type_prefix == 'DC Source':
-                    line = f"{id_} {node2} {node1} {value}\n"
-                elif type_prefix == 'AC Source':
-                    line = f"{id_} {node1} {node2} AC {value} {phase}\n"
-                elif type_prefix == 'VCVS':
-                    line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
-                elif type_prefix == 'VCCS':
-                    line = f"{id_} {node1} {node2} {depnode3} {depnode4} {value}\n"
-                elif type_prefix == 'CCVS':
-                    line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
-                elif type_prefix == 'CCCS':
-                    line = f"{id_} {node1} {node2} {depVoltage} {value}\n"
-                elif type_prefix == 'Transmission line':
-                    line = f"{id_} {node1} {node2} {impedance} {electrical_length} {freqency_prop} {freqency_prop_unit}\n"
-                elif type_prefix == 'Open Stub':
-                    line = f"OS{id_[-1]} {node1} {0} {impedance} {electrical_length} {freqency_prop} {freqency_prop_unit}\n"
-                elif type_prefix == 'Short Stub':
-                    line = f"SS{id_[-1]} {node1} {0} {impedance} {electrical_length} {freqency_prop} {freqency_prop_unit}\n"
-                elif type_prefix == 'port':
-                    # Port format: Port<n> <node> <ground> <impedance>
-                    # Ensure impedance_Zo has a value, default to 50 if empty
-                    if impedance_Zo is None or impedance_Zo == '':
-                        impedance_Zo = '50'
-                    line = f"Port{id_[-1]} {node1} {0} {impedance_Zo}\n"    
-                    grnd = f"Ground {0} {1} {1}\n"
-                    logger.info(f"Generated port line: {line.strip()}, impedance_Zo: {impedance_Zo}")
-                elif type_prefix == 'Wire':
-                    line = f"{id_} {node1} {node2}\n"
-                else:
-                    line = f"{id_} {node1} {node2} {value}\n"
-                component_lines.append(line)    
-                logger.info(f"Added to netlist: {line.strip()}")
-        
+        with stage('netlist'):
+            component_lines, grnd = build_parameter_netlist(components, freqency_prop, freqency_prop_unit)
         # Build the complete netlist after processing all components
         cctt = ''.join(component_lines)
         
@@ -619,39 +823,84 @@ def parameter():
             cctt += grnd
             logger.info(f"Added ground to netlist: {grnd.strip()}")
         
-        # Save netlist file
-        try:
-            with open('netlist.txt', 'w') as file:
-                file.write(cctt)
-            logger.info("Netlist written to file successfully")
-        except Exception as e:
-            logger.error(f"Error writing netlist to file: {str(e)}")
-            return jsonify({"error": f"Error writing netlist to file: {str(e)}"}), 500
+        report_progress(f"Computing {parameterType} parameters", 0.1)
 
         # Run the appropriate analysis
-        if parameterType == "z":
+        def run_numeric_two_port():
+            if ckt_data.get("sweepType"):
+                frequencies = frequency_grid(str(ckt_data["sweepType"]), float(ckt_data.get("startFrequency", 1)),
+                                             float(ckt_data.get("stopFrequency", 1e6)),
+                                             ckt_data.get("points", 10)).tolist()
+            else:
+                frequencies = [frequency]
+            return result_cache.get_or_compute(
+                'twoport', cctt, {'frequencies': frequencies, 'ports': [p1n1, p1n2, p2n1, p2n2]},
+                lambda: run_two_port(frequencies, p1n1, p1n2, p2n1, p2n2, netlist=cctt))
+
+        def two_port_numeric(result, kind):
+            """str(complex) per parameter, or a list of them for a sweep; None where undefined."""
+            single = len(result['frequencies']) == 1
+            return {name: (None if values[0] is None else str(values[0])) if single
+                    else [None if v is None else str(v) for v in values]
+                    for name, values in result[kind].items()}
+
+        if parameterType in ("z", "y") and parameter_solver == "numeric":
+            logger.info(f"Starting numeric {parameterType.upper()}-parameter")
+            two_port = run_numeric_two_port()
+            return {
+                "parameters": {
+                    "symbolic": {},
+                    "numeric": two_port_numeric(two_port, parameterType)
+                },
+                "frequencies": two_port["frequencies"],
+                "reciprocal": two_port["reciprocal"],
+                "parameter_type": parameterType,
+                "netlist": cctt,
+                "status": "success"
+            }, 200
+
+        elif parameterType in ("h", "abcd", "twoport"):
+            logger.info(f"Starting numeric two-port extraction ({parameterType})")
+            two_port = run_numeric_two_port()
+            kinds = TWO_PORT_REPRESENTATIONS if parameterType == "twoport" else (parameterType,)
+            return {
+                "parameters": {kind: two_port_numeric(two_port, kind) for kind in kinds},
+                "frequencies": two_port["frequencies"],
+                "reciprocal": two_port["reciprocal"],
+                "parameter_type": parameterType,
+                "netlist": cctt,
+                "status": "success"
+            }, 200
+
+        elif parameterType == "z":
             logger.info("Starting Z-parameter")
-            z_params = run_z_parameter(frequency, p1n1, p1n2, p2n1, p2n2)
-            return jsonify({
+            z_params = result_cache.get_or_compute(
+                'z', cctt, {'frequency': frequency, 'ports': [p1n1, p1n2, p2n1, p2n2]},
+                lambda: run_z_parameter(frequency, p1n1, p1n2, p2n1, p2n2, netlist=cctt))
+            return {
                 "parameters": {
                     "symbolic": z_params["symbolic"],
                     "numeric": {k: str(v) for k, v in z_params["numeric"].items()}
                 },
                 "parameter_type": "z",
+                "netlist": cctt,
                 "status": "success"
-            })
+            }, 200
 
         elif parameterType == "y":
             logger.info("Starting Y-parameter")
-            y_params = run_y_parameter(frequency, p1n1, p1n2, p2n1, p2n2)
-            return jsonify({
+            y_params = result_cache.get_or_compute(
+                'y', cctt, {'frequency': frequency, 'ports': [p1n1, p1n2, p2n1, p2n2]},
+                lambda: run_y_parameter(frequency, p1n1, p1n2, p2n1, p2n2, netlist=cctt))
+            return {
                 "parameters": {
                     "symbolic": y_params["symbolic"],
                     "numeric": {k: str(v) for k, v in y_params["numeric"].items()}
                 },
                 "parameter_type": "y",
+                "netlist": cctt,
                 "status": "success"
-            })
+            }, 200
 
         elif parameterType == "s":
 
@@ -660,18 +909,23 @@ def parameter():
             logger.info(f"End Frequency: {endfrequency}")
 
             calculator = run_s_parameter()
-            # Read the netlist file and pass the content to the calculator
-            with open('netlist.txt', 'r') as f:
-                netlist_content = f.read()
-            S_params = calculator(netlist_content)
+
+            def compute_s():
+                s = calculator(cctt)
+                return {'s': s, 'port_impedances': getattr(calculator, 'port_impedances', [])}
+
+            # Ports are ordered by the first appearance of their node in the netlist (then by
+            # line), so the netlist is not reordered
+            s_result = result_cache.get_or_compute('s_ports', cctt, {}, compute_s, order_sensitive=True)
+            S_params = s_result['s']
 
             if S_params is None:
                 logger.error("❌ run_s_parameter returned None!")
-                return jsonify({
+                return {
                     'success': False,
                     'message': 'S-parameter calculation failed',
                     'error': 'No S-parameters returned'
-                }), 500
+                }, 500
 
             # # Check if S_params is empty
             # if S_params.size == 0:
@@ -683,6 +937,7 @@ def parameter():
             #     }), 500
 
             # logger.info(f"✅ S_params received: shape={S_params.shape}, dtype={S_params.dtype}")
+            plot_key = None
             try:
                 
                 import skrf as rf
@@ -691,76 +946,63 @@ def parameter():
                 else:
                     freq_range = rf.Frequency(start=startfrequency, stop=endfrequency, npoints=len(S_params), unit='GHz')
                 
-                # Import the plotting function
-                from S_parameter import plot_s_parameters
-                plot_path = plot_s_parameters(freq_range, S_params, save_dir='static')
-                logger.info(f"Plot generated at: {plot_path}")
+                # The plot itself is only rendered when it is requested
+                plot_key = publish_plots('s', {'frequencies': freq_range.f, 's': S_params})
             except Exception as plot_error:
-                logger.error(f"Error generating plot: {plot_error}")
+                logger.error(f"Error storing plot data: {plot_error}")
                 logger.error(traceback.format_exc())
             
-            def complex_to_dict(complex_array):
-                """
-                Convert numpy array of S-parameters to JSON-serializable format.
-                Input shape: (nfreqs, 2, 2) - number of frequencies x 2x2 matrix
-                """
-                try:
-                    result = []
-                    for freq_point in complex_array:  # Iterate over frequency points
-                        freq_data = []
-                        for row in freq_point:  # Iterate over rows (2 rows)
-                            row_data = []
-                            for val in row:  # Iterate over columns (2 columns)
-                                if isinstance(val, (complex, np.complex64, np.complex128)):
-                                    row_data.append({
-                                        'real': float(np.real(val)),
-                                        'imag': float(np.imag(val)),
-                                        'magnitude': float(np.abs(val)),
-                                        'phase_deg': float(np.angle(val) * 180 / np.pi)
-                                    })
-                                else:
-                                    row_data.append({
-                                        'real': float(val),
-                                        'imag': 0.0,
-                                        'magnitude': float(abs(val)),
-                                        'phase_deg': 0.0
-                                    })
-                            freq_data.append(row_data)  # Append complete row
-                        result.append(freq_data)  # Append complete matrix for this frequency
-                    return result
-                except Exception as e:
-                    logger.error(f"Error converting complex array to dictionary: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
-                    return []
-
-            # Convert S-parameters to JSON-serializable format
-            s_params_serializable = complex_to_dict(S_params)
-            
             # Generate frequency array
             if startfrequency == endfrequency:
                 frequencies = [float(startfrequency)]
             else:
                 frequencies = np.linspace(startfrequency, endfrequency, len(S_params)).tolist()
-
-            # Debug logging
-            # logger.info(f"S-parameters shape: {S_params.shape}")
-            logger.info(f"Serialized data length: {len(s_params_serializable)}")
             logger.info(f"Frequencies length: {len(frequencies)}")
-            if s_params_serializable:
-                logger.info(f"First S-parameter matrix structure: {s_params_serializable[0]}")
+
+            if response_format == "touchstone":
+                # In the port order of the S matrix
+                port_impedances = s_result['port_impedances']
+                z0 = port_impedances[0] if port_impedances else 50.0
+                s_export = np.asarray(S_params)
+                if any(z != z0 for z in port_impedances):
+                    # Touchstone v1 has a single reference impedance
+                    from skrf import renormalize_s
+                    z0 = 50.0
+                    s_export = renormalize_s(s_export, port_impedances, z0)
+                frequencies_hz = np.asarray(frequencies) * FREQUENCY_UNITS.get(freqency_prop_unit.lower(), 1e9)
+                return touchstone_payload(frequencies_hz, s_export, z0,
+                                          comment="S-parameters exported by the circuit simulator"), 200
+
+            if response_format == "npz":
+                return npz_payload({'frequencies': frequencies, 's': S_params}, response_dtype,
+                                   filename='s_parameters.npz'), 200
+
+            if response_format == "columnar":
+                # Base64 real/imag columns straight from the array instead of one dict per entry
+                s_params_serializable = complex_columns(S_params, response_dtype)
             else:
-                logger.error("Serialized S-parameters is EMPTY!")
+                # Convert S-parameters to JSON-serializable format
+                try:
+                    s_params_serializable = complex_dicts(S_params)
+                except Exception as e:
+                    logger.error(f"Error converting complex array to dictionary: {e}")
+                    logger.error(traceback.format_exc())
+                    s_params_serializable = []
+                if not s_params_serializable:
+                    logger.error("Serialized S-parameters is EMPTY!")
 
             # Return with correct field names matching frontend expectations
-            return jsonify({
+            return {
                 'success': True,
                 'message': 'S-parameters calculated successfully',
                 'sparameters': s_params_serializable,  # NO UNDERSCORE
                 'frequencies': frequencies,
-                # 'shape': list(S_params.shape),
-                'parametertype': 's'  # LOWERCASE 't'
-            })
+                'shape': list(np.shape(S_params)),
+                'format': response_format,
+                'parametertype': 's',  # LOWERCASE 't'
+                'netlist': cctt,
+                'plot_key': plot_key
+            }, 200
 
         else:
             raise ValueError(f"Unsupported parameter type: {parameterType}")
@@ -770,13 +1012,216 @@ def parameter():
     except Exception as e:   # OUTER EXCEPT
         logger.error(f"Error during simulation: {str(e)}")
         logger.error(traceback.format_exc())
-        return jsonify({
+        return {
             "error": str(e),
             "traceback": traceback.format_exc(),
             "status": "error"
-        }), 500
+        }, 500
+
+@app.route('/plots/<analysis_type>/<plot_name>')
+def get_plot(analysis_type, plot_name):
+    """PNG of one plot of the ?key= result of analysis_type, rendered on first request."""
+    key, error = requested_plot_key(analysis_type)
+    if error is not None:
+        return error
+    set_analysis(analysis_type)
+    try:
+        path = plot_cache.render(key, plot_name, request.args.get('dpi'))
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if path is None:
+        return jsonify({"error": f"Nothing to plot in {plot_name} for this result"}), 404
+    return send_file(path, mimetype='image/png', max_age=3600)
+
+@app.route('/parameter', methods=['GET', 'POST', 'OPTIONS'])
+def parameter():
+    if request.method == 'OPTIONS':
+        return '', 200 
+    
+    if not request.is_json:
+        logger.warning("Request is not JSON")
+        return jsonify({"error": "Request must be JSON"}), 415
+    return profiled('parameter', request.get_json(), run_parameter)
+
+
+# Plot data published inside a job process is in the shared plot store, under the response's plot_key
+
+def simulation_job(ckt_data):
+    return run_simulation(ckt_data)
 
 
+def parameter_job(ckt_data):
+    response, status = run_parameter(ckt_data)
+    if isinstance(response, BinaryPayload) and not isinstance(response.data, bytes):
+        # Streams cannot leave the job process
+        response.data = b''.join(response.data)
+    return response, status
+
+
+def sweep_job(ckt_data):
+    return run_sweep(ckt_data)
+
+
+JOB_KINDS = {'simulation': simulation_job, 'parameter': parameter_job, 'sweep': sweep_job}
+
+
+@app.route('/jobs/<kind>', methods=['POST', 'OPTIONS'])
+def submit_job(kind):
+    """Queue a /simulation, /parameter or /sweep request body as a background job."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    if kind not in JOB_KINDS:
+        return jsonify({"error": f"Unknown job type: {kind} (use one of {', '.join(JOB_KINDS)})"}), 404
+    if not request.is_json:
+        logger.warning("Request is not JSON")
+        return jsonify({"error": "Request must be JSON"}), 415
+    try:
+        job = job_queue.submit(kind, JOB_KINDS[kind], request.get_json())
+    except JobQueueFull as e:
+        logger.warning(str(e))
+        return jsonify({"error": str(e), "status": "error"}), 503
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/jobs/metrics', methods=['GET'])
+def job_metrics():
+    return jsonify({**job_queue.stats(), 'parallel': parallel_executor.stats()})
+
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    if request.method == 'DELETE':
+        if not job_queue.cancel(job_id):
+            return jsonify({"error": f"Job {job_id} not found or already finished"}), 404
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if not job.done:
+        return jsonify(job.to_dict()), 202
+    if job.state != 'succeeded':
+        status = {'timeout': 504, 'cancelled': 410}.get(job.state, 500)
+        return jsonify({"error": job.error, "state": job.state, "status": "error"}), status
+    response, status = job.result
+    return to_response(response, status)
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events with the state changes and progress of a job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        after = 0
+
+    def stream(after):
+        # Holds a thread for as long as the client listens - see worker_class in gunicorn.conf.py
+        while True:
+            events, done = job_queue.wait_events(job_id, after)
+            if not events and not done:
+                yield ": keep-alive\n\n"
+            for event in events:
+                after = event['id']
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            if done and not events:
+                return
+
+    return Response(stream_with_context(stream(after)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/touchstone', methods=['POST', 'OPTIONS'])
+def upload_touchstone():
+    """Store a .sNp file (multipart 'file' field, or the raw body with ?filename=) for use as an X element."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, filename = upload.stream, upload.filename
+    else:
+        stream, filename = request.stream, request.args.get('filename', '')
+    try:
+        touchstone_id, data = store_touchstone(stream, filename)
+    except ValueError as e:
+        logger.error(f"Touchstone upload failed: {e}")
+        return jsonify({"error": str(e), "status": "error"}), 400
+    nodes = ' '.join(f'<node{i + 1}>' for i in range(data.nports))
+    return jsonify({"id": touchstone_id, "filename": filename, **data.info(),
+                    "element": f"X1 {nodes} {touchstone_id}", "status": "success"}), 201
+
+
+@app.route('/touchstone/<touchstone_id>', methods=['GET'])
+def touchstone_info(touchstone_id):
+    try:
+        data = load_touchstone(touchstone_id)
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 404
+    return jsonify({"id": touchstone_id, **data.info(), "comments": data.comments})
+
+
+def _gauges(prefix, stats):
+    return {f'{prefix}_{name}': (f'{prefix} {name}'.replace('_', ' '), value) for name, value in stats.items()
+            if isinstance(value, (int, float))}
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, analysis and stage latency histograms and cache/queue gauges in the Prometheus text format."""
+    gauges = {**_gauges('result_cache', result_cache.stats()), **_gauges('plot_cache', plot_cache.stats()),
+              **_gauges('job_queue', job_queue.stats()), **_gauges('parallel', parallel_executor.stats()),
+              **_gauges('circuit_cache', circuit_ir.cache_info()),
+              **_gauges('connection_graph_cache', graph_cache_info()),
+              **_gauges('factorization_cache', factorization_cache.stats()),
+              **_gauges('ordering_cache', ordering_cache.stats())}
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    if not profile_store.authorized(request.headers.get('X-Profile')):
+        return jsonify({"error": "A valid X-Profile token is required"}), 403
+    return jsonify({"profiles": profile_store.list(), "max_profiles": profile_store.max_profiles})
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+@app.route('/profiles/<profile_id>/<kind>', methods=['GET'])
+def get_profile(profile_id, kind=None):
+    """Summary (top functions) of a stored profile, or one of its files: pstats, text or collapsed stacks."""
+    if not profile_store.authorized(request.headers.get('X-Profile')):
+        return jsonify({"error": "A valid X-Profile token is required"}), 403
+    info = profile_store.get(profile_id)
+    if info is None:
+        return jsonify({"error": f"Unknown or expired profile: {profile_id}"}), 404
+    if kind is None:
+        return jsonify(info)
+    path = profile_store.path(profile_id, kind)
+    if path is None:
+        return jsonify({"error": f"Profile {profile_id} has no {kind} data (available: {', '.join(info['files'])})"}), 404
+    mimetype = 'application/octet-stream' if kind == 'pstats' else 'text/plain'
+    return send_file(path, mimetype=mimetype, as_attachment=kind == 'pstats',
+                     download_name=os.path.basename(path))
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({**result_cache.stats(), 'plots': plot_cache.stats(),
+                    'orderings': {**ordering_cache.stats(), 'topologies': ordering_cache.topologies()}})
+
+@app.route('/cache', methods=['DELETE'])
+def clear_cache():
+    result_cache.clear()
+    plot_cache.clear()
+    logger.info("Result and plot caches cleared")
+    return jsonify({"message": "Cache cleared"}), 200
+
 @app.route('/blog/form', methods=['POST', 'GET'])
 def blog_posts():
     if blogs_collection is None:
@@ -0,0 +1,141 @@
+"""
+Generated reference circuits of growing size for the benchmarks.
+
+Every generator returns a Circuit whose netlist uses the lcapy syntax that
+app.build_netlist produces (plain numbers, integer node names, ground 0),
+driven by V1 as a 'dc', 'ac' or 'none' (passive two-port) source. input and
+output are the nodes used as port 1 and port 2 of the two-port engines.
+"""
+from collections import namedtuple
+
+Circuit = namedtuple('Circuit', 'family size netlist input output elements')
+
+SOURCES = ('dc', 'ac', 'none')
+
+# Sizes per family, roughly doubling the element count at every step
+SIZES = {
+    'ladder': (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    'mesh': (2, 3, 4, 6, 8, 12, 16, 24),
+    'rc_tree': (2, 3, 4, 5, 6, 7, 8, 9),
+    'filter_cascade': (1, 2, 4, 8, 16, 32, 64, 128, 256),
+    'diode_bridge': (1, 2, 4, 8, 16, 32, 64, 128),
+}
+
+
+def _source(kind, node):
+    if kind == 'ac':
+        return [f"V1 {node} 0 AC 1 0"]
+    if kind == 'dc':
+        return [f"V1 {node} 0 5"]
+    return []
+
+
+def _circuit(family, size, lines, input_node, output_node):
+    return Circuit(family, size, '\n'.join(lines) + '\n', str(input_node), str(output_node), len(lines))
+
+
+def ladder(size, source='dc'):
+    """size R-C sections: series R from node i to i+1, C from i+1 to ground."""
+    lines = _source(source, 1)
+    for i in range(1, size + 1):
+        lines.append(f"R{i} {i} {i + 1} 1000")
+        lines.append(f"C{i} {i + 1} 0 1e-09")
+    return _circuit('ladder', size, lines, 1, size + 1)
+
+
+def mesh(size, source='dc'):
+    """size x size resistor grid with a capacitor to ground at every grid node."""
+    def node(row, col):
+        return row * size + col + 1
+
+    lines = _source(source, 1)
+    r = c = 0
+    for row in range(size):
+        for col in range(size):
+            if col + 1 < size:
+                r += 1
+                lines.append(f"R{r} {node(row, col)} {node(row, col + 1)} 100")
+            if row + 1 < size:
+                r += 1
+                lines.append(f"R{r} {node(row, col)} {node(row + 1, col)} 100")
+            if (row, col) != (0, 0):
+                c += 1
+                lines.append(f"C{c} {node(row, col)} 0 1e-09")
+    return _circuit('mesh', size, lines, 1, node(size - 1, size - 1))
+
+
+def rc_tree(size, source='dc'):
+    """Binary tree of depth size: R from parent to child, C from every child to ground."""
+    lines = _source(source, 1)
+    for child in range(2, 2 ** size):
+        lines.append(f"R{child - 1} {child // 2} {child} 1000")
+        lines.append(f"C{child - 1} {child} 0 1e-09")
+    return _circuit('rc_tree', size, lines, 1, 2 ** size - 1)
+
+
+def filter_cascade(size, source='dc'):
+    """size LC low-pass sections between a 50 ohm source and a 50 ohm load."""
+    lines = _source(source, 1)
+    lines.append("R1 1 2 50")
+    for i in range(1, size + 1):
+        lines.append(f"L{i} {i + 1} {i + 2} 1e-06")
+        lines.append(f"C{i} {i + 2} 0 1e-09")
+    lines.append(f"R2 {size + 2} 0 50")
+    return _circuit('filter_cascade', size, lines, 2, size + 2)
+
+
+def diode_bridge(size, source='dc'):
+    """size full-wave bridges from the source, each with its own RC load."""
+    lines = _source(source, 1)
+    d = 0
+    for i in range(size):
+        plus, minus = 3 * i + 2, 3 * i + 3
+        for anode, cathode in ((1, plus), (0, plus), (minus, 1), (minus, 0)):
+            d += 1
+            lines.append(f"D{d} {anode} {cathode}")
+        lines.append(f"R{i + 1} {plus} {minus} 1000")
+        lines.append(f"C{i + 1} {plus} {minus} 1e-06")
+    return _circuit('diode_bridge', size, lines, 1, 2)
+
+
+FAMILIES = {
+    'ladder': ladder,
+    'mesh': mesh,
+    'rc_tree': rc_tree,
+    'filter_cascade': filter_cascade,
+    'diode_bridge': diode_bridge,
+}
+
+
+def generate(family, size, source='dc'):
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source kind '{source}' (use {', '.join(SOURCES)})")
+    return FAMILIES[family](size, source)
+
+
+def to_components(circuit):
+    """The netlist as the component list of a /simulation request body."""
+    types = {'R': 'Resistor', 'C': 'Capacitor', 'L': 'Inductor', 'D': 'Diode'}
+    components = []
+    for line in circuit.netlist.splitlines():
+        tokens = line.split()
+        name = tokens[0]
+        if name[0] == 'V' and tokens[3] == 'AC':
+            components.append({'type': 'AC Source', 'id': name, 'node1': tokens[1], 'node2': tokens[2],
+                               'value': {'value': tokens[4], 'phase': tokens[5]}})
+        elif name[0] == 'V':
+            # build_netlist writes DC sources as '<id> <node2> <node1> <value>'
+            components.append({'type': 'DC Source', 'id': name, 'node1': tokens[2], 'node2': tokens[1],
+                               'value': tokens[3]})
+        else:
+            components.append({'type': types[name[0]], 'id': name, 'node1': tokens[1], 'node2': tokens[2],
+                               'value': tokens[3] if len(tokens) > 3 else ''})
+    return components
+
+
+def to_s_netlist(circuit, points=101):
+    """S-parameter netlist of a passive circuit: ports on input and output, 0.1 - 2 GHz."""
+    lines = [line for line in circuit.netlist.splitlines() if not line.startswith('V')]
+    lines += [f"Port1 {circuit.input} 0 50", f"Port2 {circuit.output} 0 50", "Ground 0 1 1",
+              f"f 0.1 2 {points} GHz"]
+    return '\n'.join(lines) + '\n'
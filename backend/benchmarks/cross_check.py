@@ -0,0 +1,103 @@
+"""
+Cross-check of the numeric MNA engine against lcapy on small circuits.
+
+Every controlled-source type (E, F, G, H) is solved at DC by both DC
+engines and at one AC frequency by the MNA engine and lcapy's phasor
+analysis; node voltages and every element current both report must agree.
+Run from anywhere (exits non-zero on a mismatch):
+
+    python benchmarks/cross_check.py [--rtol 1e-6] [--frequency 1000]
+"""
+import argparse
+import logging
+import os
+import sys
+import warnings
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# One circuit per controlled source, driven by V1 (a DC or an AC source)
+CIRCUITS = {
+    'E': "R1 1 3 1000\nC1 3 0 1e-6\nR3 3 0 1000\nE1 2 0 3 0 3\nR2 2 0 100\n",
+    'F': "R1 1 3 1000\nC1 3 0 1e-6\nR3 3 0 1000\nF1 2 0 V1 2\nR2 2 0 100\n",
+    'G': "R1 1 3 1000\nC1 3 0 1e-6\nR3 3 0 1000\nG1 2 0 3 0 0.01\nR2 2 0 100\n",
+    'H': "R1 1 3 1000\nC1 3 0 1e-6\nR3 3 0 1000\nH1 2 0 V1 50\nR2 2 0 100\n",
+}
+DC_SOURCE = "V1 1 0 1\n"
+AC_SOURCE = "V1 1 0 AC 1 0\n"
+
+
+def _mismatches(numeric, reference, rtol, atol=1e-12):
+    """Keys present in both result dicts whose values differ."""
+    return [f"{key}: {numeric[key]:.6g} (numeric) vs {reference[key]:.6g} (lcapy)"
+            for key in sorted(set(numeric) & set(reference))
+            if not np.isclose(numeric[key], reference[key], rtol=rtol, atol=atol)]
+
+
+def check_dc(netlist, rtol):
+    from dc_analysis import run_dc_analysis
+    numeric = run_dc_analysis(mode='numeric', netlist=netlist, return_info=True)
+    reference = run_dc_analysis(mode='symbolic', netlist=netlist, return_info=True)
+    if numeric[2].get('engine') != 'numeric':
+        return [f"numeric engine did not run: {numeric[2]}"]
+    mismatches = _mismatches({**numeric[0], **numeric[1]}, {**reference[0], **reference[1]}, rtol)
+    # lcapy reports no current for F and G sources; every source is in parallel with R2, so KCL at node 2 checks it
+    source = next(name for name in numeric[1] if name[2] in 'EFGH')
+    if not np.isclose(numeric[1][source], -numeric[1]['I_R2'], rtol=rtol, atol=1e-12):
+        mismatches.append(f"{source}: {numeric[1][source]:.6g} breaks KCL with I_R2 = {numeric[1]['I_R2']:.6g}")
+    return mismatches
+
+
+def check_ac(netlist, frequency, rtol):
+    """Node voltages and element currents of the MNA AC solve against lcapy's phasors."""
+    import lcapy
+    from ac_analysis import convert_ac_sources, evaluate_complex_expression, preprocess_netlist
+    from mna import MNACircuit
+
+    omega = 2 * np.pi * frequency
+    netlist = preprocess_netlist(netlist)
+    circuit = MNACircuit(netlist)
+    x = circuit.solve_ac(np.array([omega]))[0]
+    numeric = {f'V_node_{node}': x[index] for node, index in circuit.node_index.items()}
+    numeric.update((f"I_{element['name']}", circuit.element_current(x, element)) for element in circuit.elements
+                   if element['type'] not in ('C', 'L'))
+
+    reference = {}
+    cct_ac = lcapy.Circuit(convert_ac_sources(netlist)).ac()
+    for node in circuit.node_index:
+        reference[f'V_node_{node}'] = evaluate_complex_expression(str(cct_ac[node].v.phasor()), omega)
+    for element in circuit.elements:
+        try:
+            reference[f"I_{element['name']}"] = evaluate_complex_expression(
+                str(cct_ac[element['name']].i.phasor()), omega)
+        except Exception:
+            # lcapy has no branch current for current-driven elements (F, G)
+            pass
+    missing = [f"{key}: lcapy gave no numeric phasor" for key, value in reference.items() if value is None]
+    return missing + _mismatches(numeric, {k: v for k, v in reference.items() if v is not None}, rtol)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rtol', type=float, default=1e-6)
+    parser.add_argument('--frequency', type=float, default=1000.0)
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings('ignore')
+
+    failed = False
+    for kind, netlist in CIRCUITS.items():
+        for analysis, run in (('dc', lambda: check_dc(DC_SOURCE + netlist, args.rtol)),
+                              ('ac', lambda: check_ac(AC_SOURCE + netlist, args.frequency, args.rtol))):
+            mismatches = run()
+            failed = failed or bool(mismatches)
+            print(f"{kind} {analysis}: {'ok' if not mismatches else 'MISMATCH'}")
+            for line in mismatches:
+                print(f"    {line}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
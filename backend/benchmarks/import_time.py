@@ -0,0 +1,106 @@
+"""
+Cold import time of the backend modules and their heavy dependencies.
+
+Every module is imported in a fresh interpreter with -X importtime, so the
+numbers are what a new gunicorn worker (without warm-up) or a cold start
+pays. Run from anywhere:
+
+    python benchmarks/import_time.py [--repeat 3] [--top 5] [--json] [module ...]
+
+'app' is not measured by default because importing it connects to MongoDB.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = (
+    # Backend modules, as imported by app.py
+    'dc_analysis', 'ac_analysis', 'transient_analysis', 'Z_parameter', 'Y_parameter', 'S_parameter',
+    'two_port', 'parameter_sweep', 'touchstone', 'result_payload', 'plot_cache', 'job_queue',
+    # Heavy dependencies, loaded on first use
+    'lcapy', 'sympy', 'matplotlib.pyplot', 'skrf', 'fastapi', 'scipy.sparse.linalg',
+)
+
+
+def parse_importtime(stderr):
+    """(module, self us, cumulative us, nesting depth) rows of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module):
+    """One cold import of module: (cumulative seconds, importtime rows)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = parse_importtime(result.stderr)
+    # The last top-level row is the requested module itself
+    cumulative = next(cum for name, _, cum, depth in reversed(rows) if depth <= 1 and name == module)
+    return cumulative / 1e6, rows
+
+
+def heaviest(rows, module, top):
+    """The top direct children of module by cumulative time."""
+    children = []
+    for index, (name, _, _, depth) in enumerate(rows):
+        if name == module and depth <= 1:
+            # importtime lists children before their parent, one level deeper
+            j = index - 1
+            while j >= 0 and rows[j][3] > depth:
+                if rows[j][3] == depth + 1:
+                    children.append((rows[j][0], rows[j][2] / 1e6))
+                j -= 1
+            break
+    return sorted(children, key=lambda child: -child[1])[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=list(DEFAULT_MODULES))
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per module (median is reported)')
+    parser.add_argument('--top', type=int, default=3, help='heaviest direct imports listed per module')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for module in args.modules:
+        try:
+            runs = [measure(module) for _ in range(max(1, args.repeat))]
+        except RuntimeError as e:
+            results[module] = {'error': str(e)}
+            continue
+        times = [seconds for seconds, _ in runs]
+        results[module] = {
+            'median': statistics.median(times),
+            'min': min(times),
+            'max': max(times),
+            'heaviest': heaviest(runs[0][1], module, args.top)
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"{'module':<22}{'median [s]':>12}{'min [s]':>10}{'max [s]':>10}  heaviest imports")
+    for module, result in results.items():
+        if 'error' in result:
+            print(f"{module:<22}  failed: {result['error']}")
+            continue
+        children = ', '.join(f'{name} {seconds:.2f}' for name, seconds in result['heaviest'])
+        print(f"{module:<22}{result['median']:>12.3f}{result['min']:>10.3f}{result['max']:>10.3f}  {children}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
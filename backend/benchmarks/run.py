@@ -0,0 +1,372 @@
+"""
+Latency, peak memory and scaling of every analysis engine on generated circuits.
+
+Each engine runs on the circuit families of benchmarks/circuits.py at growing
+sizes; a size is skipped once the previous one took longer than --max-seconds.
+Result and compiled-expression caches are cleared before every run, so the
+numbers are those of a cold request on a warm process (the first run, which
+also pays for lazy imports, is reported separately). Run from anywhere:
+
+    python benchmarks/run.py [--quick] [--engines dc,ac_sweep] [--families ladder]
+                             [--compare benchmarks/results/<earlier>.json]
+
+Results are written as JSON to benchmarks/results/ (or --output) so runs can
+be compared over time with --compare.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.circuits import SIZES, generate, to_components, to_s_netlist  # noqa: E402
+
+ALL_FAMILIES = tuple(SIZES)
+LINEAR_FAMILIES = ('ladder', 'mesh', 'rc_tree', 'filter_cascade')
+TWO_PORT_FAMILIES = ('ladder', 'filter_cascade')
+SWEEP_FREQUENCIES = {'sweep_type': 'dec', 'start': 10, 'stop': 1e6, 'points': 20}
+
+
+def _has_result(value):
+    if isinstance(value, tuple):
+        return any(_has_result(item) for item in value)
+    if isinstance(value, (dict, list)):
+        return bool(value)
+    return value is not None and value is not False
+
+
+def _check(value, engine):
+    """Engines report most failures through empty results instead of exceptions."""
+    if isinstance(value, dict) and value.get('error'):
+        raise RuntimeError(value['error'])
+    if not _has_result(value):
+        raise RuntimeError(f"{engine} returned no result")
+    return value
+
+
+def _dc(mode):
+    def run(circuit):
+        from dc_analysis import run_dc_analysis
+        return _check(run_dc_analysis(mode=mode, netlist=circuit.netlist), f'dc ({mode})')
+    return run
+
+
+def _ac(circuit):
+    from ac_analysis import run_ac_analysis
+    return _check(run_ac_analysis(1000, netlist=circuit.netlist), 'ac')
+
+
+def _ac_sweep(circuit):
+    from ac_analysis import run_ac_sweep
+    return _check(run_ac_sweep(netlist=circuit.netlist, **SWEEP_FREQUENCIES), 'ac_sweep')
+
+
+def _transient(mode):
+    def run(circuit):
+        from transient_analysis import run_transient_analysis
+        return _check(run_transient_analysis(netlist=circuit.netlist, mode=mode, tstop=1e-4), f'transient ({mode})')
+    return run
+
+
+def _z(circuit):
+    from Z_parameter import run_z_parameter
+    return _check(run_z_parameter(1000, circuit.input, '0', circuit.output, '0', netlist=circuit.netlist), 'z')
+
+
+def _y(circuit):
+    from Y_parameter import run_y_parameter
+    return _check(run_y_parameter(1000, circuit.input, '0', circuit.output, '0', netlist=circuit.netlist), 'y')
+
+
+def _two_port(circuit):
+    from two_port import run_two_port
+    frequencies = np.logspace(1, 6, 101)
+    return _check(run_two_port(frequencies, circuit.input, '0', circuit.output, '0', netlist=circuit.netlist),
+                  'two_port')
+
+
+def _s(circuit):
+    from S_parameter import run_s_parameter
+    return _check(run_s_parameter()(to_s_netlist(circuit)), 's')
+
+
+def _sweep(circuit):
+    from parameter_sweep import run_parameter_sweep
+    resistors = [line.split()[0] for line in circuit.netlist.splitlines() if line.startswith('R')]
+    return _check(run_parameter_sweep(circuit.netlist, {name: 0.05 for name in resistors[:10]},
+                                      samples=1000, seed=1), 'sweep')
+
+
+_client = None
+
+
+def _flask_client():
+    """Test client of the Flask app; importing app needs the MongoDB settings of the environment."""
+    global _client
+    if _client is None:
+        os.environ.setdefault('mongo_uri', 'mongodb://localhost:27017/?serverSelectionTimeoutMS=500')
+        os.environ.setdefault('JWT_SECRET_KEY', 'benchmark')
+        from app import app
+        _client = app.test_client()
+    return _client
+
+
+def _flask(analysis, **params):
+    def run(circuit):
+        body = {'netList': json.dumps({'components': to_components(circuit)}), 'analysisType': analysis, **params}
+        response = _flask_client().post('/simulation', json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"/simulation returned {response.status_code}")
+        return response.get_json()
+    return run
+
+
+# name -> (runner, source kind, families, largest element count worth timing)
+ENGINES = {
+    'dc': (_dc('numeric'), 'dc', ALL_FAMILIES, 20000),
+    'dc_symbolic': (_dc('symbolic'), 'dc', LINEAR_FAMILIES, 15),
+    'ac': (_ac, 'ac', LINEAR_FAMILIES, 5),
+    'ac_sweep': (_ac_sweep, 'ac', LINEAR_FAMILIES, 20000),
+    'transient': (_transient('numeric'), 'dc', LINEAR_FAMILIES, 5000),
+    'transient_symbolic': (_transient('symbolic'), 'dc', LINEAR_FAMILIES, 8),
+    'z': (_z, 'none', TWO_PORT_FAMILIES, 10),
+    'y': (_y, 'none', TWO_PORT_FAMILIES, 10),
+    'two_port': (_two_port, 'none', LINEAR_FAMILIES, 20000),
+    's': (_s, 'none', TWO_PORT_FAMILIES, 20000),
+    'sweep': (_sweep, 'dc', LINEAR_FAMILIES, 5000),
+    'flask_dc': (_flask('dc'), 'dc', ALL_FAMILIES, 5000),
+    'flask_ac_sweep': (_flask('ac_sweep', sweepType='dec', startFrequency=10, stopFrequency=1e6, points=20),
+                       'ac', LINEAR_FAMILIES, 5000),
+    'flask_transient': (_flask('transient', tstop=1e-4), 'dc', LINEAR_FAMILIES, 2000),
+}
+
+
+def clear_caches():
+    from result_cache import result_cache
+    import compiled_expr
+    import circuit_ir
+    import S_parameter
+    from factorization import factorization_cache, ordering_cache
+    result_cache.clear()
+    compiled_expr.clear_cache()
+    circuit_ir.clear_cache()
+    S_parameter.clear_graph_cache()
+    factorization_cache.clear()
+    ordering_cache.clear()
+
+
+def _status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the peak RSS high-water mark (Linux only); returns False where it cannot be reset."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    kb = _status_kb('VmHWM')
+    if kb is None:
+        # ru_maxrss is in kB on Linux and in bytes on macOS; it cannot be reset
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            kb /= 1024
+    return kb / 1024
+
+
+def rss_mb():
+    kb = _status_kb('VmRSS')
+    return kb / 1024 if kb is not None else None
+
+
+def measure(run, circuit, repeat):
+    """Time one cold run plus repeat more, each after clearing the caches."""
+    resettable = reset_peak_rss()
+    rss_before = rss_mb()
+    times = []
+    for _ in range(repeat + 1):
+        clear_caches()
+        started = time.perf_counter()
+        run(circuit)
+        times.append(time.perf_counter() - started)
+    peak = peak_rss_mb()
+    first, times = times[0], times[1:] or times
+    return {
+        'first': first,
+        'median': statistics.median(times),
+        'min': min(times),
+        'mean': statistics.fmean(times),
+        'peak_rss_mb': round(peak, 1),
+        'peak_rss_delta_mb': round(peak - rss_before, 1) if resettable and rss_before is not None else None,
+    }
+
+
+def scaling_exponent(cases):
+    """Slope of log(median time) over log(element count): ~1 linear, ~2 quadratic, ..."""
+    points = [(case['elements'], case['median']) for case in cases if 'median' in case and case['median'] > 0]
+    if len(points) < 3:
+        return None
+    elements, medians = np.log(np.array(points, dtype=float)).T
+    return round(float(np.polyfit(elements, medians, 1)[0]), 2)
+
+
+def run_benchmarks(engines, families, repeat, max_seconds, quick):
+    results = {}
+    for engine in engines:
+        run, source, supported, max_elements = ENGINES[engine]
+        results[engine] = {}
+        for family in families:
+            if family not in supported:
+                continue
+            cases = []
+            for size in SIZES[family]:
+                circuit = generate(family, size, source)
+                if circuit.elements > max_elements or (quick and len(cases) == 3):
+                    break
+                case = {'size': size, 'elements': circuit.elements}
+                try:
+                    case.update(measure(run, circuit, repeat))
+                except Exception as e:
+                    case['error'] = f"{type(e).__name__}: {e}"
+                cases.append(case)
+                print(_format_case(engine, family, case), flush=True)
+                if 'error' in case or case['median'] > max_seconds:
+                    break
+            results[engine][family] = {'cases': cases, 'scaling_exponent': scaling_exponent(cases)}
+    return results
+
+
+def _format_case(engine, family, case):
+    label = f"{engine:<20}{family:<16}{case['size']:>6}{case['elements']:>8}"
+    if 'error' in case:
+        return f"{label}  failed: {case['error']}"
+    return (f"{label}{case['first'] * 1e3:>12.2f}{case['median'] * 1e3:>12.2f}{case['min'] * 1e3:>12.2f}"
+            f"{case['peak_rss_mb']:>10.1f}")
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def metadata(args):
+    import scipy
+    from parallel import parallel_executor
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parallel_workers': parallel_executor.workers,
+        'repeat': args.repeat,
+        'quick': args.quick,
+    }
+
+
+def compare(results, baseline, threshold):
+    """(engine, family, size, old median, new median) of every case slower than threshold x baseline."""
+    regressions = []
+    for engine, families in results.items():
+        for family, data in families.items():
+            old_cases = {case['size']: case for case in
+                         baseline.get('results', {}).get(engine, {}).get(family, {}).get('cases', [])}
+            for case in data['cases']:
+                old = old_cases.get(case['size'])
+                if old is None or 'median' not in old or 'median' not in case:
+                    continue
+                if case['median'] > threshold * old['median']:
+                    regressions.append((engine, family, case['size'], old['median'], case['median']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--engines', default='all', help=f"comma separated, from: {', '.join(ENGINES)}")
+    parser.add_argument('--families', default='all', help=f"comma separated, from: {', '.join(ALL_FAMILIES)}")
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case after the first (median is reported)')
+    parser.add_argument('--max-seconds', type=float, default=5.0, help='stop growing a family once a case is slower')
+    parser.add_argument('--quick', action='store_true', help='only the three smallest sizes of every engine and family')
+    parser.add_argument('--output', help='JSON file to write (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results JSON to compare the medians with')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    parser.add_argument('--list', action='store_true', help='list the engines and families and exit')
+    parser.add_argument('--verbose', action='store_true', help='keep the INFO logs of the engines')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for engine, (_, source, families, max_elements) in ENGINES.items():
+            print(f"{engine:<20}source={source:<5} max_elements={max_elements:<6} {', '.join(families)}")
+        return 0
+    engines = list(ENGINES) if args.engines == 'all' else [e.strip() for e in args.engines.split(',')]
+    families = list(ALL_FAMILIES) if args.families == 'all' else [f.strip() for f in args.families.split(',')]
+    unknown = [e for e in engines if e not in ENGINES] + [f for f in families if f not in SIZES]
+    if unknown:
+        parser.error(f"unknown engine or family: {', '.join(unknown)}")
+
+    os.chdir(BACKEND_DIR)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+        # lcapy warns before every large symbolic matrix inversion
+        warnings.simplefilter('ignore', UserWarning)
+    print(f"{'engine':<20}{'family':<16}{'size':>6}{'elements':>8}{'first [ms]':>12}{'median [ms]':>12}"
+          f"{'min [ms]':>12}{'peak [MB]':>10}")
+    results = run_benchmarks(engines, families, max(1, args.repeat), args.max_seconds, args.quick)
+
+    print("\nScaling exponents (time ~ elements^k):")
+    for engine, data in results.items():
+        exponents = ', '.join(f"{family} {info['scaling_exponent']}" for family, info in data.items()
+                              if info['scaling_exponent'] is not None)
+        print(f"  {engine:<20}{exponents or '-'}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump({'meta': metadata(args), 'results': results}, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\n{len(regressions)} regression(s) slower than {args.threshold}x {args.compare}")
+        for engine, family, size, old, new in regressions:
+            print(f"  {engine:<20}{family:<16}{size:>6}{old * 1e3:>12.2f} ms -> {new * 1e3:.2f} ms ({new / old:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
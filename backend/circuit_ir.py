@@ -0,0 +1,341 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from netlist_source import load_netlist
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+GROUND = '0'
+# Terminal id of the ground node; every other node gets a dense id from 0
+GROUND_ID = -1
+
+UNIT_SCALE = {'f': 1e-15, 'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'm': 1e-3,
+              'k': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+_NUMBER = re.compile(r'^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(.*)$')
+
+# Lines starting with these are comments in every netlist dialect the backend reads
+COMMENT_PREFIXES = ('*', '#', ';')
+# Element kinds named by more than their first letter, checked in order
+PREFIX_KINDS = (('Port', 'port'), ('Ground', 'ground'), ('TL', 'TL'), ('OS', 'OS'), ('SS', 'SS'))
+# Elements that only exist in the S-parameter (scikit-rf) description of a circuit
+RF_KINDS = ('port', 'ground')
+# Source keywords lcapy accepts in front of the value
+SOURCE_KEYWORDS = ('dc', 'step')
+
+MAX_CIRCUITS = int(os.getenv('CIRCUIT_CACHE_ENTRIES', 128))
+
+
+def parse_value(token, unit=None):
+    """
+    Parse an engineering value such as '1k', '10u', '2.2meg' or '1e-3'. unit
+    is an optional separate unit token ('GHz', 'nH') whose prefix scales the
+    value, as in the S-parameter netlists.
+    """
+    token = str(token).strip().strip('{}')
+    match = _NUMBER.match(token)
+    if not match:
+        raise ValueError(f"Invalid numeric value: {token}")
+    number, suffix = match.groups()
+    value = float(number)
+    if not suffix and unit:
+        suffix = str(unit).strip()
+    if suffix.lower().startswith('meg'):
+        return value * 1e6
+    if suffix and suffix[0] in UNIT_SCALE:
+        return value * UNIT_SCALE[suffix[0]]
+    return value
+
+
+def element_kind(name):
+    for prefix, kind in PREFIX_KINDS:
+        if name.startswith(prefix):
+            return kind
+    return name[0].upper()
+
+
+def _terminal_count(kind, tokens):
+    """How many of the tokens after the name are node names."""
+    if kind == 'X':
+        # X<n> <node of each port> <touchstone id>
+        return max(len(tokens) - 2, 0)
+    if kind in ('E', 'G') and len(tokens) >= 6:
+        # Output nodes followed by the control nodes
+        return 4
+    return 2
+
+
+def source_value(params):
+    """DC value of an independent source; AC-only sources are zero at DC."""
+    if not params:
+        return 0.0
+    keyword = params[0].lower()
+    if keyword in SOURCE_KEYWORDS:
+        return parse_value(params[1]) if len(params) > 1 else 0.0
+    if keyword == 'ac':
+        return 0.0
+    return parse_value(params[0])
+
+
+def _primary_value(kind, params):
+    """The element's main value (resistance, gain, DC source value, ...), NaN if it has none."""
+    try:
+        if kind in ('V', 'I'):
+            return source_value(params)
+        if kind in ('F', 'H'):
+            return parse_value(params[1])
+        return parse_value(params[0])
+    except (IndexError, ValueError):
+        return np.nan
+
+
+class CircuitIR:
+    """
+    Parsed netlist shared by every analysis: node names are interned to
+    dense integer ids (ground is GROUND_ID) and elements are kept as
+    parallel arrays - names, kinds, a flat terminal table indexed by
+    offsets, the parsed primary value and the remaining raw parameter
+    tokens. The 'f' frequency line of S-parameter netlists is kept as
+    frequency. Instances are immutable and shared through parse_circuit().
+    """
+
+    def __init__(self, rows, frequency=None, lines=None):
+        self.nodes = []
+        self.node_index = {}
+        self.names = []
+        self.params = []
+        kinds, terminals, offsets, values = [], [], [0], []
+        for tokens in rows:
+            name = tokens[0]
+            kind = element_kind(name)
+            count = _terminal_count(kind, tokens)
+            params = tuple(tokens[1 + count:])
+            self.names.append(name)
+            self.params.append(params)
+            kinds.append(kind)
+            terminals.extend(self._intern(node) for node in tokens[1:1 + count])
+            offsets.append(len(terminals))
+            values.append(_primary_value(kind, params))
+
+        self.kinds = np.array(kinds, dtype='<U6')
+        self.terminals = np.array(terminals, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int32)
+        self.values = np.array(values, dtype=float)
+        self.lines = np.array(lines if lines is not None else range(1, len(self.names) + 1), dtype=np.int32)
+        self.frequency = tuple(frequency) if frequency else None
+        self.element_index = {name: i for i, name in enumerate(self.names)}
+        for array in (self.kinds, self.terminals, self.offsets, self.values, self.lines):
+            array.setflags(write=False)
+        self._text = None
+
+    def _intern(self, name):
+        if name == GROUND:
+            return GROUND_ID
+        index = self.node_index.get(name)
+        if index is None:
+            index = self.node_index[name] = len(self.nodes)
+            self.nodes.append(name)
+        return index
+
+    @classmethod
+    def parse(cls, netlist_string):
+        rows, lines, frequency = [], [], None
+        for line_num, line in enumerate(netlist_string.strip().splitlines(), 1):
+            tokens = line.split()
+            if not tokens or tokens[0].startswith(COMMENT_PREFIXES):
+                continue
+            if tokens[0] == 'f':
+                frequency = tokens[1:]
+                continue
+            if len(tokens) < 3:
+                logger.warning(f"Line {line_num}: Invalid component definition: {line.strip()}")
+                continue
+            rows.append(tokens)
+            lines.append(line_num)
+        return cls(rows, frequency, lines)
+
+    def __len__(self):
+        return len(self.names)
+
+    def node_name(self, index):
+        return GROUND if index == GROUND_ID else self.nodes[index]
+
+    def element_terminals(self, i):
+        """Terminal node ids of element i."""
+        return self.terminals[self.offsets[i]:self.offsets[i + 1]]
+
+    def element_nodes(self, i):
+        """Terminal node names of element i."""
+        return [self.node_name(n) for n in self.element_terminals(i)]
+
+    def tokens(self, i):
+        return [self.names[i], *self.element_nodes(i), *self.params[i]]
+
+    def node_names(self):
+        """Names of every node an element connects to, ground included when used."""
+        names = set(self.nodes)
+        if np.any(self.terminals == GROUND_ID):
+            names.add(GROUND)
+        return names
+
+    def has(self, kind):
+        return bool(np.any(self.kinds == kind))
+
+    def to_netlist(self):
+        """The circuit as netlist text in the lcapy syntax (one element per line)."""
+        if self._text is None:
+            lines = [' '.join(self.tokens(i)) for i in range(len(self))]
+            if self.frequency:
+                lines.append(' '.join(['f', *self.frequency]))
+            self._text = '\n'.join(lines)
+            # Parsing the text gives this circuit back, so later lookups of it are hits
+            _store(self._text, self)
+        return self._text
+
+    def select(self, keep):
+        """The circuit with only the elements where the boolean mask keep is true."""
+        return CircuitIR([self.tokens(i) for i in np.flatnonzero(keep)], self.frequency,
+                         self.lines[np.asarray(keep, dtype=bool)])
+
+    def lowered(self, wires=None, sources=None, numeric_values=False):
+        """
+        The circuit rewritten for an analysis engine, without the S-parameter
+        ports, ground and frequency line:
+
+        wires: None keeps W elements, 'short' turns them into 0 V sources
+            (dropping wires that close a loop of wires, which would make the
+            system singular) and a number into resistors of that value.
+        sources: 'dc' keeps only the DC value of voltage sources (a sin
+            expression gives its amplitude), 'step' switches AC sources on as
+            steps of their amplitude and 'phasor' writes AC sources as the
+            complex phasor expressions of the lcapy AC analysis.
+        numeric_values: write R, C and L values as plain numbers.
+        """
+        rows, lines = [], []
+        wire_names = self.wire_names(wires) if wires is not None else {}
+        for i, name in enumerate(self.names):
+            kind = self.kinds[i]
+            nodes = self.element_nodes(i)
+            params = list(self.params[i])
+            if kind in RF_KINDS:
+                continue
+            if kind == 'W' and wires is not None:
+                if name not in wire_names:
+                    logger.info(f"Dropped wire {name}: its nodes are already shorted by other wires")
+                    continue
+                name = wire_names[name]
+                params = ['0'] if wires == 'short' else [repr(float(wires))]
+                logger.info(f"Converted wire {self.names[i]} to {name}")
+            elif kind == 'V' and sources is not None:
+                params = self._lower_source(name, nodes, params, sources)
+                if params is None:
+                    continue
+            elif kind in ('R', 'C', 'L') and numeric_values and np.isfinite(self.values[i]):
+                params = [repr(float(self.values[i]))] + params[1:]
+            rows.append([name, *nodes, *params])
+            lines.append(self.lines[i])
+        return CircuitIR(rows, None, lines)
+
+    def wire_names(self, wires):
+        """
+        Names lowered() gives the W elements for a wires option, by original
+        name. With 'short', wires closing a loop of wires (or both ends on one
+        node) carry no defined current and are left out.
+        """
+        names = {}
+        parent = {}
+
+        def root(node):
+            while parent.get(node, node) != node:
+                node = parent[node]
+            return node
+
+        for i in np.flatnonzero(self.kinds == 'W'):
+            name = self.names[i]
+            if wires == 'short':
+                a, b = (root(int(n)) for n in self.element_terminals(i)[:2])
+                if a == b:
+                    continue
+                parent[a] = b
+                names[name] = self._unique(f'V{name}')
+            else:
+                names[name] = self._unique(f'R{name}')
+        return names
+
+    def _unique(self, name):
+        candidate, suffix = name, 1
+        while candidate in self.element_index:
+            suffix += 1
+            candidate = f'{name}_{suffix}'
+        return candidate
+
+    @staticmethod
+    def _lower_source(name, nodes, params, sources):
+        keyword = params[0].lower() if params else ''
+        if sources == 'dc':
+            if nodes == [GROUND, GROUND]:
+                logger.info(f"Skipping redundant source {name} between ground and ground")
+                return None
+            if 'sin' in ' '.join(params):
+                # Amplitude of an ACP source's sin expression
+                return [params[1] if len(params) > 1 else '0']
+            return params[:1] or ['0']
+        if sources == 'step' and keyword == 'ac':
+            return ['step', params[1] if len(params) > 1 else '1']
+        if sources == 'phasor' and keyword == 'ac' and len(params) == 3:
+            try:
+                phasor = parse_value(params[1]) * np.exp(1j * np.radians(parse_value(params[2])))
+            except ValueError:
+                return params
+            return f'ac {{{phasor.real:.6f} + {phasor.imag:.6f}j}} 0 omega_0'.split()
+        return params
+
+
+_circuits = OrderedDict()
+_lock = threading.Lock()
+
+
+def _store(text, circuit):
+    with _lock:
+        _circuits[text] = circuit
+        _circuits.move_to_end(text)
+        while len(_circuits) > MAX_CIRCUITS:
+            _circuits.popitem(last=False)
+
+
+def parse_circuit(netlist):
+    """
+    The CircuitIR of netlist (text, a CircuitIR or anything load_netlist
+    accepts). Circuits are cached by their text, so the analyses of one
+    request - and repeated requests - parse a netlist only once.
+    """
+    if isinstance(netlist, CircuitIR):
+        return netlist
+    if not isinstance(netlist, str):
+        netlist = load_netlist(netlist)
+    with _lock:
+        circuit = _circuits.get(netlist)
+        if circuit is not None:
+            _circuits.move_to_end(netlist)
+            return circuit
+    circuit = CircuitIR.parse(netlist)
+    _store(netlist, circuit)
+    return circuit
+
+
+def cache_info():
+    with _lock:
+        return {'circuits': len(_circuits), 'max_circuits': MAX_CIRCUITS}
+
+
+def clear_cache():
+    with _lock:
+        _circuits.clear()
@@ -0,0 +1,137 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from lazy_imports import LazyModule
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Imported when the first expression is compiled
+sp = LazyModule('sympy')
+
+MAX_COMPILED = 512
+MAX_COMPILED_CIRCUITS = 128
+# sp.simplify is skipped for expressions with more operations than this
+SIMPLIFY_MAX_OPS = 200
+
+# Heaviside(0) = 1/2 matches lcapy's own numeric evaluation; impulses cannot be sampled
+NUMPY_FUNCTIONS = {
+    'Heaviside': lambda x, h0=0.5: np.heaviside(x, h0),
+    'DiracDelta': lambda x, *args: np.zeros_like(x, dtype=float),
+}
+
+_compiled = OrderedDict()
+_circuits = OrderedDict()
+_lock = threading.Lock()
+
+
+def compile_expression(expr, symbols):
+    """
+    Compile a sympy expression into a vectorized NumPy function of symbols.
+    Compiled functions are cached per (expression, symbols); sympy expressions
+    hash structurally, so equal expressions share one compiled function.
+    """
+    if isinstance(symbols, sp.Symbol):
+        symbols = (symbols,)
+    key = (expr, tuple(symbols))
+    with _lock:
+        func = _compiled.get(key)
+        if func is not None:
+            _compiled.move_to_end(key)
+            return func
+
+    func = sp.lambdify(symbols, expr, modules=[NUMPY_FUNCTIONS, 'numpy'])
+    with _lock:
+        _compiled[key] = func
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return func
+
+
+def _evaluate(func, values):
+    with np.errstate(all='ignore'):
+        result = np.asarray(func(values))
+    if result.shape != values.shape:
+        # Constant expressions compile to scalars
+        result = np.broadcast_to(result, values.shape).copy()
+    return result
+
+
+def evaluate_expression(expr, symbol, values):
+    """Evaluate expr on a whole array of symbol values in one vectorized call."""
+    values = np.asarray(values)
+    return _evaluate(compile_expression(expr, symbol), values)
+
+
+def simplify_expression(expr, max_ops=SIMPLIFY_MAX_OPS):
+    """
+    sp.simplify bounded by expression size: its run time grows steeply with the
+    operation count, so larger expressions are only put over a common
+    denominator with sp.cancel. max_ops=0 disables simplification.
+    """
+    if not max_ops:
+        return expr
+    try:
+        if sp.count_ops(expr) <= max_ops:
+            return sp.simplify(expr)
+        return sp.cancel(expr)
+    except Exception as e:
+        logger.warning(f"Failed to simplify expression: {e}")
+        return expr
+
+
+class CompiledParameters:
+    """
+    Frequency-domain network parameters of one circuit (sympy expressions in s)
+    compiled into vectorized complex functions of frequency.
+    """
+
+    def __init__(self, expressions, variable='s'):
+        self.symbolic = {name: str(expr) for name, expr in expressions.items()}
+        self._functions = {}
+        for name, expr in expressions.items():
+            # lcapy's s carries its own assumptions, so match the symbol by name
+            s = next((x for x in expr.free_symbols if x.name == variable), sp.Symbol(variable))
+            self._functions[name] = compile_expression(expr, s)
+
+    def evaluate(self, frequencies):
+        """Parameter arrays at s = j·2π·f for every frequency in frequencies."""
+        s_values = 2j * np.pi * np.atleast_1d(np.asarray(frequencies, dtype=float))
+        return {name: _evaluate(func, s_values).astype(complex) for name, func in self._functions.items()}
+
+
+def get_compiled_parameters(key, build):
+    """
+    Return the CompiledParameters cached under key (a circuit hash), calling
+    build() to create it on a miss. The cache is bounded to MAX_COMPILED_CIRCUITS.
+    """
+    with _lock:
+        compiled = _circuits.get(key)
+        if compiled is not None:
+            _circuits.move_to_end(key)
+            return compiled
+
+    compiled = build()
+    with _lock:
+        _circuits[key] = compiled
+        while len(_circuits) > MAX_COMPILED_CIRCUITS:
+            _circuits.popitem(last=False)
+    return compiled
+
+
+def cache_info():
+    with _lock:
+        return {'compiled_functions': len(_compiled), 'max_compiled': MAX_COMPILED,
+                'compiled_circuits': len(_circuits), 'max_compiled_circuits': MAX_COMPILED_CIRCUITS}
+
+
+def clear_cache():
+    """Drop every compiled expression and circuit, e.g. to time cold evaluations."""
+    with _lock:
+        _compiled.clear()
+        _circuits.clear()
@@ -20,12 +20,13 @@ def connect_to_mongo():
 
     except Exception as e:
         print("❌ Could not connect to MongoDB:", e)
-        return None, None
+        return None, None, None
 
 result = connect_to_mongo()
 if result[0] is None:
     db = None
     blogs_collection = None
+    user_collection = None
     print("⚠️  MongoDB connection failed. App will run without database features.")
 else:
     db, blogs_collection, user_collection = result
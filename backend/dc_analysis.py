@@ -1,63 +1,65 @@
-from lcapy import Circuit
 import logging
-import sympy as sp
 import numpy as np
+from mna import run_numeric_dc
+from nonlinear_dc import run_nonlinear_dc
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit
+from lazy_imports import LazyModule
+from metrics import timed, stage
+
+# Only the symbolic analysis needs lcapy; it is imported on first use
+lcapy = LazyModule('lcapy')
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def preprocess_netlist(netlist_string):
+# Wires are 0 V branches in the numeric engines; the exact lcapy solve takes tiny resistors
+NUMERIC_WIRES = 'short'
+SYMBOLIC_WIRES = 1e-10
+
+def preprocess_netlist(netlist_string, wires=SYMBOLIC_WIRES):
     """
-    Converts W-type wire lines, handles diodes, and cleans up the netlist.
+    Lowers W-type wires (see CircuitIR.lowered), reduces voltage sources to
+    their DC value and reports whether the circuit has diodes (kept for the
+    Newton-Raphson engine).
     """
-    lines = netlist_string.strip().splitlines()
-    processed = []
-    has_diodes = False
+    circuit = parse_circuit(netlist_string).lowered(wires=wires, sources='dc')
+    return circuit.to_netlist(), circuit.has('D')
 
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('*'):  # Skip empty lines and comments
-            continue
-            
-        tokens = line.split()
-        if len(tokens) >= 3:
-            if tokens[0].startswith('W'):
-                name, n1, n2 = tokens[0], tokens[1], tokens[2]
-                # Use reasonable resistance for wires
-                processed.append(f'R{name} {n1} {n2} 0.0000000001')
-                logger.info(f"Converted wire {name} to resistor R{name}")
-            elif tokens[0].startswith('D'):
-                # For DC analysis, replace diode with a resistor
-                name, n1, n2 = tokens[0], tokens[1], tokens[2]
-                processed.append(f'R{tokens[0]} {n1} {n2} 0.7')  # Use 0.7V drop for diode
-                has_diodes = True
-                logger.info(f"Replaced diode {name} with resistor for DC analysis")
-            elif tokens[0] == 'Vg' and tokens[1] == '0' and tokens[2] == '0':
-                # Skip redundant ground-to-ground voltage source
-                logger.info("Skipping redundant Vg 0 0 0")
-                continue
-            elif tokens[0].startswith('V'):
-                # Handle voltage sources
-                v_name, n1, n2 = tokens[0], tokens[1], tokens[2]
-                if len(tokens) > 3:
-                    # Check if it's an ACP Source with sin expression
-                    if 'sin' in ' '.join(tokens[3:]):
-                        # Extract the amplitude from sin expression
-                        value = tokens[4] if len(tokens) > 4 else '0'
-                        processed.append(f'{v_name} {n1} {n2} {value}')
-                        logger.info(f"Converted ACP Source {v_name} to DC source with value {value}")
-                    else:
-                        # Regular voltage source
-                        value = tokens[3]
-                        processed.append(f'{v_name} {n1} {n2} {value}')
-                else:
-                    processed.append(f'{v_name} {n1} {n2} 0')
-            else:
-                processed.append(line)
+def wire_aliases(netlist_string):
+    """
+    Names of the numeric engines' wire branches mapped to the wire resistor
+    names of the symbolic solve (VW1 -> RW1), and the names of wires left out
+    for closing a loop of wires.
+    """
+    circuit = parse_circuit(netlist_string)
+    branches = circuit.wire_names(NUMERIC_WIRES)
+    resistors = circuit.wire_names(SYMBOLIC_WIRES)
+    aliases = {branches[wire]: name for wire, name in resistors.items() if wire in branches}
+    dropped = [name for wire, name in resistors.items() if wire not in branches]
+    return aliases, dropped
+
+def rename_element(key, aliases):
+    """A V_<element>/I_<element> result name with the element renamed by aliases."""
+    if key.startswith('V_node_') or key[2:] not in aliases:
+        return key
+    return key[:2] + aliases[key[2:]]
 
-    return '\n'.join(processed), has_diodes
+def rename_wire_results(netlist_string, voltages, currents):
+    """
+    Report wire currents from the numeric engines' 0 V branches under the
+    symbolic solve's names (V_RW1, I_RW1). Dropped loop-closing wires carry
+    no defined current and are reported as zero.
+    """
+    aliases, dropped = wire_aliases(netlist_string)
+    voltages = {rename_element(key, aliases): value for key, value in voltages.items()}
+    currents = {rename_element(key, aliases): value for key, value in currents.items()}
+    for name in dropped:
+        voltages[f'V_{name}'] = 0.0
+        currents[f'I_{name}'] = 0.0
+    return voltages, currents
 
 def extract_numerical_value(expr):
     """
@@ -89,193 +91,80 @@ def extract_numerical_value(expr):
         logger.debug(f"Could not extract numerical value from {expr}: {e}")
         return None
 
-def analyze_diode_circuit_iterative(netlist_string, max_iterations=20, tolerance=1e-6):
-    """
-    Iterative analysis for circuits with diodes using the diode equation.
-    This is a simplified approach assuming ideal diodes.
-    """
-    logger.info("Starting iterative diode analysis...")
-    
-    # Parse netlist to identify diodes and their connections
-    lines = netlist_string.strip().splitlines()
-    diodes = {}
-    
-    for line in lines:
-        tokens = line.split()
-        if tokens[0].startswith('D') and len(tokens) >= 3:
-            diode_name = tokens[0]
-            anode = tokens[1]
-            cathode = tokens[2]
-            diodes[diode_name] = {'anode': anode, 'cathode': cathode, 'conducting': False}
-    
-    logger.info(f"Found diodes: {list(diodes.keys())}")
-    
-    # Simple iterative approach: assume diodes are either ON (conducting) or OFF
-    best_result = None
-    best_error = float('inf')
-    
-    # Try different diode states (2^n combinations for n diodes)
-    n_diodes = len(diodes)
-    if n_diodes > 4:  # Limit combinations to prevent explosion
-        logger.warning(f"Too many diodes ({n_diodes}) for exhaustive search. Using heuristic.")
-        n_diodes = 4
-    
-    for state in range(2**min(n_diodes, len(diodes))):
-        try:
-            # Create modified netlist with diode replacements
-            modified_netlist = replace_diodes_with_models(netlist_string, diodes, state)
-            
-            # Analyze the linear circuit
-            cct = Circuit(modified_netlist)
-            
-            # Check if this state is consistent
-            consistent, voltages, currents = check_diode_consistency(cct, diodes, state)
-            
-            if consistent:
-                logger.info(f"Found consistent diode state: {state}")
-                return voltages, currents, diodes
-                
-        except Exception as e:
-            logger.debug(f"State {state} failed: {e}")
-            continue
-    
-    logger.warning("No consistent diode state found. Returning best approximation.")
-    return {}, {}, diodes
-
-def replace_diodes_with_models(netlist_string, diodes, state):
+@timed('dc')
+def run_dc_analysis(netlist_filename='netlist.txt', mode='numeric', return_info=False, netlist=None):
     """
-    Replace diodes with appropriate models based on their assumed state.
+    DC operating point analysis.
+    mode='numeric' solves the circuit with the sparse MNA engine and falls back to
+    lcapy if the netlist cannot be handled numerically; mode='symbolic' always
+    uses lcapy. Circuits with diodes are always solved with Newton-Raphson.
+    With return_info=True a third dict describes the solver run (engine,
+    iteration count and per-diode operating points).
+    The circuit is taken from netlist (string or parsed object) when given,
+    otherwise it is read from netlist_filename.
     """
-    lines = netlist_string.strip().splitlines()
-    modified_lines = []
-    
-    diode_names = list(diodes.keys())
-    
-    for line in lines:
-        tokens = line.split()
-        if tokens[0].startswith('D') and tokens[0] in diodes:
-            diode_idx = diode_names.index(tokens[0])
-            if diode_idx < 32 and (state & (1 << diode_idx)):  # Diode is ON
-                # Replace with small resistance (conducting)
-                anode, cathode = tokens[1], tokens[2]
-                modified_lines.append(f'R{tokens[0]}_on {anode} {cathode}  0.00000000000001')
-            else:  # Diode is OFF
-                # Replace with large resistance (non-conducting)
-                anode, cathode = tokens[1], tokens[2]
-                modified_lines.append(f'R{tokens[0]}_off {anode} {cathode} 1e9')
-        else:
-            modified_lines.append(line)
-    
-    return '\n'.join(modified_lines)
+    voltages, currents, info = _run_dc_analysis(netlist_filename, mode, netlist)
+    if return_info:
+        return voltages, currents, info
+    return voltages, currents
 
-def check_diode_consistency(cct, diodes, state):
-    """
-    Check if the assumed diode states are consistent with the calculated voltages.
-    """
+def _run_dc_analysis(netlist_filename, mode, netlist=None):
     try:
-        voltages = {}
-        currents = {}
-        
-        # Get all voltages and currents
-        for node in cct.nodes:
-            if node != '0':
-                try:
-                    v_val = extract_numerical_value(cct[node].v)
-                    if v_val is not None:
-                        voltages[f'V_node_{node}'] = v_val
-                except:
-                    pass
-        
-        # Get component values
-        for comp_name in cct.elements:
-            comp = cct[comp_name]
-            try:
-                if hasattr(comp, 'v'):
-                    v_val = extract_numerical_value(comp.v)
-                    if v_val is not None:
-                        voltages[f'V_{comp_name}'] = v_val
-                        
-                if hasattr(comp, 'i'):
-                    i_val = extract_numerical_value(comp.i)
-                    if i_val is not None:
-                        currents[f'I_{comp_name}'] = i_val
-            except:
-                pass
-        
-        # Check consistency for each diode
-        diode_names = list(diodes.keys())
-        consistent = True
-        
-        for i, (diode_name, diode_info) in enumerate(diodes.items()):
-            if i >= 32:  # Limit check
-                break
-                
-            anode_node = diode_info['anode']
-            cathode_node = diode_info['cathode']
-            is_on = bool(state & (1 << i))
-            
-            # Get anode and cathode voltages
-            v_anode = voltages.get(f'V_node_{anode_node}', 0)
-            v_cathode = voltages.get(f'V_node_{cathode_node}', 0)
-            v_diode = v_anode - v_cathode
-            
-            # Check consistency
-            if is_on and v_diode < -0.1:  # ON but reverse biased
-                consistent = False
-                break
-            elif not is_on and v_diode > 0.7:  # OFF but forward biased significantly
-                consistent = False
-                break
-        
-        return consistent, voltages, currents
-        
-    except Exception as e:
-        logger.debug(f"Consistency check failed: {e}")
-        return False, {}, {}
-
-def run_dc_analysis(netlist_filename='netlist.txt'):
-    try:
-        with open(netlist_filename, 'r') as file:
-            netlist_string = file.read()
-        logger.info(f"Original netlist loaded from {netlist_filename}")
+        netlist_string = load_netlist(netlist, netlist_filename)
     except FileNotFoundError:
         logger.error(f"Netlist file '{netlist_filename}' not found.")
-        return {}, {}
+        return {}, {}, {}
 
     # Preprocess netlist
-    netlist_string, has_diodes = preprocess_netlist(netlist_string)
-    logger.info(f"Preprocessed netlist:\n{netlist_string}")
+    source_netlist = netlist_string
+    with stage('preprocess'):
+        numeric_netlist, has_diodes = preprocess_netlist(netlist_string, wires=NUMERIC_WIRES)
+    logger.info(f"Preprocessed netlist:\n{numeric_netlist}")
 
     if has_diodes:
-        logger.info("Circuit contains diodes - using iterative analysis")
+        if mode != 'numeric':
+            logger.info("Symbolic analysis cannot model diodes - using Newton-Raphson")
         try:
-            voltages, currents, diode_info = analyze_diode_circuit_iterative(netlist_string)
-            
-            # Print diode states
-            logger.info("=== DIODE STATES ===")
-            for diode_name, info in diode_info.items():
-                state = "CONDUCTING" if info.get('conducting', False) else "NON-CONDUCTING"
-                logger.info(f"{diode_name}: {state}")
-            
-            return voltages, currents
-            
+            with stage('solve'):
+                voltages, currents, info = run_nonlinear_dc(numeric_netlist)
+            voltages, currents = rename_wire_results(source_netlist, voltages, currents)
+            for diode_name, op in info['diodes'].items():
+                state = "CONDUCTING" if op['conducting'] else "NON-CONDUCTING"
+                logger.info(f"{diode_name}: {state} (Vd={op['Vd']:.4f} V, Id={op['Id']:.4e} A)")
+            info['engine'] = 'newton'
+            return voltages, currents, info
         except Exception as e:
-            logger.error(f"Diode analysis failed: {e}")
-            logger.info("Falling back to linear analysis (may be inaccurate)")
-    
+            logger.error(f"Nonlinear DC analysis failed: {e}")
+            return {}, {}, {'engine': 'newton', 'error': str(e)}
+
+    if mode == 'numeric':
+        try:
+            with stage('solve'):
+                dc_voltages, dc_currents = run_numeric_dc(numeric_netlist)
+            dc_voltages, dc_currents = rename_wire_results(source_netlist, dc_voltages, dc_currents)
+            logger.info(f"Numeric DC Analysis Results - Voltages: {dc_voltages}")
+            logger.info(f"Numeric DC Analysis Results - Currents: {dc_currents}")
+            return dc_voltages, dc_currents, {'engine': 'numeric'}
+        except Exception as e:
+            logger.warning(f"Numeric DC analysis failed ({e}); falling back to symbolic analysis")
+
     # Standard linear analysis
+    with stage('preprocess'):
+        netlist_string, _ = preprocess_netlist(source_netlist)
     try:
-        cct = Circuit(netlist_string)
+        with stage('circuit'):
+            cct = lcapy.Circuit(netlist_string)
         logger.info("Circuit created successfully")
         
         # Perform DC analysis
-        cct_dc = cct.dc()
+        with stage('solve'):
+            cct_dc = cct.dc()
         logger.info("DC analysis completed")
         logger.info(f"DC analysis results: {cct_dc}")
         
     except Exception as e:
         logger.error(f"Error creating circuit: {e}")
-        return {}, {}
+        return {}, {}, {'engine': 'symbolic', 'error': str(e)}
 
     dc_voltages = {}
     dc_currents = {}
@@ -324,12 +213,12 @@ def run_dc_analysis(netlist_filename='netlist.txt'):
                     
     except Exception as e:
         logger.error(f"DC analysis failed: {e}")
-        return {}, {}
+        return {}, {}, {'engine': 'symbolic', 'error': str(e)}
 
     logger.info(f"DC Analysis Results - Voltages: {dc_voltages}")
     logger.info(f"DC Analysis Results - Currents: {dc_currents}")
     
-    return dc_voltages, dc_currents
+    return dc_voltages, dc_currents, {'engine': 'symbolic'}
 
 def debug_circuit_structure(netlist_filename='netlist.txt'):
     """Debug function to understand circuit structure"""
@@ -343,10 +232,10 @@ def debug_circuit_structure(netlist_filename='netlist.txt'):
         print(f"Contains diodes: {has_diodes}")
         
         if has_diodes:
-            print("Note: Diode circuits require iterative analysis")
+            print("Note: Diode circuits are solved with Newton-Raphson")
         
         try:
-            cct = Circuit(netlist_string)
+            cct = lcapy.Circuit(netlist_string)
             print(f"Nodes: {list(cct.nodes)}")
             print(f"Elements: {list(cct.elements.keys())}")
             
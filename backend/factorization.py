@@ -0,0 +1,336 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import splu
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Row sets whose A⁻¹·E_R blocks are kept per factorization
+MAX_UPDATE_BLOCKS = 8
+# Fill-reducing orderings tried on a new sparsity pattern: SuperLU's column
+# approximate minimum degree, minimum degree on Aᵀ+A and reverse Cuthill-McKee
+ORDERINGS = ('COLAMD', 'MMD_AT_PLUS_A', 'RCM')
+
+
+def pattern_key(matrix):
+    """Fingerprint of the sparsity pattern of a canonical (sorted, summed) CSC matrix."""
+    digest = hashlib.sha1(matrix.indptr.tobytes())
+    digest.update(matrix.indices.tobytes())
+    return matrix.shape, matrix.dtype.str, digest.hexdigest()
+
+
+class PermutedLU:
+    """
+    LU factors of A with a precomputed ordering: of A[:, cols], or of
+    A[rows][:, cols] for symmetric orderings. solve() answers for A itself.
+    """
+
+    def __init__(self, lu, cols, rows=None):
+        self.lu = lu
+        self.cols = cols
+        self.rows = rows
+
+    def solve(self, b):
+        z = self.lu.solve(b if self.rows is None else b[self.rows])
+        x = np.empty_like(z)
+        x[self.cols] = z
+        return x
+
+
+def _fill(lu):
+    return lu.L.nnz + lu.U.nnz
+
+
+class Ordering:
+    """Fill-reducing ordering of one sparsity pattern and the fill-in it gave."""
+
+    def __init__(self, name, cols, rows, nnz, fill):
+        self.name = name
+        self.cols = cols
+        self.rows = rows
+        self.nnz = nnz
+        self.fill = fill
+        self.reuses = 0
+
+    def info(self):
+        return {'ordering': self.name, 'size': len(self.cols), 'nnz': self.nnz, 'fill': self.fill,
+                'fill_ratio': self.fill / self.nnz if self.nnz else 0.0, 'reuses': self.reuses}
+
+
+class OrderingCache:
+    """
+    Fill-reducing orderings per sparsity pattern (topology fingerprint). The
+    first factorization of a pattern with at least trial_size unknowns tries
+    every ordering in ORDERINGS and keeps the one with the least fill-in;
+    smaller ones use COLAMD. Every later factorization of the pattern - DC,
+    each AC frequency, transient step, Newton iteration or sweep sample -
+    reuses the ordering and only does the numeric work.
+    """
+
+    def __init__(self, max_entries=64, trial_size=1000, orderings=ORDERINGS):
+        self.max_entries = max_entries
+        self.trial_size = trial_size
+        self.orderings = tuple(orderings)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    @classmethod
+    def from_env(cls):
+        orderings = os.getenv('SPARSE_ORDERINGS')
+        return cls(
+            max_entries=int(os.getenv('ORDERING_CACHE_ENTRIES', 64)),
+            trial_size=int(os.getenv('ORDERING_TRIAL_SIZE', 1000)),
+            orderings=[o.strip() for o in orderings.split(',') if o.strip()] if orderings else ORDERINGS
+        )
+
+    @staticmethod
+    def _factor(matrix, name, bound=None):
+        """
+        splu of matrix under a named ordering; returns (factors, column order,
+        row order or None), or None when a banded RCM factorization would
+        clearly fill in more than bound entries.
+        """
+        if name == 'RCM':
+            order = reverse_cuthill_mckee((matrix + matrix.T).tocsr(), symmetric_mode=True).astype(np.int64)
+            permuted = matrix[order][:, order]
+            if bound is not None:
+                # Without pivoting the factors stay inside the envelope of the permuted pattern
+                rows = permuted.tocsr()
+                first = np.minimum.reduceat(rows.indices, rows.indptr[:-1]) if rows.nnz else np.zeros(0)
+                envelope = np.sum(np.maximum(np.arange(len(first)) - first, 0))
+                if 2 * envelope + matrix.shape[0] >= bound:
+                    return None
+            lu = splu(permuted.tocsc(), permc_spec='NATURAL')
+            return PermutedLU(lu, order, order), order, order
+        lu = splu(matrix, permc_spec=name)
+        cols = np.argsort(lu.perm_c)
+        # SuperLU permutes internally, so the factors solve A directly
+        return lu, cols, None
+
+    def factorize(self, matrix, key=None):
+        """
+        LU factors of a canonical CSC matrix under the cached ordering of its
+        pattern, computing (and trying candidate) orderings on a miss. Raises
+        RuntimeError, like splu, when the matrix is singular.
+        """
+        key = key or pattern_key(matrix)
+        with self._lock:
+            ordering = self._entries.get(key)
+            if ordering is not None:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                ordering.reuses += 1
+        if ordering is not None:
+            permuted = matrix[:, ordering.cols] if ordering.rows is None else matrix[ordering.rows][:, ordering.cols]
+            return PermutedLU(splu(permuted.tocsc(), permc_spec='NATURAL'), ordering.cols, ordering.rows)
+
+        names = self.orderings if matrix.shape[0] >= self.trial_size else ('COLAMD',)
+        best, error = None, None
+        for name in names:
+            try:
+                factored = self._factor(matrix, name, best[1].fill if best else None)
+            except RuntimeError as e:
+                error = e
+                continue
+            if factored is None:
+                continue
+            lu, cols, rows = factored
+            fill = _fill(lu.lu if isinstance(lu, PermutedLU) else lu)
+            if best is None or fill < best[1].fill:
+                best = (lu, Ordering(name, cols, rows, matrix.nnz, fill))
+        if best is None:
+            raise error
+        lu, ordering = best
+        if len(names) > 1:
+            logger.info(f"Ordering for {matrix.shape[0]} unknowns: {ordering.name} "
+                        f"(fill {ordering.fill}, {ordering.fill / max(matrix.nnz, 1):.1f}x nnz)")
+        with self._lock:
+            self.counters['misses'] += 1
+            self._entries[key] = ordering
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return lu
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def topologies(self):
+        """Ordering, fill-in and reuse count of every cached pattern, most recent first."""
+        with self._lock:
+            return [ordering.info() for ordering in reversed(self._entries.values())]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            ratios = [o.fill / o.nnz for o in self._entries.values() if o.nnz]
+            return {
+                **self.counters,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+                'mean_fill_ratio': float(np.mean(ratios)) if ratios else 0.0,
+                'max_fill_ratio': float(np.max(ratios)) if ratios else 0.0
+            }
+
+
+ordering_cache = OrderingCache.from_env()
+
+
+def factorize(matrix):
+    """Sparse LU factors of matrix (anything scipy converts to CSC) with its pattern's cached ordering."""
+    matrix = sparse.csc_matrix(matrix)
+    matrix.sum_duplicates()
+    return ordering_cache.factorize(matrix)
+
+
+class Factorization:
+    """Sparse LU factors of a base matrix and the A⁻¹·E_R blocks of recent updates to it."""
+
+    def __init__(self, matrix, key=None):
+        self.matrix = matrix.copy()
+        self.lu = ordering_cache.factorize(self.matrix, key)
+        self.columns = np.repeat(np.arange(matrix.shape[1]), np.diff(matrix.indptr))
+        self.blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def block(self, rows):
+        """A⁻¹·E_R, the solutions for unit right-hand sides at rows."""
+        key = rows.tobytes()
+        with self._lock:
+            W = self.blocks.get(key)
+            if W is not None:
+                self.blocks.move_to_end(key)
+                return W
+        E = np.zeros((self.matrix.shape[0], len(rows)), dtype=self.matrix.dtype)
+        E[rows, np.arange(len(rows))] = 1.0
+        W = self.lu.solve(E)
+        with self._lock:
+            self.blocks[key] = W
+            while len(self.blocks) > MAX_UPDATE_BLOCKS:
+                self.blocks.popitem(last=False)
+        return W
+
+
+class FactorizationCache:
+    """
+    Sparse LU factorizations of MNA matrices kept per sparsity pattern, so a
+    matrix differing from a cached one in a few entries - an edited element
+    value - is solved with a Sherman-Morrison-Woodbury update of the cached
+    factors instead of a new factorization:
+
+        (A + E_R·M·E_Cᵀ)⁻¹·b = y - W·M·(I + W_C·M)⁻¹·y_C,   y = A⁻¹·b, W = A⁻¹·E_R
+
+    with R and C the rows and columns the matrices differ in. W is kept per
+    row set, so repeated edits of one element cost a single triangular
+    solve. Edits accumulate against the cached base matrix; once their rank
+    exceeds max_rank, or an update fails the residual check, the matrix is
+    refactored and becomes the new base.
+    """
+
+    def __init__(self, max_entries=16, max_rank=32, tolerance=1e-9):
+        self.max_entries = max_entries
+        self.max_rank = max_rank
+        self.tolerance = tolerance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'updates': 0, 'factorizations': 0, 'refactorizations': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.getenv('FACTORIZATION_CACHE_ENTRIES', 16)),
+            max_rank=int(os.getenv('FACTORIZATION_MAX_RANK', 32)),
+            tolerance=float(os.getenv('FACTORIZATION_TOLERANCE', 1e-9))
+        )
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _factor(self, key, matrix, counter):
+        entry = Factorization(matrix, key)
+        with self._lock:
+            self.counters[counter] += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def solve(self, matrix, b):
+        """
+        Solve matrix·x = b (b a vector or right-hand sides as columns). Raises
+        RuntimeError, like splu, when the matrix is singular.
+        """
+        matrix = matrix.tocsc()
+        matrix.sum_duplicates()
+        key = pattern_key(matrix)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            return self._factor(key, matrix, 'factorizations').lu.solve(b)
+
+        changed = np.flatnonzero(matrix.data != entry.matrix.data)
+        if len(changed) == 0:
+            self._count('hits')
+            return entry.lu.solve(b)
+        rows, row_pos = np.unique(matrix.indices[changed], return_inverse=True)
+        cols, col_pos = np.unique(entry.columns[changed], return_inverse=True)
+        if max(len(rows), len(cols)) <= self.max_rank:
+            x = self._update(entry, matrix, b, changed, rows, row_pos, cols, col_pos)
+            if x is not None:
+                self._count('updates')
+                return x
+        logger.info(f"Refactoring {matrix.shape[0]}x{matrix.shape[1]} matrix "
+                    f"({len(rows)}x{len(cols)} entries changed)")
+        return self._factor(key, matrix, 'refactorizations').lu.solve(b)
+
+    def _update(self, entry, matrix, b, changed, rows, row_pos, cols, col_pos):
+        """Woodbury solve on the cached factors; None when the update is singular or inaccurate."""
+        M = np.zeros((len(rows), len(cols)), dtype=np.result_type(matrix.dtype, b))
+        np.add.at(M, (row_pos, col_pos), matrix.data[changed] - entry.matrix.data[changed])
+        W = entry.block(rows)
+        y = entry.lu.solve(b)
+        try:
+            correction = np.linalg.solve(np.eye(len(cols)) + W[cols] @ M, y[cols])
+        except np.linalg.LinAlgError:
+            return None
+        x = y - W @ (M @ correction)
+        residual = np.max(np.abs(matrix @ x - b), initial=0.0)
+        scale = np.max(np.abs(matrix.data)) * np.max(np.abs(x), initial=0.0) + np.max(np.abs(b), initial=0.0)
+        if not np.isfinite(residual) or residual > self.tolerance * scale:
+            return None
+        return x
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            solves = sum(self.counters.values())
+            reused = self.counters['hits'] + self.counters['updates']
+            return {
+                **self.counters,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_rank': self.max_rank,
+                'reuse_rate': reused / solves if solves else 0.0
+            }
+
+
+factorization_cache = FactorizationCache.from_env()
@@ -0,0 +1,21 @@
+# Gunicorn reads this file from the working directory: gunicorn app:app
+import os
+from lazy_imports import warm_up_from_env
+from parallel import web_concurrency
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+# WEB_CONCURRENCY also sizes each worker's parallel pool (see parallel.default_workers)
+workers = web_concurrency()
+# Threaded workers: a /jobs/<id>/events stream holds one thread, not a whole
+# worker. Job state is shared between the workers through JOB_DIR.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# The app itself is not preloaded: importing it opens the MongoDB client,
+# which must not be shared across a fork. The heavy libraries it uses are
+# imported once in the master instead (see WARM_UP_MODULES) and inherited
+# copy-on-write by every worker.
+
+
+def on_starting(server):
+    warm_up_from_env()
@@ -0,0 +1,452 @@
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from parallel import process_context
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; jobs then run without a memory limit
+    resource = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+FINISHED_STATES = frozenset(('succeeded', 'failed', 'cancelled', 'timeout'))
+# Job state shared by the web worker processes (see JobStore)
+JOB_DIR = os.getenv('JOB_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs')
+# How often a running job is checked for cancellation and its deadline
+POLL_INTERVAL = 0.1
+
+# Pipe to the parent inside a job worker process, None everywhere else
+_progress_conn = None
+
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+def report_progress(message, fraction=None):
+    """Send a progress event for the job running in this process; a no-op outside job workers."""
+    if _progress_conn is None:
+        return
+    try:
+        _progress_conn.send(('progress', {'message': message, 'fraction': fraction}))
+    except (OSError, ValueError):
+        pass
+
+
+def _limit_memory(limit_bytes):
+    if not limit_bytes or resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit_bytes = min(limit_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, hard))
+
+
+def _worker_main(conn, func, args, memory_limit):
+    """Entry point of a job process: apply the memory limit, run func and send back its outcome."""
+    global _progress_conn
+    _progress_conn = conn
+    try:
+        _limit_memory(memory_limit)
+        conn.send(('result', func(*args)))
+    except MemoryError:
+        conn.send(('error', f"Memory limit of {memory_limit // 2 ** 20} MB exceeded"))
+    except BaseException as e:
+        logger.error(f"Job failed: {e}\n{traceback.format_exc()}")
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class Job:
+    def __init__(self, kind, func, args, on_complete=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.on_complete = on_complete
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.events = []
+        self.cancel_requested = False
+
+    @classmethod
+    def from_record(cls, record, result=None):
+        """Read-only copy of a job owned by another process, from its JobStore record."""
+        job = cls(record['kind'], None, None)
+        job.id = record['job_id']
+        for field in ('state', 'submitted', 'started', 'finished', 'progress', 'error', 'events'):
+            setattr(job, field, record[field])
+        job.result = result
+        return job
+
+    @property
+    def done(self):
+        return self.state in FINISHED_STATES
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'wait_time': (self.started or now) - self.submitted,
+            'run_time': ((self.finished or now) - self.started) if self.started else None,
+            'progress': self.progress,
+            'error': self.error
+        }
+
+
+class JobStore:
+    """
+    Job state shared by every web worker process through a directory: the
+    worker that accepted a job (its owner) writes the status and events to
+    <id>.json on every event and the pickled result to <id>.result before
+    the job is marked finished, so any worker can answer status, result and
+    event requests. A cancellation arriving at another worker leaves an
+    <id>.cancel marker that the owner picks up. Files older than retention
+    seconds are removed.
+    """
+
+    def __init__(self, directory=JOB_DIR, retention=86400):
+        self.directory = directory
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.directory, f'{job_id}.{suffix}')
+
+    def _write(self, path, data):
+        tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, job):
+        record = {**job.to_dict(), 'events': job.events, 'owner': os.getpid()}
+        try:
+            self._write(self._path(job.id, 'json'), json.dumps(record, default=str).encode('utf-8'))
+        except OSError as e:
+            logger.error(f"Could not save job {job.id}: {e}")
+
+    def save_result(self, job):
+        try:
+            self._write(self._path(job.id, 'result'), pickle.dumps(job.result, protocol=pickle.HIGHEST_PROTOCOL))
+        except (OSError, pickle.PicklingError) as e:
+            logger.error(f"Could not save the result of job {job.id}: {e}")
+
+    def load(self, job_id):
+        """The job as last saved by its owner, or None."""
+        if not all(c.isalnum() for c in str(job_id)):
+            return None
+        try:
+            with open(self._path(job_id, 'json'), 'rb') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        result = None
+        if record['state'] == 'succeeded':
+            try:
+                with open(self._path(job_id, 'result'), 'rb') as f:
+                    result = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                record.update(state='failed', error="The job result is no longer available")
+        elif record['state'] not in FINISHED_STATES and not _alive(record['owner']):
+            record.update(state='failed', error="The worker process running the job exited")
+        return Job.from_record(record, result)
+
+    def request_cancel(self, job_id):
+        try:
+            self._write(self._path(job_id, 'cancel'), b'')
+        except OSError as e:
+            logger.error(f"Could not request cancellation of job {job_id}: {e}")
+
+    def cancel_requested(self, job_id):
+        return os.path.exists(self._path(job_id, 'cancel'))
+
+    def delete(self, job_id):
+        for suffix in ('json', 'result', 'cancel'):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def prune(self):
+        cutoff = time.time() - self.retention
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    Bounded queue of long-running analyses executed in worker processes.
+
+    max_workers slot threads each take the oldest queued job and run it in a
+    fresh process, so a job can be given its own address-space limit and be
+    terminated on cancellation or when it exceeds time_limit seconds. Finished
+    jobs are kept (with their results) until history newer ones have finished.
+    Work done inside a job process - result cache entries included - stays
+    in that process; only the job's return value comes back. Jobs are
+    mirrored to a JobStore, so the other web workers can report on them.
+    Job processes come from a fork server (or spawn) by default rather than
+    a fork of the multithreaded web worker; see parallel.default_start_method.
+    """
+
+    def __init__(self, max_workers=2, max_queued=64, time_limit=300, memory_limit=4 * 1024 ** 3,
+                 history=256, start_method=None, store=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.history = history
+        self._context = process_context(start_method)
+        self._store = store or JobStore()
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._running = 0
+        self._workers = []
+        self._cond = threading.Condition()
+        self.counters = {'submitted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0,
+                         'cancelled': 0, 'timeout': 0}
+        self._started = 0
+        self._wait_total = 0.0
+        self._ran = 0
+        self._run_total = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_workers=int(os.getenv('JOB_WORKERS', 2)),
+            max_queued=int(os.getenv('JOB_QUEUE_SIZE', 64)),
+            time_limit=float(os.getenv('JOB_TIME_LIMIT', 300)),
+            memory_limit=int(float(os.getenv('JOB_MEMORY_LIMIT_MB', 4096)) * 1024 ** 2),
+            history=int(os.getenv('JOB_HISTORY', 256)),
+            start_method=os.getenv('JOB_START_METHOD') or None,
+            store=JobStore(JOB_DIR, retention=float(os.getenv('JOB_RETENTION', 86400)))
+        )
+
+    def _start_workers(self):
+        # Slot threads start with the first job so importing the app spawns nothing
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, name=f'job-worker-{len(self._workers)}',
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _event(self, job, event, data=None):
+        """Record an event for job; the caller holds self._cond."""
+        job.events.append({'id': len(job.events) + 1, 'event': event, 'time': time.time(), 'data': data or {}})
+        self._store.save(job)
+        self._cond.notify_all()
+
+    def submit(self, kind, func, *args, on_complete=None):
+        """
+        Queue func(*args) and return its Job. func must be a module-level
+        function and args picklable unless the start method is 'fork'. on_complete(result) runs in this
+        process after the job succeeds. Raises JobQueueFull when max_queued
+        jobs are already waiting.
+        """
+        job = Job(kind, func, args, on_complete)
+        self._store.prune()
+        with self._cond:
+            if len(self._pending) >= self.max_queued:
+                self.counters['rejected'] += 1
+                raise JobQueueFull(f"Job queue is full ({self.max_queued} jobs waiting)")
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self.counters['submitted'] += 1
+            self._event(job, 'queued', {'position': len(self._pending)})
+            self._start_workers()
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def get(self, job_id):
+        """The job, from this process or - when another worker owns it - from the store; None if unknown."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._store.load(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False when it does not exist or already finished."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job.done:
+                    return False
+                if job.state == 'queued':
+                    self._pending.remove(job)
+                    self._finish(job, 'cancelled', error="Cancelled before it started")
+                else:
+                    # The slot thread terminates the process within POLL_INTERVAL
+                    job.cancel_requested = True
+        if job is None:
+            job = self._store.load(job_id)
+            if job is None or job.done:
+                return False
+            # The owning worker picks the marker up within POLL_INTERVAL
+            self._store.request_cancel(job_id)
+        logger.info(f"Cancellation requested for job {job_id}")
+        return True
+
+    def wait_events(self, job_id, after=0, timeout=15.0):
+        """
+        Events of a job with an id above after, waiting up to timeout seconds
+        for one to arrive, and whether the job has finished.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._cond.wait_for(lambda: len(job.events) > after or job.done, timeout)
+                return job.events[after:], job.done
+        # Owned by another worker: follow its file
+        deadline = time.time() + timeout
+        while True:
+            job = self._store.load(job_id)
+            if job is None or len(job.events) > after or job.done or time.time() >= deadline:
+                return (job.events[after:], job.done) if job is not None else ([], True)
+            time.sleep(5 * POLL_INTERVAL)
+
+    def _finish(self, job, state, result=None, error=None):
+        """Move job to a finished state; the caller holds self._cond."""
+        job.state = state
+        job.finished = time.time()
+        job.result = result
+        job.error = error
+        job.func = job.args = None
+        if state == 'succeeded':
+            # Written before the finished state, which tells other workers the result is there
+            self._store.save_result(job)
+        self.counters[state] += 1
+        if job.started:
+            self._ran += 1
+            self._run_total += job.finished - job.started
+        self._event(job, state, {'error': error} if error else None)
+        # Forget the oldest finished jobs beyond the history size
+        finished = [key for key, other in self._jobs.items() if other.done]
+        for key in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[key]
+            self._store.delete(key)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                job = self._pending.popleft()
+                if self._store.cancel_requested(job.id):
+                    self._finish(job, 'cancelled', error="Cancelled before it started")
+                    continue
+                job.state = 'running'
+                job.started = time.time()
+                self._started += 1
+                self._wait_total += job.started - job.submitted
+                self._running += 1
+                self._event(job, 'running')
+            try:
+                state, result, error = self._execute(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} could not be run: {e}\n{traceback.format_exc()}")
+                state, result, error = 'failed', None, str(e)
+            if state == 'succeeded' and job.on_complete is not None:
+                try:
+                    job.on_complete(result)
+                except Exception as e:
+                    logger.error(f"Completion hook of job {job.id} failed: {e}")
+            with self._cond:
+                self._running -= 1
+                self._finish(job, state, result, error)
+            logger.info(f"Job {job.id} {state} after {job.finished - job.started:.2f} s")
+
+    def _execute(self, job):
+        """Run job in its own process; returns (state, result, error)."""
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker_main,
+                                        args=(child_conn, job.func, job.args, self.memory_limit),
+                                        name=f'job-{job.id}', daemon=True)
+        process.start()
+        child_conn.close()
+        deadline = job.started + self.time_limit
+        outcome = None
+        try:
+            while outcome is None:
+                remaining = deadline - time.time()
+                if job.cancel_requested or self._store.cancel_requested(job.id):
+                    outcome = ('cancelled', None, "Cancelled while running")
+                elif remaining <= 0:
+                    outcome = ('timeout', None, f"Time limit of {self.time_limit:g} s exceeded")
+                elif parent_conn.poll(min(POLL_INTERVAL, remaining)):
+                    try:
+                        kind, payload = parent_conn.recv()
+                    except EOFError:
+                        process.join()
+                        outcome = ('failed', None, f"Worker process exited with code {process.exitcode}")
+                        continue
+                    if kind == 'progress':
+                        with self._cond:
+                            job.progress = payload
+                            self._event(job, 'progress', payload)
+                    elif kind == 'result':
+                        outcome = ('succeeded', payload, None)
+                    else:
+                        outcome = ('failed', None, payload)
+        finally:
+            parent_conn.close()
+            if process.is_alive():
+                process.terminate()
+                process.join(1.0)
+                if process.is_alive():
+                    process.kill()
+            process.join()
+        return outcome
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self.counters,
+                'queued': len(self._pending),
+                'running': self._running,
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'time_limit': self.time_limit,
+                'memory_limit': self.memory_limit,
+                'tracked_jobs': len(self._jobs),
+                'mean_wait_time': self._wait_total / self._started if self._started else 0.0,
+                'mean_run_time': self._run_total / self._ran if self._ran else 0.0
+            }
+
+
+job_queue = JobQueue.from_env()
@@ -0,0 +1,106 @@
+import gc
+import importlib
+import logging
+import os
+import time
+from metrics import stage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Dependencies imported by warm_up(), by group
+WARM_UP_GROUPS = {
+    'numeric': ('numpy', 'scipy.sparse', 'scipy.sparse.linalg'),
+    'symbolic': ('sympy', 'lcapy'),
+    'plots': ('matplotlib.pyplot',),
+    'rf': ('skrf',),
+    'web': ('fastapi',),
+}
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access, so
+    importing the code that uses it stays cheap until the dependency is
+    actually needed. before() runs once ahead of the real import. Imports
+    go through importlib and are therefore thread-safe.
+    """
+
+    def __init__(self, name, before=None):
+        self._name = name
+        self._before = before
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            with stage('import'):
+                if self._before is not None:
+                    self._before()
+                self._module = importlib.import_module(self._name)
+            logger.info(f"Imported {self._name} on first use in {time.perf_counter() - started:.2f} s")
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def lazy_pyplot():
+    """matplotlib.pyplot on the non-interactive Agg backend, imported on first use."""
+    return LazyModule('matplotlib.pyplot', before=_use_agg)
+
+
+def warm_up(groups='all', freeze=False):
+    """
+    Import the heavy dependencies of the given groups (names from
+    WARM_UP_GROUPS, comma separated, or 'all') ahead of time, e.g. in a
+    server process before it forks workers so they share the imported
+    modules copy-on-write. freeze moves every object that exists now into
+    the permanent GC generation so later collections in the workers do not
+    touch (and copy) those pages. Returns the import time per module.
+    """
+    if isinstance(groups, str):
+        groups = list(WARM_UP_GROUPS) if groups.strip() == 'all' else [g.strip() for g in groups.split(',')]
+    timings = {}
+    for group in groups:
+        if not group:
+            continue
+        if group not in WARM_UP_GROUPS:
+            logger.warning(f"Unknown warm-up group '{group}' (use {', '.join(WARM_UP_GROUPS)} or all)")
+            continue
+        if group == 'plots':
+            _use_agg()
+        for name in WARM_UP_GROUPS[group]:
+            started = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logger.warning(f"Warm-up could not import {name}: {e}")
+                continue
+            timings[name] = time.perf_counter() - started
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    logger.info(f"Warm-up imported {', '.join(timings) or 'nothing'} in {sum(timings.values()):.2f} s")
+    return timings
+
+
+def warm_up_from_env():
+    """warm_up() configured by WARM_UP_MODULES (default 'all'; 'none' disables it)."""
+    groups = os.getenv('WARM_UP_MODULES', 'all')
+    if groups.strip().lower() in ('', 'none', '0', 'false'):
+        return {}
+    return warm_up(groups, freeze=True)
@@ -0,0 +1,228 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Label value standing in for anything outside a label's known values
+OTHER = 'other'
+
+# The StageTimer of the request or run_* call executing in this context
+_current_timer = contextvars.ContextVar('stage_timer', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Histograms and counters rendered in the Prometheus text exposition format.
+    Every process (gunicorn worker, job process) keeps its own registry, so
+    Prometheus should scrape each worker or aggregate them.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, namespace='circuit'):
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        # name -> (kind, help, label names, {label values: state})
+        self._metrics = {}
+
+    @classmethod
+    def from_env(cls):
+        buckets = os.getenv('METRICS_BUCKETS')
+        return cls(buckets=tuple(float(b) for b in buckets.split(',')) if buckets else DEFAULT_BUCKETS)
+
+    def _series(self, kind, name, help_text, labels):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = (kind, help_text, tuple(labels), {})
+        return metric[3]
+
+    def observe(self, name, value, help_text='', **labels):
+        """Add value to the histogram name for the given label values."""
+        with self._lock:
+            series = self._series('histogram', name, help_text, labels)
+            key = tuple(labels.values())
+            state = series.get(key)
+            if state is None:
+                state = series[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            state['buckets'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def inc(self, name, amount=1, help_text='', **labels):
+        with self._lock:
+            series = self._series('counter', name, help_text, labels)
+            key = tuple(labels.values())
+            series[key] = series.get(key, 0) + amount
+
+    def render(self, gauges=None):
+        """
+        The registry in the Prometheus text format; gauges maps extra metric
+        names to (help, value) pairs sampled by the caller.
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, label_names, series) in sorted(self._metrics.items()):
+                full_name = f'{self.namespace}_{name}'
+                lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for key, state in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append(f'{full_name}{_labels(label_names, key)} {_number(state)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), state['buckets']):
+                        cumulative += count
+                        le = (('le', _number(bound)),)
+                        lines.append(f'{full_name}_bucket{_labels(label_names, key, le)} {cumulative}')
+                    lines.append(f'{full_name}_sum{_labels(label_names, key)} {_number(state["sum"])}')
+                    lines.append(f'{full_name}_count{_labels(label_names, key)} {state["count"]}')
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            full_name = f'{self.namespace}_{name}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} gauge')
+            lines.append(f'{full_name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+metrics = MetricsRegistry.from_env()
+
+
+class StageTimer:
+    """
+    Wall time per stage (netlist, preprocess, circuit, solve, plot, serialize,
+    ...) of one request or analysis run. Stages may nest; each records only
+    its own (exclusive) time, so the stages of a run add up to at most its
+    total. finish() feeds the stage and total histograms of the registry.
+    """
+
+    def __init__(self, analysis=None):
+        self.analysis = analysis
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        frame = [time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def finish(self, registry=None):
+        registry = registry or metrics
+        analysis = self.analysis or 'none'
+        for name, seconds in self.stages.items():
+            registry.observe('stage_duration_seconds', seconds, 'Wall time per analysis stage',
+                             analysis=analysis, stage=name)
+        registry.observe('analysis_duration_seconds', self.total(), 'Wall time per analysis run',
+                         analysis=analysis)
+
+    def header(self):
+        """'stage=ms, ..., total=ms' for the X-Timing response header."""
+        parts = [f'{name}={seconds * 1e3:.2f}' for name, seconds in self.stages.items()]
+        parts.append(f'total={self.total() * 1e3:.2f}')
+        return ', '.join(parts)
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def bounded(value, known):
+    """
+    value when it is one of known, otherwise OTHER. Series are never evicted,
+    so labels taken from request input must come from a fixed set.
+    """
+    return value if value in known else OTHER
+
+
+def set_analysis(analysis):
+    """Label the current run (e.g. a request once its body is parsed) with analysis."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.analysis = analysis
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage name of the current run; a no-op outside timed()."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+@contextmanager
+def timed(analysis):
+    """
+    Run a block as an analysis run: inside a request (or an enclosing run) it
+    labels that timer with analysis unless it already has a label, otherwise
+    it starts a timer of its own and records it when the block exits.
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        if timer.analysis is None:
+            timer.analysis = analysis
+        yield timer
+        return
+    timer = StageTimer(analysis)
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+        timer.finish()
+
+
+def start_request_timer():
+    """Make a fresh StageTimer current for the request being handled; returns (timer, token)."""
+    timer = StageTimer()
+    return timer, _current_timer.set(timer)
+
+
+def end_request_timer(token):
+    _current_timer.reset(token)
@@ -0,0 +1,350 @@
+import logging
+import numpy as np
+import scipy.sparse as sparse
+from parallel import parallel_executor
+from factorization import factorization_cache, factorize
+from metrics import stage
+from circuit_ir import GROUND, parse_circuit, parse_value
+
+# Setup logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Elements that carry an extra branch-current unknown in the MNA vector
+BRANCH_TYPES = ('V', 'E', 'H', 'L')
+SUPPORTED_TYPES = ('R', 'C', 'L', 'V', 'I', 'E', 'G', 'F', 'H')
+# Systems up to this size are solved as dense batches across frequencies
+DENSE_AC_LIMIT = 80
+# Memory budget (bytes) of one batch of dense complex matrices
+AC_BATCH_BYTES = 32 * 1024 * 1024
+
+
+def _solve_ac_shard(start, stop, inputs, outputs, circuit):
+    outputs['X'][start:stop] = circuit.solve_ac_block(inputs['omegas'][start:stop], inputs['B'])
+
+
+class MNACircuit:
+    """
+    Numeric Modified Nodal Analysis model of a linear netlist.
+
+    The circuit is stored in descriptor form  C·x' + G·x = b  where x holds the
+    non-ground node voltages followed by the branch currents of V/E/H/L
+    elements. DC analysis solves G·x = b with a sparse LU factorization.
+    """
+
+    @stage('circuit')
+    def __init__(self, netlist, extra_nodes=()):
+        """netlist is netlist text in the lcapy syntax or a CircuitIR."""
+        self.elements = []
+        self.branch_index = {}
+        self._parse(parse_circuit(netlist), extra_nodes)
+        self.size = len(self.nodes) + len(self.branch_index)
+        self.G, self.C, self.b_dc, self.b_step, self.b_ac = self._assemble()
+        # DC analysis treats step sources at their final value
+        self.b = self.b_dc + self.b_step
+
+    def _node(self, name):
+        if name == GROUND:
+            return -1
+        if name not in self.node_index:
+            self.node_index[name] = len(self.nodes)
+            self.nodes.append(name)
+        return self.node_index[name]
+
+    def _parse(self, circuit, extra_nodes=()):
+        # Node ids of the circuit IR are the MNA row indices (ground is -1)
+        self.nodes = list(circuit.nodes)
+        self.node_index = dict(circuit.node_index)
+        for i, name in enumerate(circuit.names):
+            kind = circuit.kinds[i]
+            line_num = circuit.lines[i]
+            if kind not in SUPPORTED_TYPES:
+                raise ValueError(f"Line {line_num}: unsupported element for numeric analysis: {name}")
+            terminals = [int(n) for n in circuit.element_terminals(i)]
+            args = circuit.params[i]
+            value = float(circuit.values[i])
+            element = {'name': name, 'type': kind, 'nodes': tuple(terminals[:2])}
+
+            if kind in ('E', 'G'):
+                if len(terminals) < 4 or np.isnan(value):
+                    raise ValueError(f"Line {line_num}: {name} needs two control nodes and a gain")
+                element['control'] = tuple(terminals[2:4])
+                element['value'] = value
+            elif kind in ('F', 'H'):
+                if len(args) < 2 or np.isnan(value):
+                    raise ValueError(f"Line {line_num}: {name} needs a control source and a gain")
+                element['control_name'] = args[0]
+                element['value'] = value
+            elif kind in ('V', 'I'):
+                if np.isnan(value):
+                    raise ValueError(f"Line {line_num}: invalid value for {name}: {' '.join(args)}")
+                element['value'] = value
+                element['waveform'] = 'step' if args and args[0].lower() == 'step' else 'dc'
+                element['ac'] = self._ac_phasor(args)
+            else:
+                if not args:
+                    raise ValueError(f"Line {line_num}: {name} needs a value")
+                if np.isnan(value):
+                    raise ValueError(f"Line {line_num}: invalid numeric value for {name}: {args[0]}")
+                element['value'] = value
+                if kind == 'R' and element['value'] == 0:
+                    raise ValueError(f"Line {line_num}: zero resistance for {name}")
+
+            if kind in BRANCH_TYPES:
+                self.branch_index[name] = None
+            self.elements.append(element)
+
+        # Nodes only touched by elements stamped outside this class (e.g. diodes)
+        for name in extra_nodes:
+            self._node(name)
+
+        # Branch unknowns are numbered after every node has been seen
+        offset = len(self.nodes)
+        for i, name in enumerate(self.branch_index):
+            self.branch_index[name] = offset + i
+
+        for element in self.elements:
+            if 'control_name' in element:
+                control = element['control_name']
+                if control not in self.branch_index:
+                    raise ValueError(f"{element['name']}: control source {control} not found")
+                element['control_branch'] = self.branch_index[control]
+
+    @staticmethod
+    def _ac_phasor(args):
+        """Small-signal phasor of 'AC <magnitude> [phase in degrees]'; other sources are zero in AC."""
+        if not args or args[0].lower() != 'ac':
+            return 0j
+        magnitude = parse_value(args[1]) if len(args) > 1 else 1.0
+        phase = parse_value(args[2]) if len(args) > 2 else 0.0
+        return magnitude * np.exp(1j * np.radians(phase))
+
+    @staticmethod
+    def coefficient(element, value=None):
+        """
+        Factor the element's stamps are linear in: the conductance of a
+        resistor, the value itself for every other element. value (a scalar or
+        an array of values) defaults to the element's own value.
+        """
+        value = element.get('value', 0.0) if value is None else value
+        return np.reciprocal(np.asarray(value, dtype=float)) if element['type'] == 'R' else value
+
+    def _stamp(self, element, coefficient, ac, g, c, b, b_ac, structural=True):
+        """
+        Stamp one element into the (rows, cols, vals) lists g and c and the
+        source vectors b and b_ac. With structural=False only the entries
+        proportional to coefficient (and ac) are stamped, leaving out the
+        fixed incidence entries of branch elements.
+        """
+        def stamp(triplet, r, col, v):
+            if r >= 0 and col >= 0:
+                triplet[0].append(r)
+                triplet[1].append(col)
+                triplet[2].append(v)
+
+        def stamp_admittance(triplet, a, k, y):
+            stamp(triplet, a, a, y)
+            stamp(triplet, k, k, y)
+            stamp(triplet, a, k, -y)
+            stamp(triplet, k, a, -y)
+
+        kind = element['type']
+        a, k = element['nodes']
+        if kind == 'R':
+            stamp_admittance(g, a, k, coefficient)
+        elif kind == 'C':
+            stamp_admittance(c, a, k, coefficient)
+        elif kind == 'I':
+            # lcapy convention: the source drives its current into the + node
+            if a >= 0:
+                b[a] += coefficient
+                b_ac[a] += ac
+            if k >= 0:
+                b[k] -= coefficient
+                b_ac[k] -= ac
+        elif kind == 'G':
+            c1, c2 = element['control']
+            stamp(g, a, c1, -coefficient)
+            stamp(g, a, c2, coefficient)
+            stamp(g, k, c1, coefficient)
+            stamp(g, k, c2, -coefficient)
+        elif kind == 'F':
+            # Like an I source, it drives coefficient * (control current) into the + node
+            m = element['control_branch']
+            stamp(g, a, m, -coefficient)
+            stamp(g, k, m, coefficient)
+        else:
+            # Branch elements: KCL contribution plus a branch equation row
+            br = self.branch_index[element['name']]
+            if structural:
+                stamp(g, a, br, 1.0)
+                stamp(g, k, br, -1.0)
+                stamp(g, br, a, 1.0)
+                stamp(g, br, k, -1.0)
+            if kind == 'V':
+                b[br] = coefficient
+                b_ac[br] = ac
+            elif kind == 'L':
+                stamp(c, br, br, -coefficient)
+            elif kind == 'E':
+                c1, c2 = element['control']
+                stamp(g, br, c1, -coefficient)
+                stamp(g, br, c2, coefficient)
+            elif kind == 'H':
+                stamp(g, br, element['control_branch'], -coefficient)
+
+    def _assemble(self):
+        """
+        Stamp every element into the sparse G, C matrices and the source vectors.
+        Constant sources go to b_dc, sources switched on at t=0 to b_step and
+        AC phasors to the complex b_ac.
+        """
+        g = ([], [], [])
+        c = ([], [], [])
+        b_dc = np.zeros(self.size)
+        b_step = np.zeros(self.size)
+        b_ac = np.zeros(self.size, dtype=complex)
+
+        for element in self.elements:
+            b = b_step if element.get('waveform') == 'step' else b_dc
+            self._stamp(element, self.coefficient(element), element.get('ac', 0j), g, c, b, b_ac)
+
+        return self._matrix(g), self._matrix(c), b_dc, b_step, b_ac
+
+    def _matrix(self, triplet):
+        rows, cols, vals = triplet
+        return sparse.coo_matrix((vals, (rows, cols)), shape=(self.size, self.size)).tocsc()
+
+    def element_stamp(self, name):
+        """
+        Unit stamp of element name: (G, C, b, b_ac) such that the assembled
+        system changes by coefficient·G, coefficient·C and coefficient·b when
+        the element's coefficient (see coefficient()) changes by that amount,
+        and by magnitude·b_ac when its AC magnitude does. b covers both DC and
+        step sources.
+        """
+        element = next((e for e in self.elements if e['name'] == name), None)
+        if element is None:
+            raise KeyError(f"Unknown element: {name}")
+        g = ([], [], [])
+        c = ([], [], [])
+        b = np.zeros(self.size)
+        b_ac = np.zeros(self.size, dtype=complex)
+        ac = element.get('ac', 0j)
+        unit_ac = ac / abs(ac) if ac else 1.0 + 0j
+        self._stamp(element, 1.0, unit_ac, g, c, b, b_ac, structural=False)
+        return self._matrix(g), self._matrix(c), b, b_ac
+
+    @stage('solve')
+    def solve_dc(self):
+        """
+        Solve the DC operating point and return the MNA solution vector. The
+        factorization is cached, so re-solving after a few element values
+        changed is a low-rank update instead of a new factorization.
+        """
+        if self.size == 0:
+            return np.zeros(0)
+        try:
+            x = factorization_cache.solve(self.G, self.b)
+        except RuntimeError as e:
+            raise ValueError(f"Singular MNA matrix (floating node or source loop?): {e}")
+        if not np.all(np.isfinite(x)):
+            raise ValueError("MNA solve produced non-finite values")
+        return x
+
+    @stage('solve')
+    def solve_ac(self, omegas, b=None):
+        """
+        Solve (G + jωC)·x = b for every angular frequency in omegas; b defaults
+        to the AC source phasors and may hold several right-hand sides as
+        columns. Returns an array of shape (len(omegas), size[, columns]).
+
+        Small systems are solved as dense batches (one LAPACK call per batch of
+        frequencies); large ones get one sparse complex LU per frequency.
+        """
+        omegas = np.atleast_1d(np.asarray(omegas, dtype=float))
+        b = np.asarray(self.b_ac if b is None else b, dtype=complex)
+        B = b if b.ndim == 2 else b[:, None]
+        shape = (len(omegas), self.size, B.shape[1])
+        # Frequencies are sharded over the parallel executor once the system is large enough
+        X = parallel_executor.map(_solve_ac_shard, len(omegas), {'omegas': omegas, 'B': B},
+                                  {'X': (shape, complex)}, (self,),
+                                  cost=self.G.nnz + self.C.nnz + self.size * B.shape[1])['X']
+        return X if b.ndim == 2 else X[..., 0]
+
+    def solve_ac_block(self, omegas, B):
+        """(G + jωC)·X = B for every ω in omegas, B holding right-hand sides as columns."""
+        X = np.empty((len(omegas), self.size, B.shape[1]), dtype=complex)
+        if self.size == 0:
+            return X
+
+        if self.size <= DENSE_AC_LIMIT:
+            G = self.G.toarray()
+            C = self.C.toarray()
+            batch = max(1, AC_BATCH_BYTES // (16 * self.size * self.size))
+            for start in range(0, len(omegas), batch):
+                w = omegas[start:start + batch]
+                A = G[None, :, :] + 1j * w[:, None, None] * C[None, :, :]
+                rhs = np.broadcast_to(B, (len(w),) + B.shape)
+                try:
+                    X[start:start + batch] = np.linalg.solve(A, rhs)
+                except np.linalg.LinAlgError as e:
+                    raise ValueError(f"Singular AC system matrix (floating node or source loop?): {e}")
+        else:
+            G = self.G.astype(complex)
+            C = self.C.astype(complex)
+            for i, w in enumerate(omegas):
+                try:
+                    X[i] = factorize(G + 1j * w * C).solve(B)
+                except RuntimeError as e:
+                    raise ValueError(f"Singular AC system matrix at {w / (2 * np.pi):g} Hz: {e}")
+        if not np.all(np.isfinite(X)):
+            raise ValueError("AC solve produced non-finite values")
+        return X
+
+    def node_voltage(self, x, index):
+        """Voltage of a node index in a solution vector (or a stack of them, one per row)."""
+        return x[..., index] if index >= 0 else 0.0
+
+    def element_voltage(self, x, element):
+        a, k = element['nodes']
+        return self.node_voltage(x, a) - self.node_voltage(x, k)
+
+    def element_current(self, x, element):
+        """Current through an element in the passive sign convention used by lcapy."""
+        kind = element['type']
+        value = element.get('value', 0.0)
+        if kind == 'R':
+            return self.element_voltage(x, element) / value
+        if kind == 'C':
+            return 0.0
+        if kind == 'I':
+            return -value
+        if kind == 'G':
+            c1, c2 = element['control']
+            return -value * (self.node_voltage(x, c1) - self.node_voltage(x, c2))
+        if kind == 'F':
+            return -value * x[..., element['control_branch']]
+        return x[..., self.branch_index[element['name']]]
+
+    def dc_results(self, x):
+        """Format a DC solution as the V_node_* / V_* / I_* dictionaries."""
+        voltages = {}
+        currents = {}
+        for node, index in self.node_index.items():
+            voltages[f'V_node_{node}'] = float(x[index])
+        for element in self.elements:
+            name = element['name']
+            voltages[f'V_{name}'] = float(self.element_voltage(x, element))
+            currents[f'I_{name}'] = float(self.element_current(x, element))
+        return voltages, currents
+
+
+def run_numeric_dc(netlist):
+    """Numeric DC operating point of a preprocessed (lcapy syntax) netlist or CircuitIR."""
+    circuit = MNACircuit(netlist)
+    logger.info(f"Numeric MNA system: {len(circuit.nodes)} nodes, "
+                f"{len(circuit.branch_index)} branches, {circuit.G.nnz} non-zeros")
+    x = circuit.solve_dc()
+    return circuit.dc_results(x)
@@ -0,0 +1,30 @@
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def load_netlist(netlist=None, netlist_filename='netlist.txt'):
+    """
+    Return the netlist text for an analysis.
+
+    netlist may be a netlist string, a sequence of lines or a parsed object
+    exposing to_netlist(); when it is None the netlist is read from
+    netlist_filename. Raises FileNotFoundError if neither is available.
+    """
+    if netlist is None:
+        with open(netlist_filename, 'r') as file:
+            netlist_string = file.read()
+        logger.info(f"Read netlist from: {netlist_filename}")
+        return netlist_string
+    if isinstance(netlist, str):
+        return netlist
+    if hasattr(netlist, 'to_netlist'):
+        return netlist.to_netlist()
+    if isinstance(netlist, (list, tuple)):
+        return '\n'.join(line.rstrip('\n') for line in netlist)
+    raise TypeError(f"Unsupported netlist type: {type(netlist).__name__}")
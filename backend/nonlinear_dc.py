@@ -0,0 +1,235 @@
+import logging
+import numpy as np
+import scipy.sparse as sparse
+from factorization import factorize
+from mna import MNACircuit
+from circuit_ir import GROUND, parse_circuit, parse_value
+
+# Setup logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+THERMAL_VOLTAGE = 0.025852  # kT/q at 300 K
+DEFAULT_DIODE = {'Is': 1e-14, 'n': 1.0, 'Rs': 0.0}
+GMIN = 1e-12
+GMIN_STEPS = (1e-2, 1e-3, 1e-4, 1e-5, 1e-6, 1e-7, 1e-8, 1e-9, 1e-10, 1e-11, 1e-12)
+
+
+def parse_diode(tokens):
+    """
+    Parse 'D<name> <anode> <cathode> [Is=..] [n=..] [Rs=..]'.
+    A bare value (as sent by the canvas) is ignored and the default model is used.
+    """
+    params = dict(DEFAULT_DIODE)
+    for token in tokens[3:]:
+        if '=' not in token:
+            logger.debug(f"Ignoring bare diode value '{token}' for {tokens[0]}")
+            continue
+        key, value = token.split('=', 1)
+        for param in DEFAULT_DIODE:
+            if key.lower() == param.lower():
+                params[param] = parse_value(value)
+                break
+        else:
+            logger.warning(f"Unknown diode parameter '{key}' for {tokens[0]}")
+    return {'name': tokens[0], 'anode': tokens[1], 'cathode': tokens[2], **params}
+
+
+class DiodeCircuit:
+    """
+    Linear MNA circuit plus Shockley diodes  Id = Is·(exp(Vd/(n·Vt)) - 1).
+
+    Series resistances are added to the linear part through an internal node, so
+    every Newton iteration only re-stamps one conductance and one current source
+    per junction on top of the constant linear matrix.
+    """
+
+    def __init__(self, netlist):
+        circuit = parse_circuit(netlist)
+        is_diode = circuit.kinds == 'D'
+        linear = circuit.select(~is_diode)
+        series = []
+        self.diodes = []
+        for i in np.flatnonzero(is_diode):
+            diode = parse_diode(circuit.tokens(i))
+            diode['junction'] = diode['anode']
+            if diode['Rs'] > 0:
+                diode['junction'] = f"{diode['name']}#int"
+                series.append(f"R{diode['name']}#rs {diode['anode']} {diode['junction']} {diode['Rs']}")
+            self.diodes.append(diode)
+        if series:
+            linear = '\n'.join([linear.to_netlist()] + series)
+
+        extra_nodes = [n for d in self.diodes for n in (d['junction'], d['cathode']) if n != GROUND]
+        self.linear = MNACircuit(linear, extra_nodes=extra_nodes)
+        self.size = self.linear.size
+
+        index = self.linear.node_index
+        self.anode_idx = np.array([index.get(d['junction'], -1) for d in self.diodes], dtype=int)
+        self.cathode_idx = np.array([index.get(d['cathode'], -1) for d in self.diodes], dtype=int)
+        self.Is = np.array([d['Is'] for d in self.diodes], dtype=float)
+        self.nVt = np.array([d['n'] for d in self.diodes], dtype=float) * THERMAL_VOLTAGE
+        self.vcrit = self.nVt * np.log(self.nVt / (np.sqrt(2) * self.Is))
+
+        # Fixed stamp pattern of the junction conductances: (a,a), (k,k), (a,k), (k,a)
+        a, k = self.anode_idx, self.cathode_idx
+        rows = np.concatenate([a, k, a, k])
+        cols = np.concatenate([a, k, k, a])
+        signs = np.concatenate([np.ones(len(a)), np.ones(len(a)), -np.ones(len(a)), -np.ones(len(a))])
+        keep = (rows >= 0) & (cols >= 0)
+        self._stamp_rows, self._stamp_cols = rows[keep], cols[keep]
+        self._stamp_signs, self._stamp_keep = signs[keep], keep
+        self._node_diag = sparse.diags(
+            np.r_[np.ones(len(self.linear.nodes)), np.zeros(len(self.linear.branch_index))], format='csc')
+
+    def junction_voltages(self, x):
+        xa = np.where(self.anode_idx >= 0, x[self.anode_idx], 0.0)
+        xk = np.where(self.cathode_idx >= 0, x[self.cathode_idx], 0.0)
+        return xa - xk
+
+    def junction_currents(self, vd):
+        expo = np.exp(np.minimum(vd / self.nVt, 200.0))
+        current = self.Is * (expo - 1.0) + GMIN * vd
+        conductance = self.Is * expo / self.nVt + GMIN
+        return current, conductance
+
+    def limit_junction_voltages(self, v_new, v_old):
+        """SPICE pnjlim: keep exponential junctions from overshooting between iterations."""
+        limited = v_new.copy()
+        step = (v_new > self.vcrit) & (np.abs(v_new - v_old) > 2 * self.nVt)
+        if np.any(step):
+            arg = 1 + (v_new - v_old) / self.nVt
+            from_forward = step & (v_old > 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                limited = np.where(from_forward & (arg > 0), v_old + self.nVt * np.log(np.maximum(arg, 1e-300)), limited)
+                limited = np.where(from_forward & (arg <= 0), self.vcrit, limited)
+                limited = np.where(step & ~from_forward,
+                                   self.nVt * np.log(np.maximum(v_new / self.nVt, 1e-300)), limited)
+        return limited
+
+    def assemble(self, vd, gshunt=0.0, source_scale=1.0):
+        """Linearized system at junction voltages vd."""
+        current, conductance = self.junction_currents(vd)
+        values = np.tile(conductance, 4)[self._stamp_keep] * self._stamp_signs
+        A = self.linear.G + sparse.coo_matrix(
+            (values, (self._stamp_rows, self._stamp_cols)), shape=(self.size, self.size)).tocsc()
+        if gshunt:
+            A = A + gshunt * self._node_diag
+
+        # Norton equivalent current of each junction, leaving the anode
+        ieq = current - conductance * vd
+        rhs = source_scale * self.linear.b
+        np.add.at(rhs, self.anode_idx[self.anode_idx >= 0], -ieq[self.anode_idx >= 0])
+        np.add.at(rhs, self.cathode_idx[self.cathode_idx >= 0], ieq[self.cathode_idx >= 0])
+        return A, rhs
+
+    def newton(self, x0, gshunt=0.0, source_scale=1.0, max_iterations=100,
+               reltol=1e-6, vabstol=1e-9):
+        """Damped Newton-Raphson from x0. Returns (x, iterations, converged)."""
+        x = x0.copy()
+        vd = self.junction_voltages(x)
+        for iteration in range(1, max_iterations + 1):
+            A, rhs = self.assemble(vd, gshunt, source_scale)
+            try:
+                x_new = factorize(A).solve(rhs)
+            except RuntimeError:
+                return x, iteration, False
+            if not np.all(np.isfinite(x_new)):
+                return x, iteration, False
+
+            vd_new = self.limit_junction_voltages(self.junction_voltages(x_new), vd)
+            limited = not np.allclose(vd_new, self.junction_voltages(x_new))
+            converged = np.all(np.abs(x_new - x) <= reltol * np.maximum(np.abs(x), np.abs(x_new)) + vabstol)
+            x, vd = x_new, vd_new
+            if converged and not limited:
+                return x, iteration, True
+        return x, max_iterations, False
+
+    def solve(self, max_iterations=100):
+        """
+        Solve the operating point: plain Newton first, then gmin stepping, then
+        source stepping. Returns (x, info).
+        """
+        x0 = np.zeros(self.size)
+        total = 0
+
+        x, iterations, converged = self.newton(x0, max_iterations=max_iterations)
+        total += iterations
+        if converged:
+            return x, {'iterations': total, 'homotopy': 'none'}
+
+        logger.info("Newton-Raphson did not converge, trying gmin stepping")
+        x = x0
+        for gshunt in GMIN_STEPS:
+            x, iterations, converged = self.newton(x, gshunt=gshunt, max_iterations=max_iterations)
+            total += iterations
+            if not converged:
+                break
+        if converged:
+            x, iterations, converged = self.newton(x, max_iterations=max_iterations)
+            total += iterations
+            if converged:
+                return x, {'iterations': total, 'homotopy': 'gmin'}
+
+        logger.info("gmin stepping failed, trying source stepping")
+        x, scale, step = x0, 0.0, 0.1
+        while scale < 1.0:
+            target = min(1.0, scale + step)
+            x_try, iterations, converged = self.newton(x, source_scale=target, max_iterations=max_iterations)
+            total += iterations
+            if converged:
+                x, scale = x_try, target
+                step = min(step * 2, 0.5)
+            else:
+                step /= 4
+                if step < 1e-4:
+                    raise ValueError(f"Source stepping stalled at {scale:.4f} of full source values")
+        return x, {'iterations': total, 'homotopy': 'source'}
+
+    def diode_report(self, x):
+        vd = self.junction_voltages(x)
+        current, conductance = self.junction_currents(vd)
+        report = {}
+        for i, diode in enumerate(self.diodes):
+            report[diode['name']] = {
+                'Vd': float(vd[i]),
+                'Id': float(current[i]),
+                'gd': float(conductance[i]),
+                'conducting': bool(current[i] > 1e3 * self.Is[i]),
+                'Is': diode['Is'],
+                'n': diode['n'],
+                'Rs': diode['Rs']
+            }
+        return report
+
+
+def run_nonlinear_dc(netlist_string, max_iterations=100):
+    """
+    DC operating point of a netlist containing diodes.
+    Returns (voltages, currents, info) where info holds the per-diode operating
+    points and iteration counts.
+    """
+    circuit = DiodeCircuit(netlist_string)
+    logger.info(f"Nonlinear DC: {len(circuit.diodes)} diodes, system size {circuit.size}")
+    x, info = circuit.solve(max_iterations=max_iterations)
+
+    linear = circuit.linear
+    voltages, currents = linear.dc_results(x)
+    internal = [d['junction'] for d in circuit.diodes if d['junction'] != d['anode']]
+    for node in internal:
+        voltages.pop(f'V_node_{node}', None)
+    for diode in circuit.diodes:
+        if diode['Rs'] > 0:
+            voltages.pop(f"V_R{diode['name']}#rs", None)
+            currents.pop(f"I_R{diode['name']}#rs", None)
+
+    info['diodes'] = circuit.diode_report(x)
+    for diode in circuit.diodes:
+        name = diode['name']
+        anode = linear.node_voltage(x, linear.node_index.get(diode['anode'], -1))
+        cathode = linear.node_voltage(x, linear.node_index.get(diode['cathode'], -1))
+        voltages[f'V_{name}'] = float(anode - cathode)
+        currents[f'I_{name}'] = info['diodes'][name]['Id']
+    logger.info(f"Nonlinear DC converged in {info['iterations']} iterations (homotopy: {info['homotopy']})")
+    return voltages, currents, info
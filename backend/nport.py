@@ -0,0 +1,179 @@
+import logging
+import numpy as np
+import scipy.sparse as sparse
+from factorization import factorize
+from parallel import parallel_executor
+from metrics import stage
+
+# Setup logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Node count up to which the nodal systems are solved as dense batches across frequencies
+DENSE_NODE_LIMIT = 80
+# Memory budget (bytes) of one batch of dense complex matrices
+BATCH_BYTES = 32 * 1024 * 1024
+
+
+def s_to_y(s, z0):
+    """
+    Admittance matrices (F, k, k) of scattering matrices s (F, k, k) with real
+    reference impedances z0 (scalar, per port or per frequency and port).
+    Raises LinAlgError when a block has no admittance form (e.g. an ideal thru).
+    """
+    s = np.asarray(s, dtype=complex)
+    k = s.shape[-1]
+    d = 1 / np.sqrt(np.broadcast_to(np.real(z0), s.shape[:-1]))
+    eye = np.eye(k)
+    with np.errstate(all='ignore'):
+        y = np.linalg.solve(eye + s, eye - s) * d[..., :, None] * d[..., None, :]
+    if not np.all(np.isfinite(y)):
+        raise np.linalg.LinAlgError("network has no admittance representation")
+    return y
+
+
+def _solve_shard(start, stop, inputs, outputs, network):
+    outputs['K'][start:stop] = network.port_block(inputs['values'][start:stop], inputs['B'])
+
+
+class NodalConnection:
+    """
+    N-port connection engine: blocks given by their admittance matrices are
+    stamped into a nodal admittance matrix Y(f), every external port
+    (between two nodes, with real reference impedance z0) is terminated in
+    its z0 and the scattering matrix follows from one solve per frequency:
+
+        S = 2·D·Aᵀ·(Y + A·Z0⁻¹·Aᵀ)⁻¹·A·D - I,   D = Z0^-1/2
+
+    with A the port incidence matrix. Works for any topology and port
+    count; all frequencies are handled as one batched array, as dense
+    batches for small node counts and with a sparse LU per frequency
+    (sharded over the parallel executor) for large ones. Node index -1 is
+    the reference (ground).
+
+    The topology - groups of elements and the ports - is added once and
+    compile()d into the sparsity pattern; solve() then only takes the
+    admittance values, so one connection serves any element values and
+    frequency grid.
+    """
+
+    def __init__(self, node_count):
+        self.size = node_count
+        self.port_plus, self.port_minus = [], []
+        # Per group: 'admittance' or 'block', and which of its (m, k, k) entries are not grounded
+        self._kinds, self._keep = [], []
+        self._rows, self._cols = [], []
+        self.compiled = False
+
+    def __getstate__(self):
+        # Shards only need the assembled pattern
+        return {'size': self.size, 'rows': self.rows, 'cols': self.cols}
+
+    def _stamp(self, kind, nodes):
+        nodes = np.asarray(nodes, dtype=int)
+        rows = np.broadcast_to(nodes[:, :, None], nodes.shape + nodes.shape[1:])
+        cols = np.broadcast_to(nodes[:, None, :], rows.shape)
+        keep = (rows >= 0) & (cols >= 0)
+        self._kinds.append(kind)
+        self._keep.append(keep)
+        self._rows.append(rows[keep])
+        self._cols.append(cols[keep])
+        return len(self._kinds) - 1
+
+    def add_admittances(self, a, b):
+        """Group of two-terminal admittances between nodes a[i] and b[i]; returns the group id."""
+        return self._stamp('admittance', np.stack([np.asarray(a, dtype=int), np.asarray(b, dtype=int)], axis=1))
+
+    def add_blocks(self, nodes):
+        """Group of k-port blocks whose ports are referenced to ground at nodes (m, k); returns the group id."""
+        return self._stamp('block', nodes)
+
+    def add_port(self, plus, minus=-1):
+        """External port from node minus to node plus."""
+        self.port_plus.append(plus)
+        self.port_minus.append(minus)
+
+    def compile(self):
+        """Fix the sparsity pattern: unique matrix positions and the scatter matrix summing into them."""
+        self._stamp('admittance', np.stack([np.asarray(self.port_plus, dtype=int),
+                                            np.asarray(self.port_minus, dtype=int)], axis=1))
+        rows = np.concatenate(self._rows)
+        cols = np.concatenate(self._cols)
+        flat, inverse = np.unique(rows * self.size + cols, return_inverse=True)
+        # Duplicate entries of one position are summed by a 0/1 scatter matrix
+        self._scatter = sparse.csr_matrix((np.ones(len(inverse)), (np.arange(len(inverse)), inverse)),
+                                          shape=(len(inverse), len(flat)))
+        self.rows, self.cols = np.divmod(flat, self.size)
+        # Port incidence A
+        self._A = np.zeros((self.size, len(self.port_plus)))
+        for i, (p, n) in enumerate(zip(self.port_plus, self.port_minus)):
+            if p >= 0:
+                self._A[p, i] += 1.0
+            if n >= 0:
+                self._A[n, i] -= 1.0
+        self.compiled = True
+        return self
+
+    def _entries(self, group, y):
+        """The non-grounded stamp entries (F, count) of one group's admittances."""
+        y = np.asarray(y, dtype=complex)
+        if not np.all(np.isfinite(y)):
+            raise np.linalg.LinAlgError(f"infinite admittance in element group {group}")
+        if self._kinds[group] == 'admittance':
+            y = y[..., None, None] * np.array([[1, -1], [-1, 1]])
+        return y[:, self._keep[group]]
+
+    def port_block(self, values, B):
+        """Bᵀ·Y⁻¹·B for a block of frequencies, values holding the nodal matrix entries of each."""
+        K = np.empty((len(values), B.shape[1], B.shape[1]), dtype=complex)
+        if self.size <= DENSE_NODE_LIMIT:
+            batch = max(1, BATCH_BYTES // (16 * self.size * self.size))
+            for start in range(0, len(values), batch):
+                block = values[start:start + batch]
+                Y = np.zeros((len(block), self.size, self.size), dtype=complex)
+                Y[:, self.rows, self.cols] = block
+                try:
+                    X = np.linalg.solve(Y, np.broadcast_to(B, (len(block),) + B.shape))
+                except np.linalg.LinAlgError as e:
+                    raise np.linalg.LinAlgError(f"singular nodal matrix (floating sub-network?): {e}")
+                K[start:start + batch] = B.T @ X
+        else:
+            for i, row in enumerate(values):
+                Y = sparse.csc_matrix((row, (self.rows, self.cols)), shape=(self.size, self.size))
+                try:
+                    K[i] = B.T @ factorize(Y).solve(B.astype(complex))
+                except RuntimeError as e:
+                    raise np.linalg.LinAlgError(f"singular nodal matrix (floating sub-network?): {e}")
+        return K
+
+    @stage('solve')
+    def solve(self, admittances, z0):
+        """
+        Scattering matrices (F, P, P) at the external ports, in the order they
+        were added. admittances holds one array per group, in the order the
+        groups were added: (F, m) for add_admittances groups and (F, m, k, k)
+        for add_blocks groups. z0 holds the real reference impedance of every port.
+        """
+        z0 = np.asarray(z0, dtype=float)
+        if np.any(z0 <= 0):
+            raise ValueError(f"Port reference impedances must be positive, got {z0.tolist()}")
+        frequency_count = len(admittances[0]) if admittances else 1
+        ports = len(z0)
+        eye = np.eye(ports)
+        if self.size == 0:
+            return np.broadcast_to(-eye, (frequency_count, ports, ports)).copy()
+        port_admittance = np.broadcast_to(1 / z0, (frequency_count, ports))
+        data = np.concatenate([self._entries(group, y)
+                               for group, y in enumerate(list(admittances) + [port_admittance])], axis=1)
+        values = np.asarray(data @ self._scatter, dtype=complex)
+        B = self._A / np.sqrt(z0)
+        logger.info(f"Nodal connection: {self.size} nodes, {len(self.rows)} non-zeros, {ports} ports, "
+                    f"{frequency_count} frequencies")
+        K = parallel_executor.map(_solve_shard, frequency_count, {'values': values, 'B': B},
+                                  {'K': ((frequency_count, ports, ports), complex)}, (self,),
+                                  cost=len(self.rows) + self.size * ports)['K']
+        S = 2 * K - eye
+        if not np.all(np.isfinite(S)):
+            raise np.linalg.LinAlgError("nodal solve produced non-finite values")
+        return S
@@ -0,0 +1,218 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _allocate(arrays, specs, blocks):
+    """Create shared blocks for specs (name -> (shape, dtype)), copying data from arrays when given."""
+    handles = {}
+    views = {}
+    for name, (shape, dtype) in specs.items():
+        dtype = np.dtype(dtype)
+        nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        blocks.append(block)
+        views[name] = np.ndarray(shape, dtype, buffer=block.buf)
+        if arrays is not None:
+            views[name][...] = arrays[name]
+        handles[name] = (block.name, shape, dtype.str)
+    return handles, views
+
+
+def _run_shard(func, start, stop, input_handles, output_handles, args):
+    """Worker side of a shard: attach the shared blocks and let func fill its slice of the outputs."""
+    blocks = []
+    try:
+        arrays = {}
+        for group, handles in (('inputs', input_handles), ('outputs', output_handles)):
+            arrays[group] = {}
+            for name, (block_name, shape, dtype) in handles.items():
+                block = shared_memory.SharedMemory(name=block_name)
+                blocks.append(block)
+                arrays[group][name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        func(start, stop, arrays['inputs'], arrays['outputs'], *args)
+    finally:
+        arrays = None
+        for block in blocks:
+            block.close()
+
+
+# Imported once by the fork server rather than by every process it starts: the
+# numeric libraries of pool workers, plus the web stack job processes import with app
+FORKSERVER_PRELOAD = ('numpy', 'scipy.sparse', 'scipy.sparse.linalg', 'flask', 'pymongo', 'pydantic')
+
+
+def default_start_method():
+    """
+    forkserver where the platform has it, else spawn. Pools and job processes
+    are started from request threads, and a fork of a multithreaded process
+    can inherit a lock another thread holds (logging, caches) and deadlock.
+    """
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def process_context(start_method=None):
+    """multiprocessing context for start_method, default_start_method() when None."""
+    context = multiprocessing.get_context(start_method or default_start_method())
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload(list(FORKSERVER_PRELOAD))
+    return context
+
+
+def web_concurrency():
+    """Number of gunicorn web workers (WEB_CONCURRENCY), each of which holds its own executor."""
+    return max(1, int(os.getenv('WEB_CONCURRENCY', 2)))
+
+
+def default_workers():
+    """This process's share of the CPUs: cpu_count split across the web workers, at least 1."""
+    return max(1, (os.cpu_count() or 1) // web_concurrency())
+
+
+class ParallelExecutor:
+    """
+    Shards the leading axis of an array computation over a pool of workers.
+
+    func(start, stop, inputs, outputs, *args) computes items start..stop:
+    it reads from the input arrays and writes its rows of the output arrays
+    in place. With a process pool, inputs are copied once into shared memory
+    and outputs are allocated there, so only shard bounds and the (small)
+    args are pickled - results are never sent back through pipes. Daemonic
+    processes such as job workers cannot start children; there the shards
+    run on a thread pool instead (NumPy and SuperLU release the GIL).
+    Work runs inline when it is smaller than two chunks of min_chunk items,
+    or when its estimated cost (items times the cost of one, e.g. the
+    non-zeros of the system each item solves) is below min_work - starting
+    the shards costs more than solving small systems. Every web
+    worker has its own executor, so by default each gets its share of the
+    CPUs (see default_workers) rather than all of them. Worker processes are
+    not forked from the (multithreaded) web worker; see default_start_method.
+    """
+
+    def __init__(self, workers=None, min_chunk=64, min_work=100000, start_method=None):
+        self.workers = max(1, workers or default_workers())
+        self.min_chunk = max(1, min_chunk)
+        self.min_work = min_work
+        self.start_method = start_method
+        self._processes = None
+        self._threads = None
+        self._lock = threading.Lock()
+        self.counters = {'inline': 0, 'process': 0, 'thread': 0, 'shards': 0, 'pool_restarts': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv('PARALLEL_WORKERS', 0)) or None,
+            min_chunk=int(os.getenv('PARALLEL_MIN_CHUNK', 64)),
+            min_work=float(os.getenv('PARALLEL_MIN_WORK', 100000)),
+            start_method=os.getenv('PARALLEL_START_METHOD') or None
+        )
+
+    def shards(self, count, cost=1):
+        """
+        (start, stop) bounds splitting range(count) into at most workers shards
+        of at least min_chunk items; one shard when count items of cost each
+        come to less than min_work.
+        """
+        parts = min(self.workers, count // self.min_chunk)
+        if parts <= 1 or count * cost < self.min_work:
+            return [(0, count)]
+        edges = np.linspace(0, count, parts + 1).astype(int)
+        return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+    def _pool(self, kind):
+        with self._lock:
+            if kind == 'thread':
+                if self._threads is None:
+                    self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix='parallel')
+                return self._threads
+            if self._processes is None:
+                context = process_context(self.start_method)
+                self._processes = ProcessPoolExecutor(self.workers, mp_context=context)
+                logger.info(f"Started a pool of {self.workers} worker processes ({context.get_start_method()})")
+            return self._processes
+
+    def _reset_processes(self):
+        with self._lock:
+            if self._processes is not None:
+                self._processes.shutdown(wait=False, cancel_futures=True)
+                self._processes = None
+                self.counters['pool_restarts'] += 1
+
+    def map(self, func, count, inputs, outputs, args=(), cost=1):
+        """
+        Run func over shards of range(count) and return the output arrays.
+        inputs maps names to arrays; outputs maps names to (shape, dtype) of
+        the arrays to allocate. cost estimates the work of one item relative
+        to min_work. func must be a module-level function and args picklable
+        for the process pool.
+        """
+        bounds = self.shards(count, cost)
+        if len(bounds) == 1:
+            self.counters['inline'] += 1
+            results = {name: np.empty(shape, dtype) for name, (shape, dtype) in outputs.items()}
+            func(0, count, inputs, results, *args)
+            return results
+
+        self.counters['shards'] += len(bounds)
+        if multiprocessing.current_process().daemon:
+            self.counters['thread'] += 1
+            results = {name: np.empty(shape, dtype) for name, (shape, dtype) in outputs.items()}
+            pool = self._pool('thread')
+            futures = [pool.submit(func, start, stop, inputs, results, *args) for start, stop in bounds]
+            for future in futures:
+                future.result()
+            return results
+
+        self.counters['process'] += 1
+        blocks = []
+        views = None
+        try:
+            input_specs = {name: (np.shape(array), np.asarray(array).dtype) for name, array in inputs.items()}
+            # The input views are only needed for the copy and are released right away
+            input_handles = _allocate(inputs, input_specs, blocks)[0]
+            output_handles, views = _allocate(None, outputs, blocks)
+            pool = self._pool('process')
+            try:
+                futures = [pool.submit(_run_shard, func, start, stop, input_handles, output_handles, args)
+                           for start, stop in bounds]
+                for future in futures:
+                    future.result()
+            except BrokenProcessPool:
+                # A worker died (killed or out of memory); the next call starts a fresh pool
+                self._reset_processes()
+                raise RuntimeError("A parallel worker process died")
+            return {name: view.copy() for name, view in views.items()}
+        finally:
+            # Views must be released before their blocks can be closed
+            views = None
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def shutdown(self):
+        with self._lock:
+            for pool in (self._processes, self._threads):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            self._processes = self._threads = None
+
+    def stats(self):
+        return {**self.counters, 'workers': self.workers, 'min_chunk': self.min_chunk, 'min_work': self.min_work}
+
+
+parallel_executor = ParallelExecutor.from_env()
+atexit.register(parallel_executor.shutdown)
@@ -0,0 +1,422 @@
+import logging
+import os
+import time
+import numpy as np
+from factorization import factorize
+from mna import MNACircuit, DENSE_AC_LIMIT, AC_BATCH_BYTES
+from dc_analysis import rename_element
+from parallel import parallel_executor
+from metrics import timed, stage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODES = ('montecarlo', 'sweep')
+ANALYSES = ('dc', 'ac')
+DISTRIBUTIONS = ('normal', 'uniform')
+# Upper bound on the number of samples (or grid points) of one run
+MAX_SAMPLES = int(os.getenv('SWEEP_MAX_SAMPLES', 100000))
+DEFAULT_PERCENTILES = (1, 5, 50, 95, 99)
+DEFAULT_BINS = 20
+# A gaussian tolerance is read as this many standard deviations
+TOLERANCE_SIGMA = 3.0
+
+
+def _number(spec, key, default=None):
+    value = spec.get(key, default)
+    if value is None:
+        raise ValueError(f"Missing '{key}'")
+    return float(value)
+
+
+def draw_samples(spec, nominal, count, rng):
+    """
+    count random values of a parameter. spec is a tolerance (fraction of the
+    nominal value) or a dict: {'distribution': 'normal', 'tolerance' | 'std',
+    'mean'} or {'distribution': 'uniform', 'tolerance' | 'min' and 'max'}.
+    Gaussian tolerances are TOLERANCE_SIGMA standard deviations wide.
+    """
+    if not isinstance(spec, dict):
+        spec = {'tolerance': spec}
+    distribution = str(spec.get('distribution', 'normal')).lower()
+    if distribution == 'normal':
+        mean = _number(spec, 'mean', nominal)
+        if 'std' in spec:
+            std = _number(spec, 'std')
+        else:
+            std = abs(mean) * _number(spec, 'tolerance') / TOLERANCE_SIGMA
+        if std < 0:
+            raise ValueError("Standard deviation must not be negative")
+        return rng.normal(mean, std, count)
+    if distribution == 'uniform':
+        if 'min' in spec or 'max' in spec:
+            low, high = _number(spec, 'min'), _number(spec, 'max')
+        else:
+            tolerance = abs(_number(spec, 'tolerance'))
+            low, high = nominal - abs(nominal) * tolerance, nominal + abs(nominal) * tolerance
+        if high < low:
+            raise ValueError("Uniform range needs min <= max")
+        return rng.uniform(low, high, count)
+    raise ValueError(f"Unknown distribution '{distribution}' (use one of {', '.join(DISTRIBUTIONS)})")
+
+
+def sweep_values(spec):
+    """Values of a swept parameter: {'values': [...]} or {'start', 'stop', 'points', 'scale': 'lin' | 'log'}."""
+    if isinstance(spec, (list, tuple)):
+        spec = {'values': spec}
+    if not isinstance(spec, dict):
+        raise ValueError("A swept parameter needs a list of values or a start/stop/points range")
+    if 'values' in spec:
+        values = np.asarray(spec['values'], dtype=float).ravel()
+    else:
+        start, stop = _number(spec, 'start'), _number(spec, 'stop')
+        points = int(spec.get('points', 10))
+        scale = str(spec.get('scale', 'lin')).lower()
+        if points < 1:
+            raise ValueError("A sweep needs at least one point")
+        if scale == 'log':
+            if start <= 0 or stop <= 0:
+                raise ValueError("A log sweep needs positive start and stop values")
+            values = np.logspace(np.log10(start), np.log10(stop), points)
+        elif scale == 'lin':
+            values = np.linspace(start, stop, points)
+        else:
+            raise ValueError(f"Unknown sweep scale '{scale}' (use lin or log)")
+    if not len(values):
+        raise ValueError("A swept parameter needs at least one value")
+    return values
+
+
+@stage('statistics')
+def summarize(samples, percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS):
+    """
+    Statistics over the first axis of samples (count, outputs): mean, std,
+    min, max, the given percentiles and a histogram with bins equal bins
+    between min and max. Every entry is an array with one value (or one row)
+    per output.
+    """
+    samples = np.asarray(samples, dtype=float)
+    count, outputs = samples.shape
+    low = samples.min(axis=0)
+    high = samples.max(axis=0)
+    # Degenerate (constant) outputs put every sample in the first bin
+    width = np.where(high > low, high - low, 1.0)
+    index = np.clip(((samples - low) / width * bins).astype(np.int64), 0, bins - 1)
+    counts = np.bincount((index + bins * np.arange(outputs)).ravel(), minlength=outputs * bins)
+    return {
+        'mean': samples.mean(axis=0),
+        'std': samples.std(axis=0, ddof=1) if count > 1 else np.zeros(outputs),
+        'min': low,
+        'max': high,
+        'percentiles': dict(zip((f'{q:g}' for q in percentiles),
+                                np.percentile(samples, percentiles, axis=0))),
+        'histogram': {
+            'counts': counts.reshape(outputs, bins),
+            'edges': low[:, None] + width[:, None] * np.linspace(0, 1, bins + 1)
+        }
+    }
+
+
+def _column(stats, index):
+    """Statistics of output index out of a summarize() result, as plain Python values."""
+    return {
+        'mean': float(stats['mean'][index]),
+        'std': float(stats['std'][index]),
+        'min': float(stats['min'][index]),
+        'max': float(stats['max'][index]),
+        'percentiles': {q: float(values[index]) for q, values in stats['percentiles'].items()},
+        'histogram': {'counts': stats['histogram']['counts'][index].tolist(),
+                      'edges': stats['histogram']['edges'][index].tolist()}
+    }
+
+
+def _by_frequency(columns):
+    """Merge per-frequency statistics of one output into lists over frequency."""
+    merged = {key: [column[key] for column in columns] for key in ('mean', 'std', 'min', 'max')}
+    merged['percentiles'] = {q: [column['percentiles'][q] for column in columns]
+                             for q in columns[0]['percentiles']}
+    merged['histogram'] = {key: [column['histogram'][key] for column in columns] for key in ('counts', 'edges')}
+    return merged
+
+
+def _solve_shard(start, stop, inputs, outputs, model, omega):
+    outputs['X'][start:stop] = model.solve_coefficients(inputs['coefficients'][start:stop], omega)
+
+
+class ParametricCircuit:
+    """
+    MNA model of a linear netlist with selected element values as parameters.
+
+    The circuit is parsed and stamped once. Since every stamp is linear in
+    the element's coefficient (conductance for resistors, the value for other
+    elements, the AC magnitude for sources in AC analysis) the system is split
+    into a fixed part and one unit stamp per parameter:
+
+        G(p) = G0 + Σ c_i(p)·G_i,   C(p) = C0 + Σ c_i(p)·C_i,   b(p) = b0 + Σ c_i(p)·b_i
+
+    so a batch of samples only needs a weighted sum of precomputed matrices
+    before it is solved. Small systems are solved as stacked dense batches in
+    one LAPACK call; large ones get one sparse LU per sample.
+    """
+
+    @stage('circuit')
+    def __init__(self, netlist_string, names, analysis='dc'):
+        if analysis not in ANALYSES:
+            raise ValueError(f"Unknown analysis '{analysis}' (use one of {', '.join(ANALYSES)})")
+        self.circuit = MNACircuit(netlist_string)
+        self.analysis = analysis
+        self.names = list(names)
+        by_name = {element['name']: element for element in self.circuit.elements}
+        unknown = [name for name in self.names if name not in by_name]
+        if unknown:
+            raise ValueError(f"Unknown elements: {', '.join(unknown)}")
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Each element can only be varied once")
+        self.elements = [by_name[name] for name in self.names]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.nominal = np.array([self._nominal(element) for element in self.elements], dtype=float)
+
+        circuit = self.circuit
+        G, C = circuit.G, circuit.C
+        b = circuit.b if analysis == 'dc' else circuit.b_ac
+        self.G_stamps, self.C_stamps, self.b_stamps = [], [], []
+        for element, coefficient in zip(self.elements, self.coefficients(self.nominal[None, :])[0]):
+            G_i, C_i, b_dc, b_ac = circuit.element_stamp(element['name'])
+            # Source parameters move the DC value in DC analysis and the AC phasor in AC analysis
+            b_i = b_dc if analysis == 'dc' else b_ac
+            G = G - coefficient * G_i
+            C = C - coefficient * C_i
+            b = b - coefficient * b_i
+            self.G_stamps.append(G_i)
+            self.C_stamps.append(C_i)
+            self.b_stamps.append(b_i)
+        self.G0, self.C0, self.b0 = G.tocsc(), C.tocsc(), b
+        self.dense = circuit.size <= DENSE_AC_LIMIT
+
+    def _is_ac_source(self, element):
+        return self.analysis == 'ac' and element['type'] in ('V', 'I')
+
+    def _nominal(self, element):
+        if self._is_ac_source(element):
+            return abs(element['ac'])
+        return element['value']
+
+    def coefficients(self, values):
+        """Stamp coefficients (samples, parameters) of parameter values (samples, parameters)."""
+        values = np.asarray(values, dtype=float)
+        columns = [values[:, i] if self._is_ac_source(element) else
+                   np.asarray(MNACircuit.coefficient(element, values[:, i]), dtype=float)
+                   for i, element in enumerate(self.elements)]
+        coefficients = np.stack(columns, axis=1) if columns else np.zeros((len(values), 0))
+        if not np.all(np.isfinite(coefficients)):
+            raise ValueError("Parameter samples include zero resistances or non-finite values")
+        return coefficients
+
+    @stage('solve')
+    def solve(self, values, omega=0.0):
+        """
+        Solution vectors (samples, size) for parameter values (samples,
+        parameters): the DC operating point, or the AC response at angular
+        frequency omega. Samples are sharded over the parallel executor.
+        """
+        coefficients = self.coefficients(values)
+        dtype = float if self.analysis == 'dc' else complex
+        shape = (len(coefficients), self.circuit.size)
+        cost = self.G0.nnz + self.C0.nnz + self.circuit.size * (1 + len(self.names))
+        return parallel_executor.map(_solve_shard, len(coefficients), {'coefficients': coefficients},
+                                     {'X': (shape, dtype)}, (self, omega), cost=cost)['X']
+
+    def solve_coefficients(self, coefficients, omega=0.0):
+        """Solution vectors for rows of stamp coefficients (see coefficients())."""
+        size = self.circuit.size
+        dtype = float if self.analysis == 'dc' else complex
+        X = np.empty((len(coefficients), size), dtype=dtype)
+        if size == 0 or not len(coefficients):
+            return X
+        Y0 = self.G0 + 1j * omega * self.C0 if self.analysis == 'ac' else self.G0
+        stamps = [G_i + 1j * omega * C_i if self.analysis == 'ac' else G_i
+                  for G_i, C_i in zip(self.G_stamps, self.C_stamps)]
+        B = np.array(self.b_stamps, dtype=dtype).reshape(len(stamps), size)
+        rhs = self.b0 + coefficients @ B
+
+        if self.dense:
+            Y0 = Y0.toarray()
+            stacked = np.array([stamp.toarray() for stamp in stamps], dtype=dtype).reshape(len(stamps), size, size)
+            batch = max(1, AC_BATCH_BYTES // (np.dtype(dtype).itemsize * size * size))
+            for start in range(0, len(coefficients), batch):
+                weights = coefficients[start:start + batch]
+                A = Y0[None, :, :] + np.tensordot(weights, stacked, axes=1)
+                try:
+                    X[start:start + batch] = np.linalg.solve(A, rhs[start:start + batch, :, None])[..., 0]
+                except np.linalg.LinAlgError as e:
+                    raise ValueError(f"Singular MNA matrix for some samples (floating node or source loop?): {e}")
+        else:
+            for k, weights in enumerate(coefficients):
+                A = Y0
+                for weight, stamp in zip(weights, stamps):
+                    A = A + weight * stamp
+                try:
+                    X[k] = factorize(A).solve(rhs[k])
+                except RuntimeError as e:
+                    raise ValueError(f"Singular MNA matrix for some samples (floating node or source loop?): {e}")
+        if not np.all(np.isfinite(X)):
+            raise ValueError("MNA solve produced non-finite values")
+        return X
+
+    def output_names(self):
+        """Names of every output quantity, as in the DC analysis results."""
+        names = [f'V_node_{node}' for node in self.circuit.node_index]
+        for element in self.circuit.elements:
+            names += [f"V_{element['name']}", f"I_{element['name']}"]
+        return names
+
+    @stage('postprocess')
+    def outputs(self, X, values, names, omega=0.0):
+        """Array (samples, len(names)) of the named output quantities of solutions X."""
+        circuit = self.circuit
+        by_name = {element['name']: element for element in circuit.elements}
+        columns = []
+        for name in names:
+            if name.startswith('V_node_'):
+                columns.append(circuit.node_voltage(X, circuit.node_index[name[len('V_node_'):]]))
+                continue
+            element = by_name[name[2:]]
+            if name.startswith('V_'):
+                columns.append(circuit.element_voltage(X, element))
+                continue
+            value = values[:, self.index[element['name']]] if element['name'] in self.index else None
+            columns.append(self._current(X, element, value, omega))
+        return np.stack([np.broadcast_to(column, (len(X),)) for column in columns], axis=1)
+
+    def _current(self, X, element, value, omega):
+        """Element current (lcapy sign convention) with per-sample values for varied elements."""
+        kind = element['type']
+        if self.analysis == 'ac':
+            if kind == 'C':
+                capacitance = element['value'] if value is None else value
+                return 1j * omega * capacitance * self.circuit.element_voltage(X, element)
+            if kind == 'I':
+                ac = element['ac'] if value is None else value * np.exp(1j * np.angle(element['ac']))
+                return -ac
+            if kind == 'V':
+                return self.circuit.element_current(X, element)
+        if value is not None:
+            element = {**element, 'value': value}
+        return self.circuit.element_current(X, element)
+
+
+@timed('sweep')
+def run_parameter_sweep(netlist_string, parameters, mode='montecarlo', analysis='dc', samples=1000, seed=None,
+                        frequencies=None, outputs=None, percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS,
+                        return_samples=None, aliases=None, progress=None):
+    """
+    Monte Carlo or grid sweep of element values on a preprocessed (lcapy
+    syntax) linear netlist.
+
+    parameters maps element names to distributions (mode='montecarlo', see
+    draw_samples) or value lists/ranges (mode='sweep', see sweep_values; the
+    grid is the cartesian product). analysis='dc' solves operating points,
+    'ac' the small-signal response at every frequency in frequencies (Hz).
+    Every output quantity (V_node_*, V_* and I_*, optionally restricted to
+    outputs) is summarized by summarize(); AC outputs are summarized as
+    magnitude and phase per frequency. Raw samples are only returned with
+    return_samples, which defaults to True for sweeps. aliases renames
+    elements in the output names (e.g. the 0 V branches standing in for wires).
+    progress(message, fraction) is called as the frequencies are worked through.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}' (use one of {', '.join(MODES)})")
+    if not parameters:
+        raise ValueError("No parameters to vary")
+    percentiles = [float(q) for q in percentiles]
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    bins = int(bins)
+    if bins < 1:
+        raise ValueError("Histograms need at least one bin")
+    if return_samples is None:
+        return_samples = mode == 'sweep'
+    # Samples are drawn (and grids laid out) in name order, so a seed always gives the same result
+    parameters = dict(sorted(parameters.items()))
+
+    started = time.perf_counter()
+    model = ParametricCircuit(netlist_string, list(parameters), analysis)
+    internal = {rename_element(name, aliases or {}): name for name in model.output_names()}
+    names = list(internal)
+    if outputs:
+        unknown = [name for name in outputs if name not in internal]
+        if unknown:
+            raise ValueError(f"Unknown outputs: {', '.join(unknown)}")
+        names = list(outputs)
+    solved = [internal[name] for name in names]
+
+    if mode == 'sweep':
+        axes = [sweep_values(spec) for spec in parameters.values()]
+        count = int(np.prod([len(axis) for axis in axes]))
+        if count > MAX_SAMPLES:
+            raise ValueError(f"Sweep grid has {count} points (limit {MAX_SAMPLES})")
+        values = np.stack([grid.ravel() for grid in np.meshgrid(*axes, indexing='ij')], axis=1)
+    else:
+        count = int(samples)
+        if not 1 <= count <= MAX_SAMPLES:
+            raise ValueError(f"Number of samples must be between 1 and {MAX_SAMPLES}")
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % 2 ** 32)
+        rng = np.random.default_rng(seed)
+        values = np.stack([draw_samples(spec, nominal, count, rng)
+                           for spec, nominal in zip(parameters.values(), model.nominal)], axis=1)
+    built = time.perf_counter()
+    logger.info(f"Parameter {mode}: {count} samples of {', '.join(model.names)} on a system of size "
+                f"{model.circuit.size} ({'dense batches' if model.dense else 'sparse LU per sample'})")
+
+    result = {
+        'mode': mode,
+        'analysis': analysis,
+        'samples': count,
+        'parameters': {name: {'nominal': float(model.nominal[i]), 'mean': float(values[:, i].mean()),
+                              'min': float(values[:, i].min()), 'max': float(values[:, i].max())}
+                       for i, name in enumerate(model.names)}
+    }
+    if mode == 'montecarlo':
+        result['seed'] = seed
+
+    if analysis == 'dc':
+        X = model.solve(values)
+        quantities = model.outputs(X, values, solved)
+        stats = summarize(quantities, percentiles, bins)
+        result['statistics'] = {name: _column(stats, i) for i, name in enumerate(names)}
+        if return_samples:
+            result['values'] = {name: quantities[:, i].tolist() for i, name in enumerate(names)}
+    else:
+        frequencies = np.atleast_1d(np.asarray(frequencies if frequencies is not None else [], dtype=float))
+        if not len(frequencies):
+            raise ValueError("AC analysis needs at least one frequency")
+        columns = {name: {'magnitude': [], 'phase_deg': []} for name in names}
+        raw = {name: {'magnitude': [], 'phase_deg': []} for name in names}
+        for f_index, frequency in enumerate(frequencies):
+            omega = 2 * np.pi * frequency
+            quantities = model.outputs(model.solve(values, omega), values, solved, omega)
+            for part, data in (('magnitude', np.abs(quantities)), ('phase_deg', np.degrees(np.angle(quantities)))):
+                stats = summarize(data, percentiles, bins)
+                for i, name in enumerate(names):
+                    columns[name][part].append(_column(stats, i))
+                    if return_samples:
+                        raw[name][part].append(data[:, i])
+            if progress is not None:
+                progress(f"Solved {f_index + 1} of {len(frequencies)} frequencies", (f_index + 1) / len(frequencies))
+        result['frequencies'] = frequencies.tolist()
+        result['statistics'] = {name: {part: _by_frequency(parts[part]) for part in parts}
+                                for name, parts in columns.items()}
+        if return_samples:
+            # (samples, frequencies) per output
+            result['values'] = {name: {part: np.stack(parts[part], axis=1).tolist() for part in parts}
+                                for name, parts in raw.items()}
+    if return_samples:
+        result['points'] = {name: values[:, i].tolist() for i, name in enumerate(model.names)}
+    result['timing'] = {'build': built - started, 'solve': time.perf_counter() - built}
+    logger.info(f"Parameter {mode} finished in {result['timing']['solve']:.3f} s")
+    return result
@@ -0,0 +1,216 @@
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from metrics import stage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PLOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'plots')
+MIN_DPI = 50
+MAX_DPI = 600
+
+# analysis type -> (plot name, legacy file name, description) in display order
+PLOTS = {
+    'ac': [
+        ('voltage_phasor', 'ac_analysis_voltage_phasor.png', "Voltage Phasor Diagram"),
+        ('current_phasor', 'ac_analysis_current_phasor.png', "Current Phasor Diagram"),
+        ('voltage_time_domain', 'ac_analysis_voltage_time_domain.png', "Voltage Time Domain"),
+        ('current_time_domain', 'ac_analysis_current_time_domain.png', "Current Time Domain"),
+        ('combined_time_domain', 'ac_analysis_combined_time_domain.png', "Combined Time Domain"),
+    ],
+    'transient': [
+        ('voltage', 'transient_analysis-voltage.png', "Transient Voltage"),
+        ('current', 'transient_analysis-current.png', "Transient Current"),
+    ],
+    's': [
+        ('combined', 's_parameters_combined.png', "S-Parameters (Combined Plot)"),
+    ],
+}
+
+
+def _renderer(analysis_type):
+    # Imported on first render so the analysis modules do not depend on this one
+    if analysis_type == 'ac':
+        from ac_analysis import render_ac_plot
+        return render_ac_plot
+    if analysis_type == 'transient':
+        from transient_analysis import render_transient_plot
+        return render_transient_plot
+    from S_parameter import render_s_plot
+    return render_s_plot
+
+
+def result_key(analysis_type, plot_data):
+    """Hash identifying the plot data of one analysis result."""
+    payload = pickle.dumps((analysis_type, plot_data), protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.sha256(payload).hexdigest()[:24]
+
+
+class PlotCache:
+    """
+    Plot data of recent analysis results, rendered to PNG only when a plot is
+    requested. Data is keyed by result hash and pickled to plot_dir next to
+    its renders, so every web worker (and job process) can serve a key that
+    another one stored; the most recent max_results are also kept in memory.
+    Every (result, plot, dpi) is rendered once and reused. Files untouched
+    for retention seconds are removed as new results come in. Rendering is
+    serialized because pyplot is not thread-safe.
+    """
+
+    def __init__(self, max_results=64, default_dpi=150, plot_dir=PLOT_DIR, retention=86400):
+        self.max_results = max_results
+        self.default_dpi = default_dpi
+        self.plot_dir = plot_dir
+        self.retention = retention
+        self._results = OrderedDict()  # key -> (analysis type, plot data)
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self.counters = {'renders': 0, 'render_hits': 0, 'evictions': 0, 'disk_hits': 0}
+        self._last_prune = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_results=int(os.getenv('PLOT_CACHE_MAX_RESULTS', 64)),
+            default_dpi=int(os.getenv('PLOT_DPI', 150)),
+            retention=float(os.getenv('PLOT_RETENTION', 86400))
+        )
+
+    def _data_path(self, key):
+        return os.path.join(self.plot_dir, f'{key}.plot')
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._results[key] = entry
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def put(self, analysis_type, plot_data):
+        """Store the plot data of a result and return its key."""
+        if analysis_type not in PLOTS:
+            raise ValueError(f"No plots defined for analysis type: {analysis_type}")
+        key = result_key(analysis_type, plot_data)
+        self._remember(key, (analysis_type, plot_data))
+        path = self._data_path(key)
+        try:
+            if os.path.exists(path):
+                # Restart its retention
+                os.utime(path)
+            else:
+                os.makedirs(self.plot_dir, exist_ok=True)
+                tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump((analysis_type, plot_data), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError) as e:
+            logger.error(f"Could not store plot data {key}: {e}")
+        self.prune()
+        return key
+
+    def get(self, key):
+        """(analysis type, plot data) stored under key, or None."""
+        if not key or not all(c in '0123456789abcdef' for c in key):
+            return None
+        with self._lock:
+            entry = self._results.get(key)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._data_path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # Stored by another process
+        self.counters['disk_hits'] += 1
+        self._remember(key, entry)
+        return entry
+
+    def prune(self, interval=60.0):
+        """Remove plot data and renders untouched for retention seconds; at most once per interval."""
+        now = time.time()
+        if now - self._last_prune < interval:
+            return
+        self._last_prune = now
+        cutoff = now - self.retention
+        for path in glob.glob(os.path.join(self.plot_dir, '*')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def resolve_dpi(self, dpi):
+        if dpi in (None, ''):
+            return self.default_dpi
+        dpi = int(dpi)
+        if not MIN_DPI <= dpi <= MAX_DPI:
+            raise ValueError(f"dpi must be between {MIN_DPI} and {MAX_DPI}")
+        return dpi
+
+    def render(self, key, name, dpi=None):
+        """
+        Path of the PNG for plot name of the result under key, rendering it on
+        first use. Returns None when the result has nothing to show in that
+        plot; raises KeyError for an unknown key or plot name.
+        """
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(f"Unknown or expired result: {key}")
+        analysis_type, plot_data = entry
+        if name not in {plot[0] for plot in PLOTS[analysis_type]}:
+            raise KeyError(f"Unknown {analysis_type} plot: {name}")
+        dpi = self.resolve_dpi(dpi)
+        path = os.path.join(self.plot_dir, f'{key}-{name}-{dpi}.png')
+        empty_marker = path + '.empty'
+
+        with self._render_lock:
+            if os.path.exists(path):
+                self.counters['render_hits'] += 1
+                return path
+            if os.path.exists(empty_marker):
+                return None
+            os.makedirs(self.plot_dir, exist_ok=True)
+            # Render under a temporary name so a partial file is never served
+            tmp_path = f'{path}.{os.getpid()}.tmp.png'
+            try:
+                with stage('plot'):
+                    created = _renderer(analysis_type)(name, plot_data, tmp_path, dpi)
+                self.counters['renders'] += 1
+                if not created or not os.path.exists(tmp_path):
+                    open(empty_marker, 'w').close()
+                    return None
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        logger.info(f"Rendered {analysis_type} plot {name} at {dpi} dpi")
+        return path
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+        for path in glob.glob(os.path.join(self.plot_dir, '*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'results': len(self._results), 'max_results': self.max_results,
+                    'default_dpi': self.default_dpi, 'retention': self.retention}
+
+
+plot_cache = PlotCache.from_env()
@@ -0,0 +1,222 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+# 'cprofile' traces every call; 'sample' records the stack of the request thread at intervals
+PROFILE_MODES = ('cprofile', 'sample')
+# Files kept per profile, by kind
+PROFILE_FILES = {'pstats': '.pstats', 'collapsed': '.collapsed', 'text': '.txt'}
+PROFILE_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+TOP_FUNCTIONS = 30
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the thread that enabled it every interval seconds
+    from a background thread and counts identical stacks, giving
+    'outer;...;inner count' lines (the collapsed format of flamegraph.pl and
+    speedscope). Work done in other processes (parallel pool, job workers)
+    is not seen.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def enable(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top_functions(self, count=TOP_FUNCTIONS):
+        """Functions by samples on top of the stack (self) and anywhere in it (total)."""
+        own, total = Counter(), Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += samples
+            for frame in set(frames):
+                total[frame] += samples
+        return [{'function': name, 'self_samples': own[name], 'total_samples': samples,
+                 'total_time': samples * self.interval}
+                for name, samples in total.most_common(count)]
+
+
+class ProfileStore:
+    """
+    Opt-in profiles of individual requests, saved as files under a directory
+    so every worker process can serve them. At most max_profiles are kept;
+    the oldest are deleted first. When token is set, profiling and retrieval
+    need an X-Profile header carrying it; otherwise the request flag is enough.
+    """
+
+    def __init__(self, profile_dir=PROFILE_DIR, max_profiles=20, token=None, sample_interval=0.005):
+        self.profile_dir = profile_dir
+        self.max_profiles = max(1, max_profiles)
+        self.token = token
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            profile_dir=PROFILE_DIR,
+            max_profiles=int(os.getenv('PROFILE_MAX_ENTRIES', 20)),
+            token=os.getenv('PROFILE_TOKEN') or None,
+            sample_interval=float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+        )
+
+    def authorized(self, header):
+        return self.token is None or header == self.token
+
+    def requested(self, flag, header):
+        """
+        Profiling mode asked for by a request's 'profile' flag (true or a mode
+        name) and X-Profile header, or None. Raises ValueError for an unknown mode.
+        """
+        if not flag and not header:
+            return None
+        if not self.authorized(header):
+            logger.warning("Profiling requested without a valid X-Profile token; running unprofiled")
+            return None
+        mode = flag if isinstance(flag, str) else 'cprofile'
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}' (use one of {', '.join(PROFILE_MODES)})")
+        return mode
+
+    @contextmanager
+    def profile(self, mode, request_id=None, **meta):
+        """
+        Profile the block and save the result under request_id (a fresh id when
+        not given or invalid). Yields the profile id.
+        """
+        profile_id = request_id if request_id and PROFILE_ID.match(request_id) else uuid.uuid4().hex[:16]
+        profiler = cProfile.Profile() if mode == 'cprofile' else SamplingProfiler(self.sample_interval)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one deterministic profiler can be active at a time (Python 3.12+)
+            logger.warning("Another profiler is active; sampling this request instead")
+            mode, profiler = 'sample', SamplingProfiler(self.sample_interval)
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield profile_id
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            try:
+                self._save(profile_id, mode, profiler, elapsed, meta)
+            except OSError as e:
+                logger.error(f"Could not save profile {profile_id}: {e}")
+
+    def _save(self, profile_id, mode, profiler, elapsed, meta):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, profile_id)
+        info = {'id': profile_id, 'mode': mode, 'created': time.time(), 'duration': elapsed, **meta}
+        if mode == 'cprofile':
+            profiler.dump_stats(base + PROFILE_FILES['pstats'])
+            text = io.StringIO()
+            stats = pstats.Stats(profiler, stream=text).sort_stats('cumulative')
+            stats.print_stats(TOP_FUNCTIONS)
+            with open(base + PROFILE_FILES['text'], 'w') as f:
+                f.write(text.getvalue())
+            info['files'] = ['pstats', 'text']
+            info['top'] = [{'function': f"{name} ({os.path.basename(filename)}:{line})", 'calls': calls,
+                            'self_time': own_time, 'total_time': total_time}
+                           for (filename, line, name), (_, calls, own_time, total_time, _)
+                           in sorted(stats.stats.items(), key=lambda item: -item[1][3])[:TOP_FUNCTIONS]]
+        else:
+            with open(base + PROFILE_FILES['collapsed'], 'w') as f:
+                f.write(profiler.collapsed())
+            info['files'] = ['collapsed']
+            info['samples'] = profiler.samples
+            info['interval'] = profiler.interval
+            info['top'] = profiler.top_functions()
+        # The metadata file is written last; its presence marks a complete profile
+        with open(base + '.json', 'w') as f:
+            json.dump(info, f)
+        logger.info(f"Saved {mode} profile {profile_id} ({elapsed:.3f} s)")
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            profiles = sorted((os.path.getmtime(os.path.join(self.profile_dir, name)), name[:-5])
+                              for name in os.listdir(self.profile_dir) if name.endswith('.json'))
+            for _, profile_id in profiles[:max(0, len(profiles) - self.max_profiles)]:
+                for suffix in ['.json', *PROFILE_FILES.values()]:
+                    path = os.path.join(self.profile_dir, profile_id + suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def get(self, profile_id):
+        """Metadata and top functions of a profile, or None."""
+        if not PROFILE_ID.match(str(profile_id)):
+            return None
+        try:
+            with open(os.path.join(self.profile_dir, profile_id + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, profile_id, kind):
+        """File of one kind (see PROFILE_FILES) of a profile, or None."""
+        if kind not in PROFILE_FILES or not PROFILE_ID.match(str(profile_id)):
+            return None
+        path = os.path.join(self.profile_dir, profile_id + PROFILE_FILES[kind])
+        return path if os.path.exists(path) else None
+
+    def list(self):
+        """Metadata (without the top functions) of every stored profile, newest first."""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        profiles = [self.get(name[:-5]) for name in os.listdir(self.profile_dir) if name.endswith('.json')]
+        return sorted(({k: v for k, v in info.items() if k != 'top'} for info in profiles if info),
+                      key=lambda info: -info['created'])
+
+
+profile_store = ProfileStore.from_env()
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from metrics import stage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def canonicalize_netlist(netlist_string, order_sensitive=False):
+    """
+    Normalize a netlist so equivalent circuits hash the same: comments and blank
+    lines are dropped, whitespace is collapsed and, unless the analysis depends
+    on line order, the element lines are sorted.
+    """
+    lines = []
+    for line in netlist_string.strip().splitlines():
+        tokens = line.split()
+        if not tokens or tokens[0].startswith(('*', '#', ';')):
+            continue
+        lines.append(' '.join(tokens))
+    if not order_sensitive:
+        lines.sort()
+    return '\n'.join(lines)
+
+
+def make_cache_key(analysis, netlist_string, params=None, order_sensitive=False):
+    """Hash of the analysis name, canonical netlist and analysis parameters."""
+    payload = json.dumps({
+        'analysis': analysis,
+        'netlist': canonicalize_netlist(netlist_string, order_sensitive),
+        'params': params or {}
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of analysis results with a TTL, a byte-size cap and
+    optional on-disk persistence. Values are stored pickled, so every hit
+    returns an independent copy and the size accounting is exact.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=3600, persist_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persist_dir = persist_dir
+        self._entries = OrderedDict()  # key -> (created, payload bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'evictions': 0, 'expirations': 0}
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 256)),
+            max_bytes=int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+            ttl=float(os.getenv('RESULT_CACHE_TTL', 3600)),
+            persist_dir=os.getenv('RESULT_CACHE_DIR') or None
+        )
+
+    def _disk_path(self, key):
+        return os.path.join(self.persist_dir, f'{key}.pkl')
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _drop(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def _store(self, key, created, payload):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (created, payload)
+        self._bytes += len(payload)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.counters['evictions'] += 1
+
+    def _load_from_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            created = os.path.getmtime(path)
+            if self._expired(created):
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return created, f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read cache file {path}: {e}")
+            return None
+
+    def _write_to_disk(self, key, payload):
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not persist cache entry {key}: {e}")
+
+    def get(self, key):
+        """Return (True, value) on a hit and (False, None) on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                self._drop(key)
+                self.counters['expirations'] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return True, pickle.loads(entry[1])
+
+        if self.persist_dir:
+            entry = self._load_from_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, *entry)
+                    self.counters['hits'] += 1
+                    self.counters['disk_hits'] += 1
+                return True, pickle.loads(entry[1])
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return False, None
+
+    def put(self, key, value):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            logger.info(f"Result for {key[:12]} is larger than the cache ({len(payload)} bytes); not cached")
+            return
+        with self._lock:
+            self._store(key, time.time(), payload)
+        if self.persist_dir:
+            self._write_to_disk(key, payload)
+
+    def get_or_compute(self, analysis, netlist_string, params, compute, artifacts=(), order_sensitive=False):
+        """
+        Return the cached result for this analysis or call compute() and cache it.
+        artifacts are files the analysis writes (plots); their contents are cached
+        with the result and restored on a hit so they always match the circuit.
+        """
+        with stage('cache'):
+            key = make_cache_key(analysis, netlist_string, params, order_sensitive)
+            hit, cached = self.get(key)
+        if hit:
+            result, files = cached
+            for path, content in files.items():
+                try:
+                    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                except OSError as e:
+                    logger.warning(f"Could not restore cached artifact {path}: {e}")
+            logger.info(f"Cache hit for {analysis} analysis ({key[:12]})")
+            return result
+
+        logger.info(f"Cache miss for {analysis} analysis ({key[:12]})")
+        # Stale plots from a previous circuit must not be mistaken for this result
+        for path in artifacts:
+            if os.path.exists(path):
+                os.remove(path)
+        result = compute()
+        files = {}
+        for path in artifacts:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    files[path] = f.read()
+        with stage('cache'):
+            self.put(key, (result, files))
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.persist_dir:
+            for name in os.listdir(self.persist_dir):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.persist_dir, name))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+                'persist_dir': self.persist_dir
+            }
+
+
+result_cache = ResultCache.from_env()
@@ -0,0 +1,111 @@
+import base64
+import io
+import logging
+import numpy as np
+from touchstone import touchstone_lines
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+RESPONSE_FORMATS = ('json', 'columnar', 'npz', 'touchstone')
+FLOAT_DTYPES = ('float32', 'float64')
+COMPLEX_DTYPES = {'float32': np.complex64, 'float64': np.complex128}
+
+
+class BinaryPayload:
+    """
+    A non-JSON response body: raw bytes, or an iterable of byte chunks to be
+    streamed, plus their mimetype and extra headers.
+    """
+
+    def __init__(self, data, mimetype='application/octet-stream', headers=None):
+        self.data = data
+        self.mimetype = mimetype
+        self.headers = headers or {}
+
+
+def normalize_format(response_format, dtype='float64'):
+    response_format = str(response_format or 'json').lower()
+    dtype = str(dtype or 'float64').lower()
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response format '{response_format}' (use one of {', '.join(RESPONSE_FORMATS)})")
+    if dtype not in FLOAT_DTYPES:
+        raise ValueError(f"Unknown dtype '{dtype}' (use one of {', '.join(FLOAT_DTYPES)})")
+    return response_format, dtype
+
+
+def encode_array(array, dtype='float64'):
+    """Little-endian, C-ordered base64 encoding of a real array with its dtype and shape."""
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {
+        'dtype': dtype,
+        'shape': list(array.shape),
+        'data': base64.b64encode(array.tobytes()).decode('ascii')
+    }
+
+
+def complex_columns(matrix, dtype='float64'):
+    """
+    Columnar encoding of a complex (nfreqs, nports, nports) array: the real and
+    imaginary parts as separate base64 arrays of the same shape.
+    """
+    matrix = np.asarray(matrix)
+    return {
+        'format': 'columnar',
+        'encoding': 'base64',
+        'byte_order': 'little',
+        'order': 'C',
+        'dtype': dtype,
+        'shape': list(matrix.shape),
+        'real': encode_array(matrix.real, dtype)['data'],
+        'imag': encode_array(matrix.imag, dtype)['data']
+    }
+
+
+def complex_dicts(matrix):
+    """
+    Nested [frequency][row][column] lists of {'real', 'imag', 'magnitude',
+    'phase_deg'} dicts - the JSON layout the frontend reads. The four quantities
+    are computed on the whole array; only the dict assembly is per entry.
+    """
+    matrix = np.asarray(matrix, dtype=complex)
+    columns = zip(matrix.real.ravel().tolist(), matrix.imag.ravel().tolist(),
+                  np.abs(matrix).ravel().tolist(), (np.angle(matrix) * 180 / np.pi).ravel().tolist())
+    entries = [{'real': re, 'imag': im, 'magnitude': mag, 'phase_deg': ph} for re, im, mag, ph in columns]
+    nfreqs, rows, cols = matrix.shape
+    return [[entries[(f * rows + r) * cols:(f * rows + r + 1) * cols] for r in range(rows)]
+            for f in range(nfreqs)]
+
+
+def npz_payload(arrays, dtype='float64', filename='result.npz'):
+    """
+    BinaryPayload holding an uncompressed .npz of arrays; complex arrays are
+    stored as complex64/complex128 according to dtype. The shape and dtype of
+    every array are repeated in X-Array-* headers.
+    """
+    buffer = io.BytesIO()
+    converted = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        converted[name] = array.astype(COMPLEX_DTYPES[dtype] if np.iscomplexobj(array) else dtype)
+    np.savez(buffer, **converted)
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    for name, array in converted.items():
+        headers[f'X-Array-{name}'] = f"{array.dtype.name};{','.join(str(n) for n in array.shape)}"
+    logger.info(f"Packed {', '.join(converted)} into {buffer.tell()} bytes of npz")
+    return BinaryPayload(buffer.getvalue(), 'application/octet-stream', headers)
+
+
+def touchstone_payload(frequencies, s, z0=50.0, filename=None, comment=None):
+    """
+    Streamed Touchstone export of (frequencies in Hz, s of shape (points, nports, nports)).
+    The text is generated chunk by chunk while it is sent.
+    """
+    nports = np.shape(s)[1]
+    filename = filename or f's_parameters.s{nports}p'
+    chunks = (chunk.encode('ascii') for chunk in touchstone_lines(frequencies, s, z0, comment))
+    return BinaryPayload(chunks, 'text/plain', {'Content-Disposition': f'attachment; filename={filename}'})
@@ -0,0 +1,306 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from lazy_imports import LazyModule
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Only Y/Z data conversion needs scikit-rf
+rf = LazyModule('skrf')
+
+TOUCHSTONE_DIR = os.getenv('TOUCHSTONE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'uploads', 'touchstone')
+MAX_UPLOAD_BYTES = int(os.getenv('TOUCHSTONE_MAX_BYTES', 256 * 1024 * 1024))
+MAX_CACHED_NETWORKS = 8
+# Bytes of text parsed at a time; chunks always end on a line boundary
+CHUNK_BYTES = 8 * 1024 * 1024
+# Frequency points formatted per chunk of an export stream
+EXPORT_POINTS_PER_CHUNK = 4096
+FREQUENCY_UNITS = {'hz': 1.0, 'khz': 1e3, 'mhz': 1e6, 'ghz': 1e9}
+TOUCHSTONE_ID = re.compile(r'^[0-9a-f]{16}$')
+EXTENSION = re.compile(r'\.s(\d+)p$', re.IGNORECASE)
+
+_networks = OrderedDict()
+_lock = threading.Lock()
+
+
+class TouchstoneData:
+    """S-parameters read from a Touchstone file: frequencies in Hz, s of shape (points, nports, nports)."""
+
+    def __init__(self, frequencies, s, z0=50.0, comments=''):
+        self.frequencies = frequencies
+        self.s = s
+        self.z0 = z0
+        self.comments = comments
+
+    @property
+    def nports(self):
+        return self.s.shape[1]
+
+    def info(self):
+        return {'nports': self.nports, 'points': len(self.frequencies),
+                'fmin': float(self.frequencies[0]), 'fmax': float(self.frequencies[-1]), 'z0': self.z0}
+
+    def interpolate(self, frequencies):
+        """S-parameters linearly interpolated (real and imaginary parts) onto frequencies in Hz."""
+        frequencies = np.asarray(frequencies, dtype=float)
+        fmin, fmax = self.frequencies[0], self.frequencies[-1]
+        if frequencies.min() < fmin * (1 - 1e-9) or frequencies.max() > fmax * (1 + 1e-9):
+            raise ValueError(f"Frequencies {frequencies.min():g}-{frequencies.max():g} Hz are outside the "
+                             f"measured range {fmin:g}-{fmax:g} Hz")
+        n = self.nports
+        s = np.empty((len(frequencies), n, n), dtype=complex)
+        for i in range(n):
+            for j in range(n):
+                s[:, i, j] = (np.interp(frequencies, self.frequencies, self.s[:, i, j].real)
+                              + 1j * np.interp(frequencies, self.frequencies, self.s[:, i, j].imag))
+        return s
+
+
+def _text_chunks(path, chunk_bytes=CHUNK_BYTES):
+    """Decoded text of a file in pieces of about chunk_bytes, each ending at a line break."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            size = len(mm)
+            while start < size:
+                end = min(start + chunk_bytes, size)
+                if end < size:
+                    newline = mm.find(b'\n', end)
+                    end = size if newline < 0 else newline + 1
+                yield mm[start:end].decode('utf-8', errors='replace')
+                start = end
+
+
+def _parse_options(line):
+    """Unit multiplier, parameter, format and reference resistance of a '#' option line."""
+    tokens = line[1:].lower().split()
+    unit, parameter, fmt, resistance = 'ghz', 's', 'ma', 50.0
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in FREQUENCY_UNITS:
+            unit = token
+        elif token in ('s', 'y', 'z', 'h', 'g'):
+            parameter = token
+        elif token in ('db', 'ma', 'ri'):
+            fmt = token
+        elif token == 'r' and i + 1 < len(tokens):
+            resistance = float(tokens[i + 1])
+            i += 1
+        i += 1
+    if parameter not in ('s', 'y', 'z'):
+        raise ValueError(f"Touchstone {parameter.upper()}-parameters are not supported")
+    return FREQUENCY_UNITS[unit], parameter, fmt, resistance
+
+
+def _split_noise_block(text_lines, record):
+    """Network-data numbers of a 2-port file that also carries a noise-parameter block."""
+    values = []
+    last_frequency = -np.inf
+    for line in text_lines:
+        numbers = [float(x) for x in line.split()]
+        if not numbers:
+            continue
+        # Noise data starts with a frequency not above the last network frequency
+        if len(numbers) == 5 and numbers[0] <= last_frequency:
+            break
+        last_frequency = numbers[0]
+        values.extend(numbers)
+    values = np.asarray(values)
+    return values[:len(values) - len(values) % record]
+
+
+def _scan(path, state):
+    """
+    Data lines of a Touchstone file, one list per text chunk, with comments and
+    option/keyword lines removed. Options, keywords and the header comment are
+    recorded in state.
+    """
+    for chunk in _text_chunks(path):
+        if 'options' in state and not any(marker in chunk for marker in '!#['):
+            # Plain numeric data, the bulk of large files, is passed through as is
+            yield [chunk]
+            continue
+        kept = []
+        for line in chunk.splitlines():
+            line, _, comment = line.partition('!')
+            if comment and 'options' not in state:
+                state.setdefault('comments', []).append(comment.strip())
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('#'):
+                state.setdefault('options', _parse_options(stripped))
+                continue
+            if stripped.startswith('['):
+                keyword, _, value = stripped.partition(']')
+                keyword = keyword[1:].strip().lower()
+                if keyword == 'number of ports':
+                    state['nports'] = int(value)
+                elif keyword == 'two-port data order':
+                    state['two_port_order'] = value.strip()
+                elif keyword in ('noise data', 'end'):
+                    yield kept
+                    return
+                continue
+            kept.append(stripped)
+        yield kept
+
+
+def read_touchstone(path, nports=None):
+    """
+    Parse a Touchstone v1 (or simple v2) file into TouchstoneData.
+
+    The file is memory-mapped and parsed in chunks of CHUNK_BYTES: comments and
+    keyword lines are stripped per chunk and the numbers are converted in one
+    C-level call, so files with hundreds of thousands of points never go
+    through a per-value Python loop. nports defaults to the .sNp extension or
+    the [Number of Ports] keyword.
+    """
+    state = {}
+    arrays = [np.fromstring(' '.join(lines), sep=' ') for lines in _scan(path, state) if lines]
+    if nports is None:
+        match = EXTENSION.search(path)
+        nports = state.get('nports') or (int(match.group(1)) if match else None)
+    if not nports:
+        raise ValueError("Number of ports unknown: name the file .sNp or add a [Number of Ports] line")
+    multiplier, parameter, fmt, resistance = state.get('options', (1e9, 's', 'ma', 50.0))
+
+    record = 1 + 2 * nports * nports
+    values = np.concatenate(arrays) if arrays else np.empty(0)
+    rows = values[:len(values) - len(values) % record].reshape(-1, record)
+    if len(values) % record or (len(rows) > 1 and np.any(np.diff(rows[:, 0]) <= 0)):
+        if nports != 2:
+            raise ValueError(f"Malformed {nports}-port Touchstone data")
+        logger.info("Touchstone file has a noise block; re-reading the network data line by line")
+        lines = (line for kept in _scan(path, {}) for block in kept for line in block.splitlines())
+        rows = _split_noise_block(lines, record).reshape(-1, record)
+    if not len(rows):
+        raise ValueError("Touchstone file contains no network data")
+
+    a, b = rows[:, 1::2], rows[:, 2::2]
+    if fmt == 'ri':
+        values = a + 1j * b
+    elif fmt == 'ma':
+        values = a * np.exp(1j * np.deg2rad(b))
+    else:
+        values = 10 ** (a / 20) * np.exp(1j * np.deg2rad(b))
+    matrix = values.reshape(-1, nports, nports)
+    if nports == 2 and state.get('two_port_order', '21_12') == '21_12':
+        # 2-port files list N11 N21 N12 N22
+        matrix = matrix.transpose(0, 2, 1)
+    if parameter == 'z':
+        matrix = rf.network.z2s(matrix * resistance, resistance)
+    elif parameter == 'y':
+        matrix = rf.network.y2s(matrix / resistance, resistance)
+    return TouchstoneData(rows[:, 0] * multiplier, np.ascontiguousarray(matrix), resistance,
+                          '\n'.join(state.get('comments', [])))
+
+
+def touchstone_lines(frequencies, s, z0=50.0, comment=None):
+    """
+    Touchstone v1 text (Hz, S, RI) as a generator of string chunks of
+    EXPORT_POINTS_PER_CHUNK frequencies, so large sweeps can be streamed.
+    Matrices of 3 or more ports are written row by row with at most four
+    complex pairs per line.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    s = np.asarray(s, dtype=complex)
+    nports = s.shape[1]
+    header = [f'! {line}' for line in (comment or '').splitlines()]
+    header.append(f'# Hz S RI R {z0:g}')
+    yield '\n'.join(header) + '\n'
+
+    if nports <= 2:
+        # 1- and 2-port data: one line per frequency, 2-port in N11 N21 N12 N22 order
+        line_format = ' '.join(['%.12g'] * (1 + 2 * nports * nports)) + '\n'
+        order = s.transpose(0, 2, 1) if nports == 2 else s
+    for start in range(0, len(frequencies), EXPORT_POINTS_PER_CHUNK):
+        stop = start + EXPORT_POINTS_PER_CHUNK
+        block = s[start:stop] if nports > 2 else order[start:stop]
+        pairs = np.stack([block.real, block.imag], axis=-1).reshape(len(block), nports, 2 * nports)
+        if nports <= 2:
+            rows = np.column_stack([frequencies[start:stop], pairs.reshape(len(block), -1)])
+            yield ''.join(line_format % tuple(row) for row in rows.tolist())
+            continue
+        lines = []
+        for f, matrix in zip(frequencies[start:stop].tolist(), pairs.tolist()):
+            for r, row in enumerate(matrix):
+                for k in range(0, 2 * nports, 8):
+                    prefix = f'{f:.12g}' if r == 0 and k == 0 else ' '
+                    lines.append(prefix + ' ' + ' '.join(f'{x:.12g}' for x in row[k:k + 8]))
+        yield '\n'.join(lines) + '\n'
+
+
+def store_touchstone(stream, filename):
+    """
+    Save an uploaded Touchstone file (a binary stream) under a content hash and
+    return (touchstone id, TouchstoneData). The file is copied in chunks and
+    parsed from disk, so uploads never have to fit in memory twice.
+    """
+    match = EXTENSION.search(filename or '')
+    if not match:
+        raise ValueError("Touchstone uploads must be named *.sNp (e.g. amplifier.s2p)")
+    nports = int(match.group(1))
+    os.makedirs(TOUCHSTONE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(TOUCHSTONE_DIR, f'upload-{os.getpid()}-{threading.get_ident()}.tmp')
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                block = stream.read(1024 * 1024)
+                if not block:
+                    break
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ValueError(f"Touchstone file exceeds {MAX_UPLOAD_BYTES // 2 ** 20} MB")
+                digest.update(block)
+                f.write(block)
+        touchstone_id = digest.hexdigest()[:16]
+        path = os.path.join(TOUCHSTONE_DIR, f'{touchstone_id}.s{nports}p')
+        data = read_touchstone(tmp_path, nports)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with _lock:
+        _networks[touchstone_id] = data
+        while len(_networks) > MAX_CACHED_NETWORKS:
+            _networks.popitem(last=False)
+    logger.info(f"Stored Touchstone {filename} as {touchstone_id}: {data.info()}")
+    return touchstone_id, data
+
+
+def load_touchstone(touchstone_id):
+    """TouchstoneData of an uploaded file; parsed files are kept in a small LRU cache."""
+    if not TOUCHSTONE_ID.match(str(touchstone_id)):
+        raise ValueError(f"Invalid Touchstone id: {touchstone_id}")
+    with _lock:
+        data = _networks.get(touchstone_id)
+        if data is not None:
+            _networks.move_to_end(touchstone_id)
+            return data
+    paths = [name for name in os.listdir(TOUCHSTONE_DIR) if name.startswith(touchstone_id + '.')] \
+        if os.path.isdir(TOUCHSTONE_DIR) else []
+    if not paths:
+        raise ValueError(f"Unknown Touchstone id: {touchstone_id} (upload the file first)")
+    data = read_touchstone(os.path.join(TOUCHSTONE_DIR, paths[0]))
+    with _lock:
+        _networks[touchstone_id] = data
+        while len(_networks) > MAX_CACHED_NETWORKS:
+            _networks.popitem(last=False)
+    return data
@@ -1,12 +1,17 @@
-import matplotlib
-matplotlib.use('Agg')  # Set the backend before importing pyplot
-
-from lcapy import Circuit
 import numpy as np
-from matplotlib.pyplot import subplots, savefig, tight_layout, close
 import logging
 import os
-import sympy as sp
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit
+from compiled_expr import evaluate_expression
+from transient_engine import run_numeric_transient
+from lazy_imports import LazyModule, lazy_pyplot
+from metrics import timed, stage
+
+# Imported on first use: numeric time stepping needs neither
+lcapy = LazyModule('lcapy')
+sp = LazyModule('sympy')
+plt = lazy_pyplot()
 
 # Configure logging
 logging.basicConfig(
@@ -16,214 +21,197 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def preprocess_netlist(netlist_string):
-    lines = netlist_string.strip().splitlines()
-    processed = []
-
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('#'):  # Skip empty lines and comments
-            continue
-            
-        tokens = line.split()
-        if len(tokens) >= 3:
-            if tokens[0].startswith('W'):
-                # Convert wire to small resistor
-                name, n1, n2 = tokens[0], tokens[1], tokens[2]
-                processed.append(f'R{name} {n1} {n2} 0.000001')
-            elif tokens[0].startswith('V') and len(tokens) >= 4:
-                # Fix voltage source - convert AC to step for transient analysis
-                name, n1, n2 = tokens[0], tokens[1], tokens[2]
-                if 'AC' in tokens[3].upper():
-                    amplitude = tokens[4] if len(tokens) > 4 else '1'
-                    processed.append(f'{name} {n1} {n2} step {amplitude}')
-                    logger.info(f"Converted ACP Source {name} to step source")
-                else:
-                    processed.append(line)
-            else:
-                processed.append(line)
-        else:
-            processed.append(line)
-
-    return '\n'.join(processed)
+    """Wires become small resistors and AC sources are switched on as steps of their amplitude."""
+    return parse_circuit(netlist_string).lowered(wires=1e-6, sources='step').to_netlist()
 
 def safe_transient_response(component_attr, t, component_name, attr_type):
     """Safely compute transient response with error handling for symbolic issues"""
     try:
-        # Get the transient response
-        response = component_attr.transient_response(t)
+        # Get the symbolic transient response once and evaluate it on the whole time vector
+        response = component_attr.transient_response()
+        expr = response.expr if hasattr(response, 'expr') else sp.sympify(response)
         
         # Check if response contains undefined symbols
-        if hasattr(response, 'free_symbols'):
-            undefined_symbols = response.free_symbols
-            if undefined_symbols:
-                logger.warning(f"Response for {component_name} {attr_type} contains undefined symbols: {undefined_symbols}")
-                return None
+        time_symbols = [s for s in expr.free_symbols if s.name == 't']
+        undefined_symbols = expr.free_symbols - set(time_symbols)
+        if undefined_symbols:
+            logger.warning(f"Response for {component_name} {attr_type} contains undefined symbols: {undefined_symbols}")
+            return None
         
-        # Convert to numpy array if it's symbolic
-        if hasattr(response, 'evalf'):
-            try:
-                response_numeric = np.array([complex(response.subs(sp.symbols('t'), t_val).evalf()) for t_val in t])
-                # Take real part if it's complex but imaginary part is negligible
-                if np.allclose(response_numeric.imag, 0):
-                    response_numeric = response_numeric.real
-                return response_numeric
-            except Exception as e:
-                logger.error(f"Error converting symbolic response to numeric for {component_name}: {e}")
-                return None
+        time_symbol = time_symbols[0] if time_symbols else sp.Symbol('t', real=True)
+        try:
+            response_numeric = evaluate_expression(expr, time_symbol, t)
+        except Exception as e:
+            logger.error(f"Error converting symbolic response to numeric for {component_name}: {e}")
+            return None
         
-        # If it's already numeric, return as is
-        return np.array(response)
+        # Take real part if it's complex but imaginary part is negligible
+        if np.iscomplexobj(response_numeric) and np.allclose(response_numeric.imag, 0):
+            response_numeric = response_numeric.real
+        return response_numeric
         
     except Exception as e:
         logger.error(f"Error computing {attr_type} response for {component_name}: {e}")
         return None
 
-def run_transient_analysis(netlist_filename='netlist.txt'):
+PLOTTED_TYPES = ('R', 'L', 'C')
+
+
+def plotted_components(element_names):
+    """Components that get plotted: R1, R2, ... then L1, ... then C1, ... until a gap in numbering."""
+    components = []
+    for component_type in PLOTTED_TYPES:
+        index = 1
+        while f"{component_type}{index}" in element_names:
+            components.append((f"{component_type}{index}", component_type))
+            index += 1
+    return components
+
+
+def symbolic_transient_responses(netlist_string, t):
+    """Voltage/current responses of the plotted components via lcapy's Laplace inversion."""
+    try:
+        with stage('circuit'):
+            cct = lcapy.Circuit(netlist_string)
+        logger.info("Circuit created successfully")
+        logger.info(f"Circuit elements: {list(cct.elements.keys())}")
+    except Exception as e:
+        logger.error(f"Error creating circuit: {e}")
+        return None
+
+    responses = {}
+    with stage('solve'):
+        for component_name, _ in plotted_components(cct.elements):
+            try:
+                component = getattr(cct, component_name)
+                responses[component_name] = {
+                    'V': safe_transient_response(component.V, t, component_name, 'voltage'),
+                    'I': safe_transient_response(component.I, t, component_name, 'current')
+                }
+            except Exception as e:
+                logger.error(f"Error computing response for {component_name}: {e}")
+    return responses
+
+
+def numeric_transient_responses(netlist_string, tstop, tstep, method, adaptive):
+    """Voltage/current responses of the plotted components via numeric time stepping."""
+    names = [line.split()[0] for line in netlist_string.splitlines() if line.split()]
+    components = [name for name, _ in plotted_components(set(names))]
+    with stage('solve'):
+        return run_numeric_transient(netlist_string, tstop=tstop, tstep=tstep, method=method,
+                                     adaptive=adaptive, names=set(components))
+
+
+def plot_transient_responses(t, responses, quantity, filename=None, dpi=300):
+    """Plot the 'V' or 'I' responses, by default into static/transient_analysis-{voltage,current}.png."""
+    label = 'voltage' if quantity == 'V' else 'current'
+    filename = filename or f'static/transient_analysis-{label}.png'
+    fig, ax = plt.subplots(figsize=(12, 7) if quantity == 'V' else (12, 8))
+    plots_created = False
+
+    for component_name, component_type in plotted_components(responses):
+        response = responses[component_name].get(quantity)
+        if response is not None and len(response) > 0:
+            linestyle = '--' if component_type == 'L' else ':' if component_type == 'C' else '-'
+            ax.plot(t, response, label=f'{quantity}{component_name} ({component_type})',
+                    linewidth=3, linestyle=linestyle)
+            plots_created = True
+            logger.info(f"{label.capitalize()} plot created for {component_name}")
+        else:
+            logger.warning(f"No valid {label} response for {component_name}")
+
+    if plots_created:
+        fontsize = 12 if quantity == 'V' else 14
+        ax.set_xlabel('Time (s)', fontsize=fontsize)
+        ax.set_ylabel('Voltage (V)' if quantity == 'V' else 'Current (A)', fontsize=fontsize)
+        ax.set_title(f'Transient Analysis - {label.capitalize()} Response', fontsize=14)
+        ax.grid(True, alpha=0.3)
+        ax.legend(fontsize=10)
+        plt.tight_layout()
+
+        try:
+            plt.savefig(filename, dpi=dpi, bbox_inches='tight')
+            logger.info(f"{label.capitalize()} plot saved successfully")
+        except Exception as e:
+            logger.error(f"Error saving {label} plot: {e}")
+    else:
+        logger.warning(f"No {label} plots were created")
+
+    # Close the figure to free memory
+    plt.close(fig)
+    return plots_created
+
+
+TRANSIENT_PLOTS = {'voltage': 'V', 'current': 'I'}
+
+
+def render_transient_plot(name, plot_data, filename, dpi):
+    """Render one of TRANSIENT_PLOTS from run_transient_analysis plot data."""
+    return plot_transient_responses(plot_data['t'], plot_data['responses'], TRANSIENT_PLOTS[name], filename, dpi)
+
+
+def _has_response(responses):
+    return any(response is not None and len(response) > 0
+               for quantities in responses.values() for response in quantities.values())
+
+
+@timed('transient')
+def run_transient_analysis(netlist_filename='netlist.txt', netlist=None, mode='numeric',
+                           tstop=0.05, tstep=None, method='trap', adaptive=True, return_info=False,
+                           return_plot_data=False):
+    """
+    Transient analysis from t=0 to tstop sampled every tstep (default 1000 points).
+
+    mode 'numeric' time-steps the MNA equations with the given integration method
+    ('be', 'trap' or 'gear2') and falls back to lcapy on failure; mode 'symbolic'
+    uses lcapy's Laplace inversion. Returns True if at least one component has a
+    response, followed by an info dict when return_info is set and by the
+    {'t', 'responses'} data for render_transient_plot when return_plot_data is.
+    """
+    info = {'engine': None}
+    plot_data = None
+    success = False
+
+    def result():
+        values = (success,) + ((info,) if return_info else ()) + ((plot_data,) if return_plot_data else ())
+        return values if len(values) > 1 else success
+
     try:
         # Check if netlist file exists
-        if not os.path.exists(netlist_filename):
+        if netlist is None and not os.path.exists(netlist_filename):
             logger.error(f"Netlist file '{netlist_filename}' not found!")
-            return False
-        
-        # Create output directory if it doesn't exist
-        os.makedirs('static', exist_ok=True)
-        
-        t = np.linspace(0, 0.05, 1000)  # Time range for the analysis
+            return result()
+
+        tstop = float(tstop)
+        tstep = float(tstep) if tstep else tstop / 999
 
-        # Read the netlist string from the file
-        with open(netlist_filename, 'r') as file:
-            netlist_string = file.read()
+        netlist_string = load_netlist(netlist, netlist_filename)
 
         logger.info("Original netlist:\n%s", netlist_string)
-        netlist_string = preprocess_netlist(netlist_string)
+        with stage('preprocess'):
+            netlist_string = preprocess_netlist(netlist_string)
         logger.info("Processed netlist:\n%s", netlist_string)
 
-        # Define the circuit with the read netlist
-        try:
-            cct = Circuit(netlist_string)
-            logger.info("Circuit created successfully")
-            logger.info(f"Circuit elements: {list(cct.elements.keys())}")
-        except Exception as e:
-            logger.error(f"Error creating circuit: {e}")
-            return False
-
-        # Create figure for voltage plot
-        fig, ax = subplots(figsize=(12, 7))
-        voltage_plots_created = False
-
-        # Handle arbitrary numbers of resistors, capacitors, and inductors
-        for component_type in ['R', 'L', 'C']:
-            index = 1
-            while True:
-                component_name = f"{component_type}{index}"
-                if component_name not in cct.elements:
-                    break
-
-                try:
-                    # Get component
-                    component = getattr(cct, component_name)
-                    
-                    # Safe transient response of voltage
-                    v_response = safe_transient_response(component.V, t, component_name, 'voltage')
-                    
-                    if v_response is not None and len(v_response) > 0:
-                        linestyle = '--' if component_type == 'L' else ':' if component_type == 'C' else '-'
-                        ax.plot(t, v_response, label=f'V{component_name} ({component_type})', 
-                               linewidth=3, linestyle=linestyle)
-                        voltage_plots_created = True
-                        logger.info(f"Voltage plot created for {component_name}")
-                    else:
-                        logger.warning(f"No valid voltage response for {component_name}")
-                    
-                except Exception as e:
-                    logger.error(f"Error plotting voltage for {component_name}: {e}")
-
-                index += 1
-
-        if voltage_plots_created:
-            # Plot settings for Voltage
-            ax.set_xlabel('Time (s)', fontsize=12)
-            ax.set_ylabel('Voltage (V)', fontsize=12)
-            ax.set_title('Transient Analysis - Voltage Response', fontsize=14)
-            ax.grid(True, alpha=0.3)
-            ax.legend(fontsize=10)
-            tight_layout()
-            
-            try:
-                savefig('static/transient_analysis-voltage.png', dpi=300, bbox_inches='tight')
-                logger.info("Voltage plot saved successfully")
-            except Exception as e:
-                logger.error(f"Error saving voltage plot: {e}")
-        else:
-            logger.warning("No voltage plots were created")
-        
-        # Close the figure to free memory
-        close(fig)
-
-        # Create figure for current plot
-        fig, ax = subplots(figsize=(12, 8))
-        current_plots_created = False
-
-        # Handle arbitrary numbers of resistors, capacitors, and inductors
-        for component_type in ['R', 'L', 'C']:
-            index = 1
-            while True:
-                component_name = f"{component_type}{index}"
-                if component_name not in cct.elements:
-                    break
-                
-                try:
-                    # Get component
-                    component = getattr(cct, component_name)
-                    
-                    # Safe transient response of current
-                    i_response = safe_transient_response(component.I, t, component_name, 'current')
-                    
-                    if i_response is not None and len(i_response) > 0:
-                        linestyle = '--' if component_type == 'L' else ':' if component_type == 'C' else '-'
-                        ax.plot(t, i_response, label=f'I{component_name} ({component_type})', 
-                               linewidth=3, linestyle=linestyle)
-                        current_plots_created = True
-                        logger.info(f"Current plot created for {component_name}")
-                    else:
-                        logger.warning(f"No valid current response for {component_name}")
-                    
-                except Exception as e:
-                    logger.error(f"Error plotting current for {component_name}: {e}")
-
-                index += 1
-
-        if current_plots_created:
-            # Plot settings for Current
-            ax.set_xlabel('Time (s)', fontsize=14)
-            ax.set_ylabel('Current (A)', fontsize=14)
-            ax.set_title('Transient Analysis - Current Response', fontsize=14)
-            ax.grid(True, alpha=0.3)
-            ax.legend(fontsize=10)
-            tight_layout()
-            
+        responses = None
+        if mode != 'symbolic':
             try:
-                savefig('static/transient_analysis-current.png', dpi=300, bbox_inches='tight')
-                logger.info("Current plot saved successfully")
+                t, responses, info = numeric_transient_responses(netlist_string, tstop, tstep, method, adaptive)
             except Exception as e:
-                logger.error(f"Error saving current plot: {e}")
-        else:
-            logger.warning("No current plots were created")
-        
-        # Close the figure to free memory
-        close(fig)
-        
-        # Return True only if at least one plot was created
-        return voltage_plots_created or current_plots_created
-        
+                logger.warning(f"Numeric transient failed ({e}), falling back to symbolic analysis")
+                info = {'engine': None, 'error': str(e)}
+        if responses is None:
+            t = np.linspace(0, tstop, int(round(tstop / tstep)) + 1)
+            responses = symbolic_transient_responses(netlist_string, t)
+            if responses is None:
+                return result()
+            info['engine'] = 'symbolic'
+
+        success = _has_response(responses)
+        if not success:
+            logger.warning("No transient responses were computed")
+        plot_data = {'t': t, 'responses': responses}
+
     except Exception as e:
         logger.error(f"Unexpected error in run_transient_analysis: {e}")
-        return False
-
-if __name__ == "__main__":
-    # Run with your actual netlist file
-    success = run_transient_analysis('netlist.txt')
-    if success:
-        print("At least one plot was generated successfully!")
-    else:
-        print("No plots were generated. Check the logs for details.")
\ No newline at end of file
+        info['error'] = str(e)
+    return result()
@@ -0,0 +1,221 @@
+import logging
+import math
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse as sparse
+from mna import MNACircuit
+from factorization import factorization_cache, factorize
+
+# Setup logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Integration method -> order of accuracy
+METHODS = {'be': 1, 'trap': 2, 'gear2': 2}
+METHOD_ALIASES = {'backward_euler': 'be', 'euler': 'be', 'tr': 'trap', 'trapezoidal': 'trap',
+                  'gear': 'gear2', 'bdf2': 'gear2'}
+# Milne's device: LTE ~ ratio·(corrector - predictor), with the predictor an
+# extrapolating polynomial through the last order+1 accepted points
+LTE_RATIO = {'be': 1.0 / 3.0, 'trap': 1.0 / 13.0, 'gear2': 2.0 / 11.0}
+GMIN = 1e-12
+MAX_FACTORIZATIONS = 16
+MAX_HALVINGS = 40
+
+
+def normalize_method(method):
+    method = str(method or 'trap').lower()
+    method = METHOD_ALIASES.get(method, method)
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method '{method}' (use one of {', '.join(METHODS)})")
+    return method
+
+
+class TransientSimulator:
+    """
+    Companion-model time stepping of  C·x' + G·x = b(t)  for an MNACircuit.
+
+    Every integration formula turns a step into  (a0·C + G)·x[n+1] = b + C·h[n],
+    so the system matrix only depends on a0. Adaptive steps are restricted to
+    tstep/2^k, which keeps the number of distinct a0 values - and therefore
+    sparse LU factorizations - small; fixed steps need one factorization per
+    method. Step sources are off for t < 0 and on from t = 0.
+    """
+
+    def __init__(self, circuit, method='trap', reltol=1e-3, vabstol=1e-6, iabstol=1e-9):
+        self.circuit = circuit
+        self.method = normalize_method(method)
+        self.order = METHODS[self.method]
+        self.reltol = reltol
+        n_nodes = len(circuit.nodes)
+        self.abstol = np.r_[np.full(n_nodes, vabstol), np.full(circuit.size - n_nodes, iabstol)]
+        self._lus = OrderedDict()
+        self.stats = {'accepted': 0, 'rejected': 0, 'factorizations': 0, 'solves': 0}
+
+    def source_vector(self, t):
+        return self.circuit.b_dc + self.circuit.b_step if t >= 0 else self.circuit.b_dc
+
+    def initial_state(self):
+        """DC operating point before the step sources switch on (capacitors open, inductors shorted)."""
+        circuit = self.circuit
+        try:
+            return factorization_cache.solve(circuit.G, circuit.b_dc)
+        except RuntimeError:
+            # Nodes only connected through capacitors: a tiny shunt pins them to ground
+            n_nodes = len(circuit.nodes)
+            shunt = sparse.diags(np.r_[np.full(n_nodes, GMIN), np.zeros(circuit.size - n_nodes)], format='csc')
+            try:
+                return factorize(circuit.G + shunt).solve(circuit.b_dc)
+            except RuntimeError as e:
+                raise ValueError(f"Singular MNA matrix at the initial operating point: {e}")
+
+    def _solver(self, a0):
+        lu = self._lus.get(a0)
+        if lu is not None:
+            self._lus.move_to_end(a0)
+            return lu
+        try:
+            lu = factorize(a0 * self.circuit.C + self.circuit.G)
+        except RuntimeError as e:
+            raise ValueError(f"Singular transient system matrix (floating node or source loop?): {e}")
+        self.stats['factorizations'] += 1
+        self._lus[a0] = lu
+        while len(self._lus) > MAX_FACTORIZATIONS:
+            self._lus.popitem(last=False)
+        return lu
+
+    def _coefficients(self, method, h, history):
+        """Return (a0, hist) so that x' at the new point is a0·x - hist."""
+        t0, x0, xdot0, h0 = history[-1]
+        if method == 'be':
+            return 1.0 / h, x0 / h
+        if method == 'trap':
+            return 2.0 / h, 2.0 / h * x0 + xdot0
+        # Variable-step BDF2; step sizes are tracked exactly so a constant step
+        # keeps a constant a0 instead of drifting with the accumulated time
+        x1 = history[-2][1]
+        omega = h / h0
+        a0 = (1 + 2 * omega) / (h * (1 + omega))
+        a1 = -(1 + omega) / h
+        a2 = omega * omega / (h * (1 + omega))
+        return a0, -(a1 * x0 + a2 * x1)
+
+    def step(self, method, h, history):
+        t_new = history[-1][0] + h
+        a0, hist = self._coefficients(method, h, history)
+        x = self._solver(a0).solve(self.source_vector(t_new) + self.circuit.C @ hist)
+        self.stats['solves'] += 1
+        if not np.all(np.isfinite(x)):
+            raise ValueError(f"Transient solve produced non-finite values at t={t_new:g}")
+        return t_new, x, a0 * x - hist, h
+
+    def _lte_norm(self, history, t_new, x_new):
+        """Scaled local truncation error estimate; the step is accepted when it is <= 1."""
+        points = history[-(self.order + 1):]
+        x_pred = np.zeros_like(x_new)
+        for i, (ti, xi, _, _) in enumerate(points):
+            weight = 1.0
+            for j, (tj, _, _, _) in enumerate(points):
+                if i != j:
+                    weight *= (t_new - tj) / (ti - tj)
+            x_pred += weight * xi
+        tol = self.reltol * np.maximum(np.abs(x_new), np.abs(history[-1][1])) + self.abstol
+        lte = LTE_RATIO[self.method] * np.abs(x_new - x_pred)
+        return float(np.max(lte / tol)) if len(tol) else 0.0
+
+    def run(self, tstop, tstep, adaptive=True):
+        """
+        Simulate from 0 to tstop and sample the solution every tstep.
+        Returns (t, X, Xdot) where each row of X / Xdot is the MNA solution
+        vector / its time derivative at the matching time point.
+        """
+        if tstop <= 0 or tstep <= 0:
+            raise ValueError("tstop and tstep must be positive")
+        n_out = int(math.floor(tstop / tstep + 1e-9)) + 1
+        t_out = np.arange(n_out) * tstep
+        X = np.empty((n_out, self.circuit.size))
+        Xdot = np.empty_like(X)
+
+        x0 = self.initial_state()
+        X[0] = x0
+        Xdot[0] = 0.0
+        history = [(0.0, x0, np.zeros_like(x0), None)]
+        next_out = 1
+
+        # The sources switch at t = 0, so the first step is always backward Euler
+        level = 6 if adaptive else 0
+        while next_out < n_out:
+            h = tstep / 2 ** level
+            method = self.method if len(history) > 1 else 'be'
+            new_point = self.step(method, h, history)
+            t_new, x_new, xdot_new, _ = new_point
+
+            if adaptive and len(history) > self.order:
+                error = self._lte_norm(history, t_new, x_new)
+                if error > 1.0:
+                    self.stats['rejected'] += 1
+                    level += max(1, math.ceil(math.log2(error) / (self.order + 1)))
+                    if level > MAX_HALVINGS:
+                        raise ValueError(f"Time step too small at t={history[-1][0]:g}")
+                    continue
+                grow = 0.9 * error ** (-1.0 / (self.order + 1)) if error > 0 else 2.0
+                if grow >= 2.0 and level > 0:
+                    level -= 1
+                elif grow < 1.0:
+                    level += math.ceil(math.log2(1.0 / grow))
+            self.stats['accepted'] += 1
+
+            # Linear interpolation onto the output grid points covered by this step
+            t_old, x_old, xdot_old, _ = history[-1]
+            hi = np.searchsorted(t_out, t_new, side='right')
+            if hi > next_out:
+                frac = ((t_out[next_out:hi] - t_old) / (t_new - t_old))[:, None]
+                X[next_out:hi] = x_old + frac * (x_new - x_old)
+                Xdot[next_out:hi] = xdot_old + frac * (xdot_new - xdot_old)
+                next_out = hi
+
+            history.append(new_point)
+            if len(history) > 3:
+                history.pop(0)
+
+        return t_out, X, Xdot
+
+    def element_waveforms(self, t, X, Xdot, names=None):
+        """Voltage and current (lcapy sign convention) of the named elements (default all) over time."""
+        circuit = self.circuit
+        on = (t >= 0).astype(float)
+        waveforms = {}
+        for element in circuit.elements:
+            if names is not None and element['name'] not in names:
+                continue
+            kind = element['type']
+            voltage = circuit.element_voltage(X, element)
+            if kind == 'C':
+                current = element['value'] * circuit.element_voltage(Xdot, element)
+            elif kind == 'I':
+                current = -element['value'] * (on if element.get('waveform') == 'step' else np.ones_like(t))
+            else:
+                current = circuit.element_current(X, element)
+            waveforms[element['name']] = {
+                'V': np.broadcast_to(voltage, t.shape).astype(float),
+                'I': np.broadcast_to(current, t.shape).astype(float)
+            }
+        return waveforms
+
+
+def run_numeric_transient(netlist_string, tstop=0.05, tstep=None, method='trap', adaptive=True, names=None):
+    """
+    Numeric transient analysis of a preprocessed (lcapy syntax) netlist.
+    Returns (t, waveforms, info) with waveforms[name] = {'V': array, 'I': array}
+    for the elements in names (default every element).
+    """
+    tstep = tstep or tstop / 999
+    circuit = MNACircuit(netlist_string)
+    simulator = TransientSimulator(circuit, method=method)
+    logger.info(f"Numeric transient: {len(circuit.nodes)} nodes, {len(circuit.branch_index)} branches, "
+                f"method={simulator.method}, tstop={tstop:g}, tstep={tstep:g}, adaptive={adaptive}")
+    t, X, Xdot = simulator.run(tstop, tstep, adaptive=adaptive)
+    info = {'engine': 'numeric', 'method': simulator.method, 'adaptive': adaptive,
+            'tstop': tstop, 'tstep': tstep, **simulator.stats}
+    logger.info(f"Numeric transient finished: {info}")
+    return t, simulator.element_waveforms(t, X, Xdot, names), info
@@ -0,0 +1,208 @@
+import logging
+import numpy as np
+from mna import MNACircuit, GROUND
+from netlist_source import load_netlist
+from circuit_ir import parse_circuit
+from metrics import timed
+
+# Setup logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+REPRESENTATIONS = ('z', 'y', 'h', 'abcd')
+PARAMETER_NAMES = {
+    'z': (('Z11', 'Z12'), ('Z21', 'Z22')),
+    'y': (('Y11', 'Y12'), ('Y21', 'Y22')),
+    'h': (('H11', 'H12'), ('H21', 'H22')),
+    'abcd': (('A', 'B'), ('C', 'D')),
+}
+# High-value resistor that references an otherwise floating network to ground
+GROUND_REFERENCE = 1e12
+
+
+def _entries(m):
+    return m[..., 0, 0], m[..., 0, 1], m[..., 1, 0], m[..., 1, 1]
+
+
+def _matrix(m11, m12, m21, m22):
+    return np.stack([np.stack([m11, m12], axis=-1), np.stack([m21, m22], axis=-1)], axis=-2)
+
+
+def _inverse(m):
+    m11, m12, m21, m22 = _entries(m)
+    det = m11 * m22 - m12 * m21
+    return _matrix(m22 / det, -m12 / det, -m21 / det, m11 / det)
+
+
+def _z_to_h(z):
+    z11, z12, z21, z22 = _entries(z)
+    return _matrix((z11 * z22 - z12 * z21) / z22, z12 / z22, -z21 / z22, 1 / z22)
+
+
+def _z_to_abcd(z):
+    z11, z12, z21, z22 = _entries(z)
+    return _matrix(z11 / z21, (z11 * z22 - z12 * z21) / z21, 1 / z21, z22 / z21)
+
+
+def _y_to_h(y):
+    y11, y12, y21, y22 = _entries(y)
+    return _matrix(1 / y11, -y12 / y11, y21 / y11, (y11 * y22 - y12 * y21) / y11)
+
+
+def _y_to_abcd(y):
+    y11, y12, y21, y22 = _entries(y)
+    return _matrix(-y22 / y21, -1 / y21, -(y11 * y22 - y12 * y21) / y21, -y11 / y21)
+
+
+def _h_to_z(h):
+    h11, h12, h21, h22 = _entries(h)
+    return _matrix((h11 * h22 - h12 * h21) / h22, h12 / h22, -h21 / h22, 1 / h22)
+
+
+def _h_to_y(h):
+    h11, h12, h21, h22 = _entries(h)
+    return _matrix(1 / h11, -h12 / h11, h21 / h11, (h11 * h22 - h12 * h21) / h11)
+
+
+def _abcd_to_z(t):
+    a, b, c, d = _entries(t)
+    return _matrix(a / c, (a * d - b * c) / c, 1 / c, d / c)
+
+
+def _abcd_to_y(t):
+    a, b, c, d = _entries(t)
+    return _matrix(d / b, -(a * d - b * c) / b, -1 / b, a / b)
+
+
+def _identity(m):
+    return m
+
+
+TO_Z = {'z': _identity, 'y': _inverse, 'h': _h_to_z, 'abcd': _abcd_to_z}
+TO_Y = {'z': _inverse, 'y': _identity, 'h': _h_to_y, 'abcd': _abcd_to_y}
+FROM_Z = {'z': _identity, 'y': _inverse, 'h': _z_to_h, 'abcd': _z_to_abcd}
+FROM_Y = {'z': _inverse, 'y': _identity, 'h': _y_to_h, 'abcd': _y_to_abcd}
+
+
+def convert_two_port(matrix, source, target):
+    """
+    Convert two-port parameters between 'z', 'y', 'h' and 'abcd'.
+
+    matrix has shape (..., 2, 2), typically (frequencies, 2, 2); every
+    frequency is converted at once with closed-form 2x2 formulas. The
+    conversion goes through Z where that exists and through Y otherwise;
+    entries of a representation that does not exist come out as nan/inf.
+    """
+    source, target = source.lower(), target.lower()
+    if source not in REPRESENTATIONS or target not in REPRESENTATIONS:
+        raise ValueError(f"Unknown two-port representation: {source} -> {target}")
+    matrix = np.asarray(matrix, dtype=complex)
+    if source == target:
+        return matrix.copy()
+    with np.errstate(all='ignore'):
+        via_z = FROM_Z[target](TO_Z[source](matrix))
+        via_y = FROM_Y[target](TO_Y[source](matrix))
+    return np.where(np.isfinite(via_z), via_z, via_y)
+
+
+def preprocess_netlist(netlist_string):
+    """
+    Netlist for the numeric two-port: wires become exact 0 V shorts and the
+    'f' / 'Ground' / 'Port' lines /parameter appends are dropped.
+    """
+    return parse_circuit(netlist_string).lowered(wires='short').to_netlist()
+
+
+class TwoPortExtractor:
+    """
+    Numeric two-port parameters of a linear netlist from port-excited MNA solves.
+
+    Z comes from injecting a unit current into each port (both excitations are
+    solved together as two right-hand sides of one factorization per
+    frequency). When the open-circuit system is singular - e.g. a series
+    element between the ports - the ports are driven by 0/1 V sources
+    instead and Y is read from the source currents. Independent sources
+    inside the network are zeroed, as the parameters require.
+    """
+
+    def __init__(self, netlist_string, p1n1, p1n2, p2n1, p2n2):
+        self.ports = [(str(p1n1), str(p1n2)), (str(p2n1), str(p2n2))]
+        self.netlist = preprocess_netlist(netlist_string)
+        nodes = parse_circuit(self.netlist).node_names()
+        missing = [node for port in self.ports for node in port if node not in nodes and node != GROUND]
+        if missing:
+            raise ValueError(f"Port nodes not found in circuit: {missing}")
+        if GROUND not in nodes:
+            self.netlist += f'\nRgnd#ref {self.ports[0][1]} {GROUND} {GROUND_REFERENCE}'
+            logger.info(f"Added ground reference resistor at node {self.ports[0][1]}")
+
+    def _port_indices(self, circuit):
+        return [(circuit.node_index.get(p, -1), circuit.node_index.get(n, -1)) for p, n in self.ports]
+
+    def open_circuit_z(self, omegas):
+        circuit = MNACircuit(self.netlist)
+        B = np.zeros((circuit.size, 2), dtype=complex)
+        indices = self._port_indices(circuit)
+        for j, (p, n) in enumerate(indices):
+            if p >= 0:
+                B[p, j] += 1.0
+            if n >= 0:
+                B[n, j] -= 1.0
+        # Rows of X.T are the solutions of the two excitations; row i of Z is
+        # the voltage across port i for both of them
+        X = circuit.solve_ac(omegas, B).transpose(0, 2, 1)
+        return np.stack([circuit.node_voltage(X, p) - circuit.node_voltage(X, n) for p, n in indices], axis=-2)
+
+    def short_circuit_y(self, omegas):
+        sources = [f'V#port{i + 1} {p} {n} 0' for i, (p, n) in enumerate(self.ports)]
+        circuit = MNACircuit('\n'.join([self.netlist] + sources))
+        branches = [circuit.branch_index[f'V#port{i + 1}'] for i in range(2)]
+        B = np.zeros((circuit.size, 2), dtype=complex)
+        for j, branch in enumerate(branches):
+            B[branch, j] = 1.0
+        X = circuit.solve_ac(omegas, B)
+        # Source branch currents flow into the + terminal, i.e. out of the network
+        return np.stack([-X[:, branch, :] for branch in branches], axis=-2)
+
+    def extract(self, frequencies):
+        """Return {'z'|'y'|'h'|'abcd': array of shape (len(frequencies), 2, 2)}."""
+        omegas = 2 * np.pi * np.atleast_1d(np.asarray(frequencies, dtype=float))
+        try:
+            source, matrix = 'z', self.open_circuit_z(omegas)
+        except ValueError as e:
+            logger.info(f"Open-circuit solve failed ({e}), extracting Y with port sources")
+            source, matrix = 'y', self.short_circuit_y(omegas)
+        return {kind: convert_two_port(matrix, source, kind) for kind in REPRESENTATIONS}
+
+
+def _complex_value(value):
+    return complex(value) if np.isfinite(value) else None
+
+
+@timed('two_port')
+def run_two_port(frequencies, p1n1, p1n2, p2n1, p2n2, netlist_filename='netlist.txt', netlist=None):
+    """
+    Z, Y, H and ABCD parameters for a frequency or an array of frequencies.
+
+    Returns {'frequencies': [...], 'z': {'Z11': [...], ...}, 'y': ..., 'h': ...,
+    'abcd': {'A': [...], ...}, 'reciprocal': bool} with one complex per
+    frequency (None where a representation does not exist).
+    """
+    netlist_string = load_netlist(netlist, netlist_filename)
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=float))
+    extractor = TwoPortExtractor(netlist_string, p1n1, p1n2, p2n1, p2n2)
+    params = extractor.extract(frequencies)
+
+    result = {'frequencies': frequencies.tolist()}
+    for kind, matrix in params.items():
+        result[kind] = {PARAMETER_NAMES[kind][i][j]: [_complex_value(v) for v in matrix[:, i, j]]
+                        for i in range(2) for j in range(2)}
+    z = params['z']
+    y = params['y']
+    with np.errstate(invalid='ignore'):
+        reciprocal_z = np.abs(z[:, 0, 1] - z[:, 1, 0]) <= 1e-9 * np.maximum(np.abs(z[:, 0, 1]), 1e-300)
+        reciprocal_y = np.abs(y[:, 0, 1] - y[:, 1, 0]) <= 1e-9 * np.maximum(np.abs(y[:, 0, 1]), 1e-300)
+    result['reciprocal'] = bool(np.all(reciprocal_z | reciprocal_y))
+    logger.info(f"Two-port extracted at {len(frequencies)} frequencies")
+    return result
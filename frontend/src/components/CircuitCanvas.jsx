@@ -644,27 +644,14 @@ const CircuitCanvas = () => {
       }
     }
   };
-  const generateNetlist = async () => {
-    try {
-      const response = await fetch('https://circuit-simulator.onrender.com/generate-netlist', {
-        method: 'POST',
-        headers: { 
-          'Content-Type': 'application/json',
-          'Accept': 'application/json',
-        },
-        body: JSON.stringify({})
-      });
-      if (!response.ok) {
-        const errorText = await response.text();
-        throw new Error(`Failed to generate netlist: ${errorText}`);
-      }
-      const data = await response.json();
-      console.log('Received netlist:', data);
-      setNetlist(data.netlist);
-    } catch (error) {
-      console.error('Error generating netlist:', error);
-      alert('Failed to generate netlist. Please check the console for details.');
+  const generateNetlist = () => {
+    // Every /simulation and /parameter response carries the netlist it ran
+    const latest = simData?.netlist ?? parametervalue?.netlist;
+    if (!latest) {
+      toast.info("Run a simulation first to see its netlist.");
+      return;
     }
+    setNetlist(latest);
   };
   const renderZParameterMatrix = () => {
     if (!parametervalue || !parametervalue.parameters || !parametervalue.parameters.numeric) return null;
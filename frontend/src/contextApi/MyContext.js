@@ -406,8 +406,12 @@ const sendSimulationData = async () => {
       popup.document.close();
       return;
     }
-    // For AC and Transient analysis, fetch and display images
-    const apiUrl = `https://circuit-simulator.onrender.com/get-images/${analysisType}`;
+    // For AC and Transient analysis, fetch and display the images of this simulation's result
+    if (!simData?.plot_key) {
+      toast.error('No simulation results available. Please run the simulation first.');
+      return;
+    }
+    const apiUrl = `https://circuit-simulator.onrender.com/get-images/${analysisType}?key=${simData.plot_key}`;
     fetch(apiUrl)
       .then(response => {
         if (!response.ok) {
@@ -460,7 +464,11 @@ const sendSimulationData = async () => {
       toast.error('Switch to S-parameter to view S plots.');
       return;
     }
-    const apiUrl = `https://circuit-simulator.onrender.com/get-images/s`;
+    if (!parametervalue?.plot_key) {
+      toast.error('No S-parameter plots available. Evaluate parameters first.');
+      return;
+    }
+    const apiUrl = `https://circuit-simulator.onrender.com/get-images/s?key=${parametervalue.plot_key}`;
     fetch(apiUrl)
       .then(response => {
         if (!response.ok) {